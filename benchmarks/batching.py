@@ -0,0 +1,152 @@
+"""
+Throughput and latency of ``selfie_seg`` elements of several streams
+sharing one graph, by batch window and maximum batch size.
+
+  $ python benchmarks/batching.py
+  $ python benchmarks/batching.py --streams 8 --live
+
+Streams run as fast as they can by default. With --live they produce frames
+at 30 fps, like cameras would. Added latency is relative to the first
+variant, which only batches frames that are waiting already.
+"""
+import time
+import typing as t
+
+import click
+
+from webcam_filters.stats import percentile
+
+from common import test_src, run, print_table
+
+
+VARIANTS = [
+    (0, 8),
+    (2, 8),
+    (5, 8),
+    (10, 8),
+    (5, 2),
+    (5, 4),
+    (0, 1),
+]
+
+
+def measure(
+    streams: int,
+    window: int,
+    max_batch: int,
+    width: int,
+    height: int,
+    num_buffers: int,
+    live: bool,
+) -> t.Tuple[float, t.List[float]]:
+    """
+    Return the frames per second segmented by all streams together and the
+    milliseconds each frame took from its source to its sink.
+    """
+    pushed: t.Dict[t.Tuple[int, int], float] = {}
+    latencies: t.List[float] = []
+    arrived: t.List[float] = []
+
+    def on_push(i):
+        def probe(buf):
+            pushed[(i, buf.pts)] = time.perf_counter()
+
+        return probe
+
+    def on_arrive(i):
+        def probe(buf):
+            now = time.perf_counter()
+            arrived.append(now)
+
+            start = pushed.pop((i, buf.pts), None)
+            if start is not None:
+                latencies.append((now - start) * 1000)
+
+        return probe
+
+    description = " ".join(
+        f"{test_src(width, height, num_buffers, name=f'src{i}', is_live=live)} ! "
+        f"queue ! "
+        f"selfie_seg shared-graph=true batch-window={window} "
+        f"max-batch={max_batch} inference-width=256 ! "
+        f"fakesink name=sink{i} sync=false"
+        for i in range(streams)
+    )
+
+    probes = {}
+    for i in range(streams):
+        probes[(f"src{i}", "src")] = on_push(i)
+        probes[(f"sink{i}", "sink")] = on_arrive(i)
+
+    run(description, probes)
+
+    if len(arrived) < 2:
+        raise RuntimeError("not enough frames reached the sinks")
+
+    # From the first frame on, so loading the model isn't included.
+    arrived.sort()
+    fps = (len(arrived) - 1) / (arrived[-1] - arrived[0])
+
+    return fps, latencies
+
+
+@click.command()
+@click.option("--streams", type=click.IntRange(min=1), default=4, show_default=True)
+@click.option("--num-buffers", type=int, default=150, show_default=True)
+@click.option("--width", type=int, default=1280, show_default=True)
+@click.option("--height", type=int, default=720, show_default=True)
+@click.option(
+    "--live",
+    is_flag=True,
+    help="Produce frames at 30 fps instead of as fast as possible.",
+)
+def main(
+    streams: int,
+    num_buffers: int,
+    width: int,
+    height: int,
+    live: bool,
+) -> None:
+    rows = []
+    baseline = None
+
+    for window, max_batch in VARIANTS:
+        fps, latencies = measure(
+            streams,
+            window,
+            max_batch,
+            width,
+            height,
+            num_buffers,
+            live,
+        )
+
+        p50 = percentile(latencies, 50)
+        if baseline is None:
+            baseline = p50
+
+        rows.append((
+            window,
+            max_batch,
+            fps,
+            p50,
+            percentile(latencies, 95),
+            p50 - baseline,
+        ))
+
+    print_table(
+        f"selfie_seg, {streams} streams sharing a graph",
+        [
+            "batch-window ms",
+            "max-batch",
+            "frames/s",
+            "p50 ms",
+            "p95 ms",
+            "added p50 ms",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Milliseconds per frame of ``cv2_boxfilter`` across kernel sizes, blurring at
+full resolution and at an automatically picked lower resolution.
+
+  $ python benchmarks/boxfilter.py
+  $ python benchmarks/boxfilter.py --n-threads 8
+"""
+import click
+
+from common import test_src, ms_per_frame, print_table
+
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (3840, 2160)]
+
+KSIZES = [10, 25, 50, 100, 150, 200]
+
+
+@click.command()
+@click.option("--num-buffers", type=int, default=300, show_default=True)
+@click.option("--n-threads", type=int, default=1, show_default=True)
+def main(num_buffers: int, n_threads: int) -> None:
+    rows = []
+
+    for width, height in RESOLUTIONS:
+        for ksize in KSIZES:
+            full, scaled = (
+                ms_per_frame(
+                    f"{test_src(width, height, num_buffers)} ! "
+                    f"cv2_boxfilter ksize={ksize} downscale={downscale} "
+                    f"n-threads={n_threads} ! "
+                    f"fakesink name=sink sync=false"
+                )
+                for downscale in (1, 0)
+            )
+            rows.append((f"{width}x{height}", ksize, full, scaled))
+
+    print_table(
+        f"cv2_boxfilter, {n_threads} thread(s)",
+        ["Input", "ksize", "full ms/frame", "downscaled ms/frame"],
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks drive the real GStreamer elements with ``videotestsrc`` so they can
+run without a webcam or v4l2loopback device.
+"""
+import time
+import typing as t
+
+from webcam_filters.gst import init, Gst
+
+
+def test_src(
+    width: int,
+    height: int,
+    num_buffers: int,
+    pattern: str = "smpte",
+    format_: str = "RGB",
+    name: str = "src",
+    is_live: bool = False,
+) -> str:
+    """
+    Return a pipeline description fragment for a raw video test source.
+    """
+    return (
+        f"videotestsrc name={name} num-buffers={num_buffers} "
+        f"pattern={pattern} is-live={str(is_live).lower()} ! "
+        f"video/x-raw, format={format_}, width={width}, height={height}, "
+        f"framerate=30/1"
+    )
+
+
+def run(
+    description: str,
+    probes: t.Mapping[t.Tuple[str, str], t.Callable[[Gst.Buffer], None]],
+) -> None:
+    """
+    Run the pipeline description to EOS, calling probes[(element, pad)] with
+    every buffer that passes that pad.
+    """
+    init()
+
+    pipeline = Gst.parse_launch(description)
+
+    def make_probe(callback):
+        def probe(pad, info):
+            callback(info.get_buffer())
+            return Gst.PadProbeReturn.OK
+
+        return probe
+
+    for (element, pad), callback in probes.items():
+        pipeline.get_by_name(element).get_static_pad(pad).add_probe(
+            Gst.PadProbeType.BUFFER,
+            make_probe(callback),
+        )
+
+    pipeline.set_state(Gst.State.PLAYING)
+
+    bus = pipeline.get_bus()
+    msg = bus.timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE,
+        Gst.MessageType.EOS | Gst.MessageType.ERROR
+    )
+
+    pipeline.set_state(Gst.State.NULL)
+
+    if msg.type == Gst.MessageType.ERROR:
+        gerror, debug = msg.parse_error()
+        raise RuntimeError(f"pipeline failed: {gerror.message}\n{debug}")
+
+
+def ms_per_frame(description: str) -> float:
+    """
+    Run the pipeline description to EOS and return the mean milliseconds
+    between frames arriving at the sink named ``sink``.
+
+    The first frame is used as the starting point so element start up costs
+    (e.g. model loading) are not included.
+    """
+    stamps: t.List[float] = []
+
+    run(
+        description,
+        {("sink", "sink"): lambda buf: stamps.append(time.perf_counter())}
+    )
+
+    if len(stamps) < 2:
+        raise RuntimeError("not enough frames reached the sink")
+
+    return (stamps[-1] - stamps[0]) * 1000 / (len(stamps) - 1)
+
+
+def latencies_ms(description: str) -> t.List[float]:
+    """
+    Run the pipeline description to EOS and return the milliseconds each
+    frame took from the src pad of the element named ``src`` to the sink
+    named ``sink``.
+    """
+    pushed: t.Dict[int, float] = {}
+    result: t.List[float] = []
+
+    def on_push(buf):
+        pushed[buf.pts] = time.perf_counter()
+
+    def on_arrive(buf):
+        start = pushed.pop(buf.pts, None)
+        if start is not None:
+            result.append((time.perf_counter() - start) * 1000)
+
+    run(description, {("src", "src"): on_push, ("sink", "sink"): on_arrive})
+
+    return result
+
+
+def print_table(
+    title: str,
+    columns: t.Sequence[str],
+    rows: t.Iterable[t.Sequence[t.Any]],
+) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title=title)
+
+    for c in columns:
+        table.add_column(c)
+
+    for r in rows:
+        table.add_row(*(f"{x:.2f}" if isinstance(x, float) else str(x) for x in r))
+
+    Console().print(table)
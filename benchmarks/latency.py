@@ -0,0 +1,72 @@
+"""
+End-to-end latency of the background blur graph (tee, selfie_seg and
+background_blur) against the fused selfie_blur element, fed by a live 30fps
+source.
+
+  $ python benchmarks/latency.py
+"""
+import click
+
+from webcam_filters.stats import percentile
+
+from common import test_src, latencies_ms, print_table
+
+
+GRAPHS = [
+    (
+        "selfie_seg + background_blur",
+        "tee name=t "
+        "t. ! queue ! selfie_seg {selfie} ! video/x-raw, format=GRAY8 ! "
+        "blur.mask "
+        "t. ! blur.frame "
+        "background_blur name=blur ksize={ksize} ! "
+        "fakesink name=sink sync=false",
+    ),
+    (
+        "selfie_blur (fused)",
+        "selfie_blur {selfie} ksize={ksize} ! fakesink name=sink sync=false",
+    ),
+]
+
+
+@click.command()
+@click.option("--num-buffers", type=int, default=300, show_default=True)
+@click.option("--width", type=int, default=1280, show_default=True)
+@click.option("--height", type=int, default=720, show_default=True)
+@click.option("--ksize", type=int, default=150, show_default=True)
+@click.option(
+    "--selfie-props",
+    default="inference-width=256",
+    show_default=True,
+    help="Properties set on the segmentation element.",
+)
+def main(
+    num_buffers: int,
+    width: int,
+    height: int,
+    ksize: int,
+    selfie_props: str,
+) -> None:
+    rows = []
+
+    for name, graph in GRAPHS:
+        latencies = latencies_ms(
+            f"{test_src(width, height, num_buffers, is_live=True)} ! "
+            + graph.format(selfie=selfie_props, ksize=ksize)
+        )
+        rows.append((
+            name,
+            percentile(latencies, 50),
+            percentile(latencies, 95),
+            percentile(latencies, 99),
+        ))
+
+    print_table(
+        f"Latency at {width}x{height}",
+        ["Graph", "p50 ms", "p95 ms", "p99 ms"],
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main()
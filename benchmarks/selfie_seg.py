@@ -0,0 +1,41 @@
+"""
+Milliseconds per frame of ``selfie_seg`` at full and reduced inference
+resolution.
+
+  $ python benchmarks/selfie_seg.py
+"""
+import click
+
+from common import test_src, ms_per_frame, print_table
+
+
+RESOLUTIONS = [(1280, 720), (1920, 1080)]
+
+VARIANTS = [
+    ("full resolution", "inference-width=0 inference-height=0"),
+    ("256 wide, nearest", "inference-width=256 interpolation=0"),
+    ("256 wide, bilinear", "inference-width=256 interpolation=1"),
+    ("256 wide, edge-aware", "inference-width=256 interpolation=2"),
+]
+
+
+@click.command()
+@click.option("--num-buffers", type=int, default=300, show_default=True)
+@click.option("--model", type=click.IntRange(0, 1), default=0, show_default=True)
+def main(num_buffers: int, model: int) -> None:
+    rows = []
+
+    for width, height in RESOLUTIONS:
+        for name, props in VARIANTS:
+            ms = ms_per_frame(
+                f"{test_src(width, height, num_buffers)} ! "
+                f"selfie_seg model={model} {props} ! "
+                f"fakesink name=sink sync=false"
+            )
+            rows.append((f"{width}x{height}", name, ms))
+
+    print_table("selfie_seg", ["Input", "Inference", "ms/frame"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Start up time of the CLI and of GStreamer with and without the Python
+plugins, each measured in a fresh interpreter.
+
+  $ python benchmarks/startup.py
+  $ python benchmarks/startup.py --importtime
+
+--importtime also lists the slowest imports of ``webcam_filters.main`` as
+reported by ``python -X importtime``.
+"""
+import sys
+import time
+import statistics
+import subprocess
+
+import click
+
+from common import print_table
+
+
+CASES = [
+    ("webcam-filters --version", ["-m", "webcam_filters", "--version"]),
+    ("webcam-filters --help", ["-m", "webcam_filters", "--help"]),
+    (
+        "passthrough (GStreamer only)",
+        [
+            "-c",
+            "from webcam_filters.gst import init, make_element; "
+            "init(load_plugins=False); make_element('videoconvert')",
+        ],
+    ),
+    (
+        "blur (Python plugins)",
+        [
+            "-c",
+            "from webcam_filters.gst import init, make_element; "
+            "init(); make_element('selfie_seg')",
+        ],
+    ),
+]
+
+
+def wall_ms(args) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable] + args,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def slowest_imports(module: str, count: int):
+    """
+    Return (cumulative ms, self ms, package) of the count slowest imports of
+    module.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, package = line[len("import time:"):].split("|")
+        rows.append((
+            int(cumulative_us) / 1000,
+            int(self_us) / 1000,
+            package.rstrip(),
+        ))
+
+    return sorted(rows, reverse=True)[:count]
+
+
+@click.command()
+@click.option("--runs", type=click.IntRange(min=1), default=5, show_default=True)
+@click.option(
+    "--importtime",
+    is_flag=True,
+    help="Also list the slowest imports of the CLI.",
+)
+@click.option("--top", type=int, default=20, show_default=True)
+def main(runs: int, importtime: bool, top: int) -> None:
+    rows = []
+
+    for name, args in CASES:
+        # The first run (re)builds the GStreamer registry, so it's excluded.
+        wall_ms(args)
+        times = [wall_ms(args) for _ in range(runs)]
+        rows.append((name, statistics.median(times), min(times)))
+
+    print_table("Start up", ["Case", "median ms", "min ms"], rows)
+
+    if importtime:
+        print_table(
+            "Slowest imports of webcam_filters.main",
+            ["cumulative ms", "self ms", "package"],
+            slowest_imports("webcam_filters.main", top),
+        )
+
+
+if __name__ == "__main__":
+    main()
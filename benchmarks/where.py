@@ -0,0 +1,49 @@
+"""
+Milliseconds per frame of ``numpy_where`` in select and blend mode.
+
+  $ python benchmarks/where.py
+  $ python benchmarks/where.py --n-threads 8
+"""
+import click
+
+from common import test_src, ms_per_frame, print_table
+
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (3840, 2160)]
+
+VARIANTS = [
+    ("select, RGB condition", "mode=0", "RGB"),
+    ("select, GRAY8 condition", "mode=0", "GRAY8"),
+    ("blend, GRAY8 alpha", "mode=1", "GRAY8"),
+]
+
+
+@click.command()
+@click.option("--num-buffers", type=int, default=300, show_default=True)
+@click.option("--n-threads", type=int, default=1, show_default=True)
+def main(num_buffers: int, n_threads: int) -> None:
+    rows = []
+
+    for width, height in RESOLUTIONS:
+        for name, props, condition_format in VARIANTS:
+            ms = ms_per_frame(
+                f"numpy_where name=where {props} n-threads={n_threads} ! "
+                f"fakesink name=sink sync=false "
+                f"{test_src(width, height, num_buffers, 'ball', condition_format, 'c')} ! "
+                f"where.condition "
+                f"{test_src(width, height, num_buffers, 'white', name='x')} ! "
+                f"where.x "
+                f"{test_src(width, height, num_buffers, 'black', name='y')} ! "
+                f"where.y"
+            )
+            rows.append((f"{width}x{height}", name, ms))
+
+    print_table(
+        f"numpy_where, {n_threads} thread(s)",
+        ["Input", "Mode", "ms/frame"],
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Matching the inputs of aggregators by pts.
+"""
+import collections
+
+import pytest
+
+pytest.importorskip("gi")
+
+from webcam_filters.aggregation import pop_matching, still_coming
+from webcam_filters.gst import Gst
+
+
+Buffer = collections.namedtuple("Buffer", "pts")
+
+
+class Pad:
+    """
+    The parts of a GstBase.AggregatorPad the matching uses.
+    """
+
+    def __init__(self, *pts, eos=False):
+        self.buffers = collections.deque(Buffer(x) for x in pts)
+        self.eos = eos
+
+    def peek_buffer(self):
+        return self.buffers[0] if self.buffers else None
+
+    def drop_buffer(self):
+        self.buffers.popleft()
+
+    def has_buffer(self):
+        return bool(self.buffers)
+
+    def is_eos(self):
+        return self.eos
+
+
+def test_matching_buffer_is_popped():
+    pad = Pad(1, 2)
+
+    assert pop_matching(pad, 1) == (Buffer(1), None)
+    assert list(pad.buffers) == [Buffer(2)]
+
+
+def test_older_buffers_are_dropped():
+    pad = Pad(1, 2, 3, 4)
+
+    assert pop_matching(pad, 3) == (Buffer(3), Buffer(2))
+    assert list(pad.buffers) == [Buffer(4)]
+
+
+def test_newer_buffers_are_held():
+    pad = Pad(1, 3)
+
+    assert pop_matching(pad, 2) == (None, Buffer(1))
+    assert list(pad.buffers) == [Buffer(3)]
+
+
+def test_missing_buffer():
+    assert pop_matching(Pad(), 1) == (None, None)
+
+
+def test_untimestamped_buffers_are_taken_in_order():
+    assert pop_matching(Pad(5), Gst.CLOCK_TIME_NONE) == (Buffer(5), None)
+    assert pop_matching(
+        Pad(Gst.CLOCK_TIME_NONE),
+        5
+    ) == (Buffer(Gst.CLOCK_TIME_NONE), None)
+
+
+def test_still_coming():
+    assert still_coming(Pad(), timeout=False)
+    assert not still_coming(Pad(), timeout=True)
+    assert not still_coming(Pad(eos=True), timeout=False)
+    assert not still_coming(Pad(1), timeout=False)
@@ -0,0 +1,95 @@
+"""
+copied-bytes of the in-place elements, run on real GStreamer pipelines.
+"""
+import pytest
+
+pytest.importorskip("gi")
+
+from webcam_filters.gst import init, Gst
+
+
+WIDTH = 64
+HEIGHT = 48
+NUM_BUFFERS = 3
+
+SRC = (
+    f"videotestsrc num-buffers={NUM_BUFFERS} ! "
+    f"video/x-raw, format=RGB, width={WIDTH}, height={HEIGHT}, "
+    "framerate=30/1"
+)
+
+
+def copied_bytes(description: str) -> int:
+    """
+    Run the pipeline description to EOS and return the copied-bytes of the
+    element named ``filter``.
+    """
+    init()
+
+    pipeline = Gst.parse_launch(description)
+    pipeline.set_state(Gst.State.PLAYING)
+
+    msg = pipeline.get_bus().timed_pop_filtered(
+        10 * Gst.SECOND,
+        Gst.MessageType.EOS | Gst.MessageType.ERROR
+    )
+
+    pipeline.set_state(Gst.State.NULL)
+
+    assert msg is not None and msg.type == Gst.MessageType.EOS
+
+    return pipeline.get_by_name("filter").get_property("copied-bytes")
+
+
+def test_writable_buffers_are_not_copied():
+    assert copied_bytes(
+        f"{SRC} ! cv2_boxfilter name=filter ksize=3 ! fakesink"
+    ) == 0
+
+
+def test_copy_of_non_writable_buffer_is_counted():
+    # Both branches of the tee hold a reference to each buffer, so it isn't
+    # writable and has to be copied before blurring it in place.
+    copied = copied_bytes(
+        f"{SRC} ! tee name=t "
+        "t. ! queue ! cv2_boxfilter name=filter ksize=3 ! fakesink "
+        "t. ! queue ! fakesink"
+    )
+
+    assert copied >= WIDTH * 3 * HEIGHT
+
+
+MASK = (
+    f"videotestsrc num-buffers={NUM_BUFFERS} pattern=black ! "
+    f"video/x-raw, format=GRAY8, width={WIDTH}, height={HEIGHT}, "
+    "framerate=30/1"
+)
+
+
+def test_background_blur_blurs_writable_frames_in_place():
+    assert copied_bytes(
+        f"background_blur name=filter ksize=3 ! fakesink "
+        f"{SRC} ! filter.frame "
+        f"{MASK} ! filter.mask"
+    ) == 0
+
+
+def test_background_blur_copies_shared_frames():
+    copied = copied_bytes(
+        f"background_blur name=filter ksize=3 ! fakesink "
+        f"{SRC} ! tee name=t "
+        "t. ! queue ! filter.frame "
+        "t. ! queue ! fakesink "
+        f"{MASK} ! filter.mask"
+    )
+
+    assert copied >= WIDTH * 3 * HEIGHT
+
+
+@pytest.mark.parametrize("format_", ["I420", "NV12"])
+def test_background_blur_blurs_yuv_frames_in_place(format_):
+    assert copied_bytes(
+        f"background_blur name=filter ksize=3 ! fakesink "
+        f"{SRC.replace('RGB', format_)} ! filter.frame "
+        f"{MASK} ! filter.mask"
+    ) == 0
@@ -0,0 +1,93 @@
+"""
+The on-disk cache of device caps.
+"""
+import pytest
+
+pytest.importorskip("gi")
+
+from webcam_filters import caps_cache
+from webcam_filters.gst import init, Gst
+
+
+CAPS = "video/x-raw, format=(string)YUY2, width=(int)640, height=(int)480"
+
+
+@pytest.fixture()
+def devices(monkeypatch):
+    """
+    Fingerprints of fake devices by path, which tests can change.
+    """
+    init()
+
+    fingerprints = {}
+
+    def device_fingerprint(device):
+        try:
+            return fingerprints[device]
+        except KeyError:
+            raise FileNotFoundError(device)
+
+    monkeypatch.setattr(
+        caps_cache.v4l2,
+        "device_fingerprint",
+        device_fingerprint
+    )
+
+    return fingerprints
+
+
+def test_stored_caps_are_loaded(devices, tmp_path):
+    path = tmp_path / "caps.json"
+    devices["/dev/video0"] = "uvcvideo/cam/usb-1/1"
+
+    caps_cache.store("/dev/video0", Gst.Caps.from_string(CAPS), path)
+
+    assert caps_cache.load("/dev/video0", path).is_equal(
+        Gst.Caps.from_string(CAPS)
+    )
+
+
+def test_changed_device_invalidates_its_caps(devices, tmp_path):
+    path = tmp_path / "caps.json"
+    devices["/dev/video0"] = "uvcvideo/cam/usb-1/1"
+    caps_cache.store("/dev/video0", Gst.Caps.from_string(CAPS), path)
+
+    devices["/dev/video0"] = "uvcvideo/other cam/usb-1/1"
+
+    assert caps_cache.load("/dev/video0", path) is None
+
+
+def test_devices_are_cached_separately(devices, tmp_path):
+    path = tmp_path / "caps.json"
+    devices["/dev/video0"] = "a"
+    devices["/dev/video1"] = "b"
+
+    caps_cache.store("/dev/video0", Gst.Caps.from_string(CAPS), path)
+    caps_cache.store("/dev/video1", Gst.Caps.from_string("video/x-raw"), path)
+
+    assert caps_cache.load("/dev/video0", path).is_equal(
+        Gst.Caps.from_string(CAPS)
+    )
+    assert len(caps_cache.read(path)) == 2
+
+
+def test_devices_without_fingerprint_are_not_cached(devices, tmp_path):
+    path = tmp_path / "caps.json"
+
+    caps_cache.store("/dev/video9", Gst.Caps.from_string(CAPS), path)
+
+    assert not path.exists()
+    assert caps_cache.load("/dev/video9", path) is None
+
+
+@pytest.mark.parametrize("contents", ["", "{", "[]", '{"/dev/video0": 1}'])
+def test_bad_cache_files_are_ignored(devices, tmp_path, contents):
+    path = tmp_path / "caps.json"
+    path.write_text(contents)
+    devices["/dev/video0"] = "a"
+
+    assert caps_cache.load("/dev/video0", path) is None
+
+    caps_cache.store("/dev/video0", Gst.Caps.from_string(CAPS), path)
+
+    assert caps_cache.load("/dev/video0", path) is not None
@@ -0,0 +1,69 @@
+"""
+Parsing input and output URIs and checking their query parameters.
+"""
+import pytest
+
+pytest.importorskip("gi")
+
+from webcam_filters.endpoints import (
+    SINK_SCHEMES,
+    SOURCE_SCHEMES,
+    Endpoint,
+    check_params,
+    parse_endpoint,
+)
+from webcam_filters.gst import init, Gst
+
+
+def test_bare_path_is_a_v4l2_device():
+    assert parse_endpoint("/dev/video3?throttle-time=20", SINK_SCHEMES) == (
+        Endpoint("v4l2", "/dev/video3", {"throttle-time": "20"})
+    )
+
+
+def test_uri_location_and_params():
+    assert parse_endpoint("file:///tmp/in.mkv", SOURCE_SCHEMES) == (
+        Endpoint("file", "/tmp/in.mkv", {})
+    )
+    assert parse_endpoint("fd://3", SOURCE_SCHEMES) == Endpoint("fd", "3", {})
+    assert parse_endpoint("appsink://?max-buffers=5", SINK_SCHEMES) == (
+        Endpoint("appsink", "", {"max-buffers": "5"})
+    )
+
+
+@pytest.mark.parametrize("value", [
+    "appsink://frames",
+    "http://example.com/video",
+    "file://",
+    "fd://stdin",
+])
+def test_invalid_inputs_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_endpoint(value, SOURCE_SCHEMES)
+
+
+def test_params_that_are_properties_pass():
+    init()
+
+    check_params(Endpoint("file", "/tmp/out.mkv", {"sync": "false"}), True)
+    check_params(Endpoint("fd", "0", {"blocksize": "4096"}), False)
+
+
+def test_unknown_params_are_rejected():
+    init()
+
+    with pytest.raises(ValueError, match="no property 'bogus'"):
+        check_params(Endpoint("file", "/tmp/out.mkv", {"bogus": "1"}), True)
+
+
+def test_shm_input_caps_params_are_not_properties():
+    init()
+
+    if Gst.ElementFactory.find("shmsrc") is None:
+        pytest.skip("shmsrc isn't available")
+
+    params = {"format": "I420", "width": "640", "is-live": "true"}
+    check_params(Endpoint("shm", "/tmp/socket", params), False)
+
+    with pytest.raises(ValueError):
+        check_params(Endpoint("shm", "/tmp/socket", {"bogus": "1"}), False)
@@ -0,0 +1,142 @@
+"""
+Image operations shared by the filter elements.
+"""
+import cv2
+import numpy
+
+from webcam_filters.image import (
+    MAX_AUTO_DOWNSCALE,
+    auto_downscale,
+    background_regions,
+    blend,
+    box_blur,
+    merge_regions,
+)
+
+
+def blend_arrays(alpha, x, y):
+    height, width = alpha.shape[:2]
+    res = numpy.empty_like(x)
+    a = numpy.empty((height, width, 1), numpy.int16)
+    d = numpy.empty(x.shape, numpy.int16)
+
+    blend(alpha, x, y, res, a, d)
+
+    return res
+
+
+def random_frame(rng):
+    return rng.integers(0, 256, (8, 8, 3), dtype=numpy.uint8)
+
+
+def test_blend_opaque_and_transparent_alpha_are_exact():
+    rng = numpy.random.default_rng(0)
+    x = random_frame(rng)
+    y = random_frame(rng)
+
+    opaque = numpy.full((8, 8, 1), 255, numpy.uint8)
+    transparent = numpy.zeros((8, 8, 1), numpy.uint8)
+
+    assert numpy.array_equal(blend_arrays(opaque, x, y), x)
+    assert numpy.array_equal(blend_arrays(transparent, x, y), y)
+
+
+def test_blend_is_close_to_float_blend():
+    rng = numpy.random.default_rng(0)
+    x = random_frame(rng)
+    y = random_frame(rng)
+    alpha = rng.integers(0, 256, (8, 8, 1), dtype=numpy.uint8)
+
+    expected = y + (x.astype(float) - y) * alpha / 255
+    res = blend_arrays(alpha, x, y)
+
+    # Off by at most the 7-bit rounding of alpha and the truncated product.
+    assert numpy.abs(res - expected).max() < 3
+
+
+def test_blend_into_an_input():
+    rng = numpy.random.default_rng(0)
+    x = random_frame(rng)
+    y = random_frame(rng)
+    alpha = rng.integers(0, 256, (8, 8, 1), dtype=numpy.uint8)
+
+    expected = blend_arrays(alpha, x, y)
+
+    a = numpy.empty((8, 8, 1), numpy.int16)
+    d = numpy.empty((8, 8, 3), numpy.int16)
+    blend(alpha, x, y, y, a, d)
+
+    assert numpy.array_equal(y, expected)
+
+
+def test_auto_downscale_is_bounded():
+    assert auto_downscale(0) == 1
+    assert auto_downscale(5) == 1
+    assert auto_downscale(200) == MAX_AUTO_DOWNSCALE
+
+
+def test_box_blur_at_full_resolution_is_a_box_filter():
+    rng = numpy.random.default_rng(0)
+    src = rng.integers(0, 256, (32, 48, 3), dtype=numpy.uint8)
+    dst = numpy.empty_like(src)
+
+    box_blur(src, dst, 5)
+
+    assert numpy.array_equal(dst, cv2.boxFilter(src, -1, (5, 5)))
+
+
+def test_box_blur_downscaled_keeps_size_and_flat_colour():
+    src = numpy.full((30, 50, 3), 77, numpy.uint8)
+    dst = numpy.empty_like(src)
+
+    box_blur(src, dst, 9, 4)
+
+    assert numpy.array_equal(dst, src)
+
+
+def test_box_blur_in_place():
+    rng = numpy.random.default_rng(0)
+    src = rng.integers(0, 256, (32, 48, 3), dtype=numpy.uint8)
+    expected = numpy.empty_like(src)
+
+    box_blur(src, expected, 9, 2)
+    box_blur(src, src, 9, 2)
+
+    assert numpy.array_equal(src, expected)
+
+
+def test_foreground_mask_has_no_background_regions():
+    mask = numpy.full((64, 32), 255, numpy.uint8)
+
+    assert background_regions(mask, 16) == []
+
+
+def test_background_regions_cover_background_in_whole_bands():
+    mask = numpy.full((64, 32), 255, numpy.uint8)
+    mask[20:24, 5:10] = 0
+    mask[50:52, 30] = 128
+
+    # Rows are rounded out to bands, columns cropped to the background.
+    assert background_regions(mask, 16) == [(16, 32, 5, 10), (48, 64, 30, 31)]
+
+
+def test_adjacent_background_bands_are_one_region():
+    mask = numpy.full((50, 32), 255, numpy.uint8)
+    mask[10:40, 2:4] = 0
+    mask[48, 20] = 0
+
+    # The last band is cut short at the bottom of the mask.
+    assert background_regions(mask, 16) == [(0, 50, 2, 21)]
+
+
+def test_close_regions_are_merged_into_their_bounding_box():
+    regions = [(0, 16, 10, 20), (20, 32, 0, 5), (32, 48, 30, 40)]
+
+    assert merge_regions(regions, 8) == [(0, 48, 0, 40)]
+
+
+def test_distant_regions_are_kept_apart():
+    regions = [(0, 16, 10, 20), (32, 48, 0, 5)]
+
+    assert merge_regions(regions, 16) == regions
+    assert merge_regions(regions, 17) == [(0, 48, 0, 20)]
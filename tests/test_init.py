@@ -0,0 +1,31 @@
+"""
+GStreamer initialisation around parsing the command line.
+"""
+import sys
+import subprocess
+
+import pytest
+
+pytest.importorskip("gi")
+
+
+# Parsing runs every eager callback, whether or not its option is given,
+# before the pipeline initialises GStreamer with the plugins. GStreamer is
+# only initialised once per process, so this runs in a process of its own.
+CHECK_PLUGINS = """
+from webcam_filters.main import cli
+from webcam_filters.gst import init, Gst
+
+cli.make_context(
+    "webcam-filters",
+    ["--input-dev", "/dev/video0", "--output-dev", "/dev/video3"],
+)
+init()
+
+for name in ("selfie_seg", "background_blur", "cv2_boxfilter", "selfie_blur"):
+    assert Gst.ElementFactory.find(name) is not None, name
+"""
+
+
+def test_plugins_found_after_parsing_without_list_dev_caps():
+    subprocess.run([sys.executable, "-c", CHECK_PLUGINS], check=True)
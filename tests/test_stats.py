@@ -0,0 +1,44 @@
+"""
+Pipeline statistics.
+"""
+import pytest
+
+pytest.importorskip("gi")
+
+from webcam_filters.gst import init, Gst
+from webcam_filters.stats import PipelineStats, percentile
+
+
+NUM_BUFFERS = 5
+
+
+def test_percentile():
+    values = list(range(100, 0, -1))
+
+    assert percentile(values, 0) == 1
+    assert percentile(values, 50) == 51
+    assert percentile(values, 99) == 100
+    assert percentile(values, 100) == 100
+    assert percentile([7.5], 95) == 7.5
+
+
+def test_frames_are_counted_per_sink():
+    init()
+
+    pipeline = Gst.parse_launch(
+        f"videotestsrc num-buffers={NUM_BUFFERS} ! tee name=t "
+        "t. ! queue ! fakesink name=a "
+        "t. ! queue ! fakesink name=b"
+    )
+    stats = PipelineStats(pipeline)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        10 * Gst.SECOND,
+        Gst.MessageType.EOS | Gst.MessageType.ERROR
+    )
+    pipeline.set_state(Gst.State.NULL)
+
+    assert msg is not None and msg.type == Gst.MessageType.EOS
+    assert stats.output_frames == {"a": NUM_BUFFERS, "b": NUM_BUFFERS}
+    assert set(stats.snapshot()["fps"]) == {"a", "b"}
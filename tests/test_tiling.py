@@ -0,0 +1,49 @@
+"""
+Splitting frames into bands and running work over them on a thread pool.
+"""
+import threading
+
+from webcam_filters.tiling import MIN_BAND_ROWS, Tiler, split_rows
+
+
+def test_bands_cover_every_row_once():
+    bands = split_rows(1080, 7)
+
+    assert len(bands) == 7
+    assert bands[0][0] == 0
+    assert bands[-1][1] == 1080
+    assert all(a[1] == b[0] for a, b in zip(bands, bands[1:]))
+    assert max(b - t for t, b in bands) - min(b - t for t, b in bands) <= 1
+
+
+def test_short_frames_get_fewer_bands():
+    assert split_rows(MIN_BAND_ROWS * 3, 8) == [
+        (0, MIN_BAND_ROWS),
+        (MIN_BAND_ROWS, 2 * MIN_BAND_ROWS),
+        (2 * MIN_BAND_ROWS, 3 * MIN_BAND_ROWS),
+    ]
+    assert split_rows(MIN_BAND_ROWS - 1, 8) == [(0, MIN_BAND_ROWS - 1)]
+
+
+def test_single_thread_runs_on_the_calling_thread():
+    tiler = Tiler(1)
+    threads = tiler.map(lambda i, top, bottom: threading.current_thread(), 480)
+
+    assert threads == [threading.current_thread()]
+    assert tiler._pool is None
+
+
+def test_results_are_in_band_order():
+    tiler = Tiler(4)
+
+    try:
+        assert tiler.map(lambda *band: band, 480) == [
+            (0, 0, 120),
+            (1, 120, 240),
+            (2, 240, 360),
+            (3, 360, 480),
+        ]
+    finally:
+        tiler.stop()
+
+    assert tiler._pool is None
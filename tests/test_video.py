@@ -0,0 +1,86 @@
+"""
+Layouts and numpy views of raw video frames.
+"""
+import numpy
+import pytest
+
+from webcam_filters.image import YUVFrame, channels, frame_planes
+from webcam_filters.video import frame_view, mask_view, video_layout
+
+
+@pytest.mark.parametrize("format_, offsets, strides, size", [
+    ("RGB", (0,), (16,), 48),
+    ("GRAY8", (0,), (8,), 24),
+    ("I420", (0, 32, 40), (8, 4, 4), 48),
+    ("NV12", (0, 32), (8, 8), 48),
+])
+def test_odd_sizes_are_padded_like_gstreamer(format_, offsets, strides, size):
+    layout = video_layout(format_, 5, 3)
+
+    assert layout.offsets == offsets
+    assert layout.strides == strides
+    assert layout.size == size
+
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        video_layout("YUY2", 4, 4)
+
+
+def test_rgb_view():
+    layout = video_layout("RGB", 5, 3)
+    data = numpy.arange(layout.size, dtype=numpy.uint8)
+    frame = frame_view(data, layout)
+
+    assert frame.shape == (3, 5, 3)
+    assert frame[1, 0, 0] == 16
+    assert frame_planes(frame) == [(frame, 1)]
+
+
+def test_i420_view():
+    layout = video_layout("I420", 5, 3)
+    data = numpy.arange(layout.size, dtype=numpy.uint8)
+    frame = frame_view(data, layout)
+
+    assert isinstance(frame, YUVFrame)
+    assert frame.y.shape == (3, 5)
+    assert frame.u.shape == frame.v.shape == (2, 3)
+    assert frame.u[1, 0] == 36
+    assert frame.v[0, 0] == 40
+    assert [s for _, s in frame_planes(frame)] == [1, 2, 2]
+
+
+def test_nv12_view():
+    layout = video_layout("NV12", 5, 3)
+    data = numpy.arange(layout.size, dtype=numpy.uint8)
+    frame = frame_view(data, layout)
+
+    assert frame.v is None
+    assert frame.u.shape == (2, 3, 2)
+    assert frame.u[1, 1].tolist() == [42, 43]
+    assert [s for _, s in frame_planes(frame)] == [1, 2]
+
+
+def test_views_write_through_to_the_data():
+    layout = video_layout("I420", 8, 4)
+    data = numpy.zeros(layout.size, numpy.uint8)
+
+    frame_view(data, layout).v[...] = 7
+
+    assert (data[layout.offsets[2]:] == 7).all()
+    assert not data[:layout.offsets[2]].any()
+
+
+def test_mask_view_is_the_first_channel():
+    for format_ in ("GRAY8", "RGB"):
+        layout = video_layout(format_, 5, 3)
+        data = numpy.arange(layout.size, dtype=numpy.uint8)
+        mask = mask_view(data, layout)
+
+        assert mask.shape == (3, 5, 1)
+        assert mask[1, 0, 0] == layout.strides[0]
+
+
+def test_channels_adds_an_axis_to_single_channel_planes():
+    assert channels(numpy.zeros((3, 5), numpy.uint8)).shape == (3, 5, 1)
+    assert channels(numpy.zeros((3, 5, 2), numpy.uint8)).shape == (3, 5, 2)
@@ -1,3 +1,4 @@
+import os
 import sys
 
 from pathlib import Path
@@ -6,3 +7,13 @@ from importlib import metadata
 __version__ = metadata.version(__name__)
 
 GST_PLUGIN_PATH = str(Path(__file__).parent / "plugins")
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") /
+    "webcam-filters"
+)
+
+DATA_DIR = (
+    Path(os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share") /
+    "webcam-filters"
+)
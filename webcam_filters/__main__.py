@@ -1,7 +1,21 @@
+import sys
+
 from .main import cli
 
 
 def main():
+    if sys.argv[1:2] == ["bench"]:
+        from .bench import bench
+
+        bench.main(sys.argv[2:], prog_name="webcam-filters bench")
+        return
+
+    if sys.argv[1:2] == ["daemon"]:
+        from .daemon import daemon
+
+        daemon.main(sys.argv[2:], prog_name="webcam-filters daemon")
+        return
+
     cli.main(prog_name="webcam-filters")
 
 
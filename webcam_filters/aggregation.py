@@ -0,0 +1,60 @@
+"""
+Pairing up the inputs of the aggregator elements by timestamp.
+
+The branches feeding an aggregator (e.g. frames and masks) go through queues
+of their own, and leaky queues drop buffers on each branch independently.
+Taking buffers in the order they arrive would then pair every later frame
+with the mask of another, so inputs are matched on pts instead.
+"""
+import typing as t
+
+import gi
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstBase", "1.0")
+
+from gi.repository import Gst, GstBase
+
+
+class Match(t.NamedTuple):
+    # The buffer with the pts, if it has arrived.
+    buffer: t.Optional[Gst.Buffer]
+    # The newest buffer older than pts that was dropped to get to it.
+    stale: t.Optional[Gst.Buffer]
+
+
+def pop_matching(pad: GstBase.AggregatorPad, pts: int) -> Match:
+    """
+    Pop the buffer of pad with the given pts, dropping the older ones before
+    it. Newer buffers are left queued for the frames they belong to. Buffers
+    without a timestamp are taken in the order they arrive.
+    """
+    stale = None
+
+    while True:
+        buf = pad.peek_buffer()
+
+        if buf is None:
+            return Match(None, stale)
+
+        if (
+            pts == Gst.CLOCK_TIME_NONE or
+            buf.pts == Gst.CLOCK_TIME_NONE or
+            buf.pts == pts
+        ):
+            pad.drop_buffer()
+            return Match(buf, stale)
+
+        if buf.pts > pts:
+            return Match(None, stale)
+
+        pad.drop_buffer()
+        stale = buf
+
+
+def still_coming(pad: GstBase.AggregatorPad, timeout: bool) -> bool:
+    """
+    Whether the buffer pad is missing may still arrive, so the aggregator
+    should wait for it rather than fall back to an older one.
+    """
+    return not timeout and not pad.is_eos() and not pad.has_buffer()
@@ -0,0 +1,187 @@
+"""
+Output buffer pool handling for the aggregator elements, and accounting of
+the frame copies elements make.
+
+Aggregators write every frame into a buffer acquired from a pool, so a frame
+downstream still holds is never written over with the next one. Pools the
+elements create are backed by memfd memory where GStreamer supports it, so
+frames can be handed to other processes (e.g. via shm or DMABuf import)
+without copying.
+"""
+import typing as t
+
+import gi
+
+gi.require_version("Gst", "1.0")
+
+import numpy
+
+from gi.repository import Gst, GObject, GLib
+
+
+# Buffers the pool keeps around at least: one being written, one being
+# consumed downstream and one in flight between them.
+MIN_BUFFERS = 3
+
+# 0 lets the pool grow when downstream holds on to more buffers, rather than
+# blocking the aggregator.
+MAX_BUFFERS = 0
+
+
+def decide_allocation(query: Gst.Query, size: int) -> bool:
+    """
+    Pick the output buffer pool for an allocation query.
+
+    A pool proposed by downstream is used if there is one, otherwise a new
+    pool (memfd backed where available) is created. Either way it's
+    configured for buffers of at least size bytes and at least MIN_BUFFERS
+    buffers.
+    """
+    caps, _ = query.parse_allocation()
+
+    if caps is None:
+        return False
+
+    have_pool = query.get_n_allocation_pools() > 0
+
+    if have_pool:
+        pool, pool_size, min_buffers, max_buffers = (
+            query.parse_nth_allocation_pool(0)
+        )
+        size = max(size, pool_size)
+    else:
+        pool = None
+        min_buffers = 0
+        max_buffers = MAX_BUFFERS
+
+    allocator = None
+    if pool is None:
+        pool = Gst.BufferPool.new()
+        allocator = memfd_allocator()
+
+    min_buffers = max(min_buffers, MIN_BUFFERS)
+    if max_buffers and max_buffers < min_buffers:
+        max_buffers = min_buffers
+
+    config = pool.get_config()
+    if allocator is not None:
+        Gst.BufferPool.config_set_allocator(config, allocator, None)
+    Gst.BufferPool.config_set_params(
+        config,
+        caps,
+        size,
+        min_buffers,
+        max_buffers
+    )
+
+    if not pool.set_config(config):
+        # The pool adjusted the config; take it if it's still usable.
+        config = pool.get_config()
+        if not Gst.BufferPool.config_validate_params(
+            config,
+            caps,
+            size,
+            min_buffers,
+            max_buffers
+        ):
+            Gst.error("buffer pool rejected config")
+            return False
+
+        if not pool.set_config(config):
+            Gst.error("failed to configure buffer pool")
+            return False
+
+    if have_pool:
+        query.set_nth_allocation_pool(0, pool, size, min_buffers, max_buffers)
+    else:
+        query.add_allocation_pool(pool, size, min_buffers, max_buffers)
+
+    return True
+
+
+def acquire_buffer(
+    aggregator: Gst.Element,
+) -> t.Tuple[Gst.FlowReturn, t.Optional[Gst.Buffer]]:
+    """
+    Return (flow return, buffer) for a free buffer from the aggregator's
+    negotiated pool.
+    """
+    pool = aggregator.get_buffer_pool()
+
+    if pool is None:
+        raise RuntimeError("no buffer pool negotiated")
+
+    if not pool.is_active() and not pool.set_active(True):
+        raise RuntimeError("failed to activate buffer pool")
+
+    return pool.acquire_buffer(None)
+
+
+def memfd_allocator() -> t.Optional[Gst.Allocator]:
+    """
+    Return GStreamer's memfd backed shm allocator, or None if it's not
+    available (it was added in GStreamer 1.24).
+    """
+    try:
+        gi.require_version("GstAllocators", "1.0")
+        from gi.repository import GstAllocators
+
+        GstAllocators.ShmAllocator.init_once()
+        return Gst.Allocator.find("shmallocator")
+    except (ImportError, ValueError, AttributeError):
+        return None
+
+
+# Read-only property elements expose the bytes they copied through.
+COPIED_BYTES_PROPERTY = (
+    GObject.TYPE_UINT64,
+    "copied-bytes",
+    "Bytes of frame data copied so far (for checking a path is zero-copy)",
+    0,
+    GLib.MAXUINT64,
+    0,
+    GObject.ParamFlags.READABLE
+)
+
+
+def data_address(buf: Gst.Buffer) -> int:
+    """
+    Return the address the buffer's memory is mapped at.
+    """
+    info = buf.map(Gst.MapFlags.READ)
+    with info:
+        return mapped_address(info)
+
+
+def mapped_address(info: Gst.MapInfo) -> int:
+    return numpy.frombuffer(info.data, numpy.uint8).ctypes.data
+
+
+class CopyCounter:
+    """
+    Count the bytes of frame data copied by an element.
+
+    In-place transforms call before(inbuf) from do_before_transform and
+    after(info) from do_transform_ip with the READ | WRITE map of the buffer.
+    If the buffer's memory was copied in between (because it wasn't
+    writable, e.g. after a tee) its size is counted. The copy of shared
+    memory only happens once it's mapped for writing, so the address has to
+    come from that map. Copies an element makes itself are counted with
+    add().
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self._address = None
+
+    def before(self, buf: Gst.Buffer) -> None:
+        self._address = data_address(buf)
+
+    def after(self, info: Gst.MapInfo) -> None:
+        if self._address is not None and mapped_address(info) != self._address:
+            self.bytes += info.size
+
+        self._address = None
+
+    def add(self, nbytes: int) -> None:
+        self.bytes += nbytes
@@ -0,0 +1,234 @@
+"""
+Engines that run the selfie segmentation models.
+
+A backend builds graphs from a GraphSpec. A graph runs one model and has:
+
+- process(frame): the float32 foreground probabilities (0-1) of an RGB
+  frame, at the size of the frame
+- reset(): forget any state kept from the previous frame
+- close(): free the model
+- process_batch(frames), optionally: the masks of several frames computed in
+  one call
+
+mediapipe and onnxruntime take a long time to import and onnxruntime is
+optional, so each is only imported once one of its graphs is built. The
+command line imports this module for the backend options, so cv2 and numpy
+are only imported by the graphs too.
+"""
+import typing as t
+
+from enum import Enum, unique
+from pathlib import Path
+
+
+# onnxruntime.GraphOptimizationLevel names, by the values of the
+# onnx-optimization property.
+ONNX_OPTIMIZATION_LEVELS = (
+    "ORT_DISABLE_ALL",
+    "ORT_ENABLE_BASIC",
+    "ORT_ENABLE_EXTENDED",
+    "ORT_ENABLE_ALL",
+)
+
+# numpy dtypes of the ONNX model input types that are supported. uint8
+# inputs (e.g. of fully int8 quantised models) are fed the pixels as is,
+# float inputs are scaled to 0-1.
+ONNX_INPUT_TYPES = {
+    "tensor(float)": "float32",
+    "tensor(float16)": "float16",
+    "tensor(uint8)": "uint8",
+}
+
+# Model files of the onnxruntime backend are named after the model.
+MODEL_NAMES = ("general", "landscape")
+
+
+@unique
+class SegmentationBackend(int, Enum):
+    mediapipe = 0
+    onnxruntime = 1
+
+    def __str__(self):
+        return self.name
+
+
+@unique
+class OnnxOptimization(int, Enum):
+    disabled = 0
+    basic = 1
+    extended = 2
+    all = 3
+
+    def __str__(self):
+        return self.name
+
+
+class GraphSpec(t.NamedTuple):
+    """
+    What a graph is built from. Graphs with equal specs are interchangeable.
+    """
+    backend: int
+    model: int
+    onnx_model_dir: str = ""
+    onnx_threads: int = 0
+    onnx_optimization: int = len(ONNX_OPTIMIZATION_LEVELS) - 1
+
+
+def onnx_model_path(model_dir: str, model: int) -> Path:
+    return Path(model_dir) / f"{MODEL_NAMES[model]}.onnx"
+
+
+def build_graph(spec: GraphSpec):
+    if spec.backend == SegmentationBackend.onnxruntime:
+        return OnnxGraph(
+            onnx_model_path(spec.onnx_model_dir, spec.model),
+            spec.onnx_threads,
+            spec.onnx_optimization,
+        )
+
+    return MediapipeGraph(spec.model)
+
+
+class MediapipeGraph:
+
+    def __init__(self, model: int):
+        from mediapipe.python.solutions.selfie_segmentation import (
+            SelfieSegmentation,
+        )
+
+        self._graph = SelfieSegmentation(model_selection=model)
+
+    def process(self, frame: "numpy.ndarray") -> "numpy.ndarray":
+        return self._graph.process(frame).segmentation_mask
+
+    def reset(self) -> None:
+        self._graph.reset()
+
+    def close(self) -> None:
+        self._graph.close()
+
+
+class OnnxGraph:
+    """
+    Run an ONNX selfie segmentation model with ONNX Runtime on the CPU.
+
+    The model takes a batch of RGB frames as NHWC or NCHW at a fixed size and
+    outputs NxHxW, NxHxWxC or NxCxHxW probabilities, whose last channel is
+    the foreground. Models with a dynamic batch dimension run a whole batch
+    in one call.
+    """
+
+    def __init__(self, path: Path, threads: int, optimization: int):
+        import numpy
+
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError(
+                "the onnxruntime backend needs the onnxruntime package "
+                "(e.g. pip install webcam-filters[onnx])"
+            )
+
+        options = onnxruntime.SessionOptions()
+        # 0 lets onnxruntime use a thread per core.
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = getattr(
+            onnxruntime.GraphOptimizationLevel,
+            ONNX_OPTIMIZATION_LEVELS[optimization],
+        )
+
+        self._session = onnxruntime.InferenceSession(
+            str(path),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+
+        input_ = self._session.get_inputs()[0]
+        shape = input_.shape
+
+        if len(shape) != 4 or input_.type not in ONNX_INPUT_TYPES:
+            raise ValueError(
+                f"{path}: unsupported model input {input_.type} {shape}, "
+                "expected a batch of RGB frames"
+            )
+
+        self._input = input_.name
+        self._dtype = numpy.dtype(ONNX_INPUT_TYPES[input_.type])
+        self._nchw = shape[1] == 3
+        height, width = shape[2:] if self._nchw else shape[1:3]
+
+        if not isinstance(width, int) or not isinstance(height, int):
+            raise ValueError(f"{path}: model input size must be fixed")
+
+        self.size = (width, height)
+        self.dynamic_batch = not isinstance(shape[0], int) or shape[0] < 1
+
+        self._small = numpy.empty((height, width, 3), numpy.uint8)
+
+    def process(self, frame: "numpy.ndarray") -> "numpy.ndarray":
+        return self.run([frame])[0]
+
+    def process_batch(
+        self,
+        frames: t.Sequence["numpy.ndarray"],
+    ) -> t.List["numpy.ndarray"]:
+        if self.dynamic_batch:
+            return self.run(frames)
+
+        return [self.process(frame) for frame in frames]
+
+    def run(
+        self,
+        frames: t.Sequence["numpy.ndarray"],
+    ) -> t.List["numpy.ndarray"]:
+        import cv2
+        import numpy
+
+        width, height = self.size
+        batch = numpy.empty((len(frames), height, width, 3), self._dtype)
+
+        for i, frame in enumerate(frames):
+            cv2.resize(
+                frame,
+                self.size,
+                dst=self._small,
+                interpolation=cv2.INTER_AREA
+            )
+            batch[i] = self._small
+
+        if self._dtype != numpy.uint8:
+            batch *= 1 / 255
+
+        if self._nchw:
+            batch = numpy.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+        output = self._session.run(None, {self._input: batch})[0]
+
+        return [
+            cv2.resize(
+                mask.astype(numpy.float32, copy=False),
+                (frame.shape[1], frame.shape[0]),
+                interpolation=cv2.INTER_LINEAR
+            )
+            for mask, frame in zip(foreground(output), frames)
+        ]
+
+    def reset(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._session = None
+
+
+def foreground(output: "numpy.ndarray") -> "numpy.ndarray":
+    """
+    Return the NxHxW foreground probabilities of a model output.
+    """
+    if output.ndim == 3:
+        return output
+
+    # Channels are the smaller of the dimensions either side of HxW.
+    if output.shape[-1] <= output.shape[1]:
+        return output[..., -1]
+
+    return output[:, -1]
@@ -0,0 +1,352 @@
+"""
+Offline benchmark of the filter graph.
+
+``webcam-filters bench`` builds the same filters ``webcam-filters`` would, but
+feeds them from ``videotestsrc`` or a video file and drains them into a
+``fakesink`` as fast as possible, so performance can be measured without a
+webcam or v4l2loopback device.
+"""
+import enum
+import json
+import time
+import typing as t
+import dataclasses
+
+from fractions import Fraction
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+from .click import click, EnumChoice
+from .endpoints import Endpoint
+from .gst import init, make_element, Pipeline, Gst
+from .main import cli
+from .stats import percentile, PERCENTILES
+
+
+# Options of the main command that also apply to benchmarks. Sharing them
+# keeps the defaults the same as a real run.
+SHARED_OPTIONS = {
+    "background_blur_downscale",
+    "background_blur_threads",
+    "selfie_segmentation_model",
+    "selfie_segmentation_threshold",
+    "selfie_segmentation_feather",
+    "selfie_segmentation_smoothing",
+    "selfie_segmentation_hysteresis",
+    "selfie_segmentation_interval",
+    "selfie_segmentation_motion_threshold",
+    "selfie_segmentation_async",
+    "selfie_segmentation_queue_depth",
+    "selfie_segmentation_drop_policy",
+    "selfie_segmentation_width",
+    "selfie_segmentation_height",
+    "selfie_segmentation_interpolation",
+    "segmentation_backend",
+    "segmentation_onnx_model_dir",
+    "segmentation_onnx_threads",
+    "segmentation_onnx_optimization",
+    "native_yuv",
+    "max_latency_ms",
+    "io_mode",
+    "hw_accel_api",
+    "vaapi_features",
+    "verbose",
+}
+
+
+class FilterCombination(enum.Enum):
+    passthrough = enum.auto()
+    blur = enum.auto()
+    fused_blur = enum.auto()
+
+    def __str__(self):
+        return self.name
+
+
+@dataclasses.dataclass()
+class BenchPipeline(Pipeline):
+    input_file: t.Optional[Path]
+    pattern: str
+    num_buffers: int
+
+    def build_source(self, pipeline: Gst.Pipeline) -> Gst.Element:
+        rgbconvert = self.make_rgbconvert()
+        rgbfilter = make_element("capsfilter", "rgbfilter")
+
+        caps = (
+            f"video/x-raw, width={self.input_width}, "
+            f"height={self.input_height}, "
+            f"framerate={self.input_framerate.numerator}/"
+            f"{self.input_framerate.denominator}"
+        )
+        rgbfilter.set_property(
+            "caps",
+            Gst.Caps.from_string(f"{caps}, format={self.frame_format}")
+        )
+
+        if self.input_file is None:
+            src = make_element("videotestsrc")
+            inputfilter = make_element("capsfilter")
+
+            src.set_property("num-buffers", self.num_buffers)
+            Gst.util_set_object_arg(src, "pattern", self.pattern)
+            # Webcams commonly produce YUY2, so include converting from it.
+            inputfilter.set_property(
+                "caps",
+                Gst.Caps.from_string(f"{caps}, format=YUY2")
+            )
+
+            pipeline.add(src, inputfilter, rgbconvert, rgbfilter)
+
+            src.link(inputfilter)
+            inputfilter.link(rgbconvert)
+
+        else:
+            src = make_element("filesrc")
+            decodebin = make_element("decodebin3")
+            scale = make_element("videoscale")
+            rate = make_element("videorate")
+
+            src.set_property("location", str(self.input_file))
+
+            pipeline.add(src, decodebin, scale, rate, rgbconvert, rgbfilter)
+
+            src.link(decodebin)
+            decodebin.connect(
+                "pad-added",
+                lambda dbin, pad: pad.link(scale.get_static_pad("sink"))
+            )
+            scale.link(rate)
+            rate.link(rgbconvert)
+
+        rgbconvert.link(rgbfilter)
+
+        return rgbfilter
+
+    def make_sink(self, endpoint: Endpoint) -> Gst.Element:
+        sink = make_element("fakesink", "sink")
+        sink.set_property("sync", False)
+
+        return sink
+
+    def bench(self) -> t.Dict[str, t.Any]:
+        """
+        Run the pipeline to EOS and return its frame rate, the latency of
+        frames through the filters and the CPU time used per frame.
+
+        The clock starts at the first frame reaching the sink, so start up
+        costs (e.g. model loading) are not included.
+        """
+        init()
+
+        self.enable_hwdec_elements()
+
+        pipeline = self.build_pipeline()
+
+        pushed: t.Dict[int, float] = {}
+        latencies: t.List[float] = []
+        first: t.Dict[str, float] = {}
+        frames = 0
+
+        def on_push(pad, info):
+            pushed[info.get_buffer().pts] = time.perf_counter()
+            return Gst.PadProbeReturn.OK
+
+        def on_arrive(pad, info):
+            nonlocal frames
+
+            now = time.perf_counter()
+            start = pushed.pop(info.get_buffer().pts, None)
+            if start is not None:
+                latencies.append((now - start) * 1000)
+
+            if not first:
+                first["wall"] = now
+                first["cpu"] = time.process_time()
+            else:
+                frames += 1
+
+            return Gst.PadProbeReturn.OK
+
+        pipeline.get_by_name("rgbfilter").get_static_pad("src").add_probe(
+            Gst.PadProbeType.BUFFER,
+            on_push,
+        )
+        pipeline.get_by_name("sink").get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER,
+            on_arrive,
+        )
+
+        pipeline.set_state(Gst.State.PLAYING)
+
+        bus = pipeline.get_bus()
+        msg = bus.timed_pop_filtered(
+            Gst.CLOCK_TIME_NONE,
+            Gst.MessageType.EOS | Gst.MessageType.ERROR
+        )
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        pipeline.set_state(Gst.State.NULL)
+
+        if msg.type == Gst.MessageType.ERROR:
+            gerror, debug = msg.parse_error()
+            click.echo(f"Error from {msg.src.get_path_string()}: {gerror.message}")
+            if self.verbose:
+                click.echo(f"Debug: {debug}")
+            raise click.Abort()
+
+        if frames < 1:
+            click.echo("not enough frames reached the sink")
+            raise click.Abort()
+
+        result = {
+            "frames": frames,
+            "fps": frames / (wall - first["wall"]),
+            "cpu_ms_per_frame": (cpu - first["cpu"]) * 1000 / frames,
+        }
+        for p in PERCENTILES:
+            result[f"latency_p{p}_ms"] = (
+                percentile(latencies, p) if latencies else None
+            )
+
+        return result
+
+
+@click.command()
+@click.option(
+    "--input-file",
+    help="""
+    Video file to decode and feed through the filters.
+    A videotestsrc pattern is used if not given.
+    """,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+)
+@click.option(
+    "--pattern",
+    help="videotestsrc pattern used when there is no --input-file.",
+    type=str,
+    default="smpte",
+)
+@click.option(
+    "--num-buffers",
+    help="Frames generated when there is no --input-file.",
+    type=click.IntRange(min=2),
+    default=300,
+)
+@click.option(
+    "--width",
+    help="Width frames are scaled to.",
+    type=click.IntRange(min=1),
+    default=1280,
+)
+@click.option(
+    "--height",
+    help="Height frames are scaled to.",
+    type=click.IntRange(min=1),
+    default=720,
+)
+@click.option(
+    "--framerate",
+    help="Framerate of the input specified in fractional format (e.g. '30/1').",
+    type=Fraction,
+    default="30/1",
+)
+@click.option(
+    "--combination",
+    help="Filter combination to benchmark. May be given multiple times.",
+    type=EnumChoice(FilterCombination),
+    multiple=True,
+    default=[str(x) for x in FilterCombination],
+)
+@click.option(
+    "--background-blur",
+    help="Background blur intensity of the blur combinations.",
+    type=click.IntRange(1, 200),
+    default=50,
+)
+@click.option(
+    "--json",
+    "as_json",
+    help="Print one JSON object per combination instead of a table.",
+    is_flag=True,
+    default=False,
+    show_default=False,
+)
+def bench(
+    input_file: t.Optional[Path],
+    pattern: str,
+    num_buffers: int,
+    width: int,
+    height: int,
+    framerate: Fraction,
+    combination: t.Sequence[FilterCombination],
+    background_blur: int,
+    as_json: bool,
+    **kwargs,
+) -> None:
+    """
+    Benchmark filter combinations without a webcam.
+    """
+    results = []
+
+    for c in combination:
+        p = BenchPipeline(
+            input_dev="",
+            output_dev="",
+            outputs=(),
+            input_width=width,
+            input_height=height,
+            input_framerate=framerate,
+            input_media_type=None,
+            background_blur=(
+                None if c == FilterCombination.passthrough else background_blur
+            ),
+            fused_pipeline=c == FilterCombination.fused_blur,
+            stats=False,
+            stats_file=None,
+            stats_interval=1.0,
+            control_socket=None,
+            selfie_segmentation_preload=(),
+            input_file=input_file,
+            pattern=pattern,
+            num_buffers=num_buffers,
+            **kwargs,
+        )
+
+        result = {"combination": str(c), **p.bench()}
+        results.append(result)
+
+        if as_json:
+            click.echo(json.dumps(result))
+
+    if as_json:
+        return
+
+    table = Table(title=f"webcam-filters bench ({width}x{height})")
+
+    table.add_column("Combination")
+    table.add_column("fps")
+    for p in PERCENTILES:
+        table.add_column(f"p{p} latency ms")
+    table.add_column("CPU ms/frame")
+
+    def ms(x):
+        return "-" if x is None else f"{x:.2f}"
+
+    for r in results:
+        table.add_row(
+            r["combination"],
+            f"{r['fps']:.1f}",
+            *(ms(r[f"latency_p{p}_ms"]) for p in PERCENTILES),
+            f"{r['cpu_ms_per_frame']:.2f}",
+        )
+
+    Console().print(table)
+
+
+bench.params.extend(x for x in cli.params if x.name in SHARED_OPTIONS)
@@ -0,0 +1,103 @@
+"""
+On-disk cache of the capabilities of v4l2 devices.
+
+Probing a device with v4l2src opens it and tries its formats, which takes
+over a second on some USB cameras. Caps are cached by device path together
+with the device's fingerprint (see v4l2.device_fingerprint), so plugging a
+different camera into the same path or updating its driver invalidates them.
+"""
+import os
+import json
+import tempfile
+import threading
+import typing as t
+
+import gi
+
+gi.require_version("Gst", "1.0")
+
+from pathlib import Path
+
+from gi.repository import Gst
+
+from . import v4l2
+from . import CACHE_DIR
+
+
+CACHE_PATH = CACHE_DIR / "device-caps.json"
+
+# Background refreshes may store concurrently with the main thread.
+_lock = threading.Lock()
+
+
+def load(device: str, path: Path = CACHE_PATH) -> t.Optional[Gst.Caps]:
+    """
+    Return the cached caps of device, or None if there are none or the
+    device changed since they were cached.
+    """
+    try:
+        fingerprint = v4l2.device_fingerprint(device)
+    except OSError:
+        return None
+
+    entry = read(path).get(os.path.realpath(device))
+
+    if not isinstance(entry, dict) or entry.get("fingerprint") != fingerprint:
+        return None
+
+    caps = Gst.Caps.from_string(entry.get("caps", ""))
+
+    if caps is None or caps.is_empty():
+        return None
+
+    return caps
+
+
+def store(device: str, caps: Gst.Caps, path: Path = CACHE_PATH) -> None:
+    """
+    Cache the caps of device. Devices that can't be fingerprinted aren't
+    cached.
+    """
+    try:
+        fingerprint = v4l2.device_fingerprint(device)
+    except OSError:
+        return
+
+    with _lock:
+        entries = read(path)
+        entries[os.path.realpath(device)] = {
+            "fingerprint": fingerprint,
+            "caps": caps.to_string(),
+        }
+        write(path, entries)
+
+
+def read(path: Path) -> t.Dict[str, t.Any]:
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return entries if isinstance(entries, dict) else {}
+
+
+def write(path: Path, entries: t.Dict[str, t.Any]) -> None:
+    """
+    Replace the cache file atomically, so a concurrent start never reads a
+    partial one. Failing to write is only logged, as the cache is optional.
+    """
+    tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f, indent=2)
+
+        os.replace(tmp, path)
+    except OSError as e:
+        Gst.warning(f"failed to write {path}: {e}")
+
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
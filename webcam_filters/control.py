@@ -0,0 +1,171 @@
+"""
+Local control socket for changing a running pipeline.
+
+Clients connect to a Unix socket and send one JSON object per line, and get
+a JSON object back on a line of its own for each, e.g.
+
+  $ echo '{"set": {"background-blur": 80}}' | socat - UNIX-CONNECT:/tmp/wf.sock
+  {"values": {"background-blur": 80, ...}}
+
+Failed requests are answered with {"error": "..."}. Requests are handled on
+the GLib main loop, so handlers can change the pipeline directly.
+"""
+import os
+import json
+import socket
+import typing as t
+
+import gi
+
+gi.require_version("GLib", "2.0")
+
+from pathlib import Path
+
+from gi.repository import GLib
+
+
+# Longest request line accepted before the client is disconnected.
+MAX_REQUEST_BYTES = 64 * 1024
+
+Handler = t.Callable[[t.Dict[str, t.Any]], t.Dict[str, t.Any]]
+
+
+class ControlServer:
+    """
+    Serve JSON-lines requests on a Unix socket at path, answering each with
+    handler(request).
+    """
+
+    def __init__(self, path: Path, handler: Handler):
+        self.path = path
+        self.handler = handler
+
+        self._sock: t.Optional[socket.socket] = None
+        self._watch: t.Optional[int] = None
+        self._clients: t.Dict[socket.socket, t.Tuple[bytearray, int]] = {}
+
+    def start(self) -> None:
+        """
+        Start listening. Raises OSError if another process is listening on
+        path already.
+        """
+        self.remove_stale_socket()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(self.path))
+        # Only the user running the pipeline may control it.
+        os.chmod(self.path, 0o600)
+        sock.listen()
+        sock.setblocking(False)
+
+        self._sock = sock
+        self._watch = GLib.io_add_watch(
+            sock.fileno(),
+            GLib.PRIORITY_DEFAULT,
+            GLib.IO_IN,
+            self.on_accept,
+        )
+
+    def stop(self) -> None:
+        for conn in list(self._clients):
+            self.disconnect(conn)
+
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            self.path.unlink(missing_ok=True)
+
+    def remove_stale_socket(self) -> None:
+        if not self.path.is_socket():
+            return
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(self.path))
+        except ConnectionRefusedError:
+            # Left behind by a process that didn't exit cleanly.
+            self.path.unlink()
+            return
+        finally:
+            probe.close()
+
+        raise OSError(f"{self.path} is in use by another process")
+
+    def on_accept(self, fd: int, condition: GLib.IOCondition) -> bool:
+        try:
+            conn, _ = self._sock.accept()
+        except BlockingIOError:
+            return True
+
+        conn.setblocking(False)
+        watch = GLib.io_add_watch(
+            conn.fileno(),
+            GLib.PRIORITY_DEFAULT,
+            GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+            self.on_readable,
+            conn,
+        )
+        self._clients[conn] = (bytearray(), watch)
+
+        return True
+
+    def on_readable(
+        self,
+        fd: int,
+        condition: GLib.IOCondition,
+        conn: socket.socket,
+    ) -> bool:
+        buf, _ = self._clients[conn]
+
+        try:
+            data = conn.recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+
+        if not data:
+            self.disconnect(conn, remove_watch=False)
+            return False
+
+        buf.extend(data)
+
+        while b"\n" in buf:
+            line, _, rest = bytes(buf).partition(b"\n")
+            buf[:] = rest
+
+            try:
+                conn.sendall(self.respond(line))
+            except OSError:
+                self.disconnect(conn, remove_watch=False)
+                return False
+
+        if len(buf) > MAX_REQUEST_BYTES:
+            self.disconnect(conn, remove_watch=False)
+            return False
+
+        return True
+
+    def respond(self, line: bytes) -> bytes:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+
+            reply = self.handler(request)
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"error": str(e)}
+
+        return (json.dumps(reply) + "\n").encode()
+
+    def disconnect(self, conn: socket.socket, remove_watch: bool = True) -> None:
+        _, watch = self._clients.pop(conn)
+
+        if remove_watch:
+            GLib.source_remove(watch)
+
+        conn.close()
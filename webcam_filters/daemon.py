@@ -0,0 +1,313 @@
+"""
+Serve several cameras from one process.
+
+``webcam-filters daemon CONFIG`` runs a pipeline per camera in the config
+file, all on one main loop. They share the Python runtime, the GStreamer
+registry and one segmentation graph per model, so each additional camera
+costs little more than its frame buffers. Frames of different cameras are
+segmented in batches (see --batch-window-ms and --max-batch).
+
+Cameras are configured with the options of ``webcam-filters`` (without the
+leading dashes), either as JSON::
+
+  {
+    "defaults": {"background-blur": 150},
+    "cameras": {
+      "front": {"input-dev": "/dev/video0", "output-dev": "/dev/video10"},
+      "back": {"input-dev": "/dev/video2", "output-dev": "/dev/video11"}
+    }
+  }
+
+or as INI, with a section per camera and defaults in [DEFAULT] (options
+given multiple times are one value per line)::
+
+  [DEFAULT]
+  background-blur = 150
+
+  [front]
+  input-dev = /dev/video0
+  output-dev = /dev/video10
+
+A camera that fails (e.g. is unplugged) is stopped on its own and started
+again after --restart-delay, without interrupting the others.
+"""
+import json
+import signal
+import typing as t
+import configparser
+
+import gi
+
+gi.require_version("GLib", "2.0")
+
+from pathlib import Path
+
+from gi.repository import GObject, GLib
+
+from .click import click
+from .gst import init, Pipeline
+from .main import cli
+from .segmentation import DEFAULT_BATCH_WINDOW, DEFAULT_MAX_BATCH
+
+
+DEFAULT_RESTART_DELAY = 5.0
+
+# Options of the main command that cameras can't set. Every camera showing a
+# live table at once would garble the terminal.
+UNSUPPORTED_OPTIONS = {"stats"}
+
+# Options cameras can set, by name without the leading dashes.
+CAMERA_OPTIONS = {
+    param.opts[0][2:]: param
+    for param in cli.params
+    if isinstance(param, click.Option) and param.expose_value
+}
+
+
+def read_config(path: Path) -> t.Dict[str, t.Dict[str, t.Any]]:
+    """
+    Return the settings of each camera in the config file, by camera name,
+    with the defaults applied. Files ending in .ini are read as INI and
+    everything else as JSON.
+    """
+    if path.suffix == ".ini":
+        parser = configparser.ConfigParser(interpolation=None)
+        with open(path) as f:
+            parser.read_file(f)
+
+        return {name: dict(parser[name]) for name in parser.sections()}
+
+    with open(path) as f:
+        config = json.load(f)
+
+    if not isinstance(config, dict):
+        raise ValueError("config must be a JSON object")
+
+    defaults = config.get("defaults", {})
+    cameras = config.get("cameras")
+
+    if not isinstance(defaults, dict):
+        raise ValueError("defaults must be a JSON object")
+
+    if not isinstance(cameras, dict):
+        raise ValueError("cameras must be a JSON object of cameras by name")
+
+    for name, settings in cameras.items():
+        if not isinstance(settings, dict):
+            raise ValueError(f"camera {name!r} must be a JSON object")
+
+    return {
+        name: {**defaults, **settings}
+        for name, settings in cameras.items()
+    }
+
+
+def camera_args(settings: t.Dict[str, t.Any]) -> t.List[str]:
+    """
+    Return the command line arguments of the main command for a camera's
+    settings. Values may be JSON values or INI strings.
+    """
+    args = []
+
+    for name, value in settings.items():
+        param = CAMERA_OPTIONS.get(name)
+
+        if param is None or name in UNSUPPORTED_OPTIONS:
+            raise ValueError(f"unknown setting {name!r}")
+
+        opt = f"--{name}"
+
+        if param.is_flag:
+            if click.BOOL.convert(value, param, None):
+                args.append(opt)
+            continue
+
+        if isinstance(value, list):
+            if not param.multiple:
+                raise ValueError(f"{name} takes a single value")
+            values = value
+        elif isinstance(value, str) and param.multiple:
+            values = [x.strip() for x in value.splitlines() if x.strip()]
+        else:
+            values = [value]
+
+        for v in values:
+            args.extend([opt, str(v)])
+
+    return args
+
+
+def load_pipelines(
+    path: Path,
+    batch_window_ms: int = DEFAULT_BATCH_WINDOW,
+    max_batch: int = DEFAULT_MAX_BATCH,
+) -> t.List[Pipeline]:
+    """
+    Return a Pipeline for each camera in the config file, validated the
+    same way as the options of the main command.
+    """
+    try:
+        cameras = read_config(path)
+    except (OSError, ValueError, configparser.Error) as e:
+        raise click.ClickException(f"unable to read {path}: {e}")
+
+    if not cameras:
+        raise click.ClickException(f"no cameras in {path}")
+
+    pipelines = []
+
+    for name, settings in cameras.items():
+        try:
+            ctx = cli.make_context(name, camera_args(settings))
+        except ValueError as e:
+            raise click.ClickException(f"camera {name!r}: {e}")
+        except click.ClickException as e:
+            raise click.ClickException(
+                f"camera {name!r}: {e.format_message()}"
+            )
+
+        p = Pipeline(**ctx.params)
+        p.name = name
+        p.shared_segmentation = True
+        p.selfie_segmentation_batch_window_ms = batch_window_ms
+        p.selfie_segmentation_max_batch = max_batch
+
+        pipelines.append(p)
+
+    return pipelines
+
+
+class Daemon:
+    """
+    Run pipelines side by side on one main loop, restarting each on its own
+    when it fails.
+    """
+
+    def __init__(self, pipelines: t.Sequence[Pipeline], restart_delay: float):
+        self.pipelines = pipelines
+        self.restart_delay = restart_delay
+        self.loop = GObject.MainLoop()
+
+        # Names of the pipelines that are started.
+        self._running: t.Set[str] = set()
+
+    def run(self) -> None:
+        init(load_plugins=any(p.uses_filters for p in self.pipelines))
+
+        for p in self.pipelines:
+            p.enable_hwdec_elements()
+            self.start(p)
+
+        GLib.unix_signal_add(
+            GLib.PRIORITY_DEFAULT,
+            signal.SIGTERM,
+            self.on_sigterm,
+        )
+
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            self.loop.quit()
+        finally:
+            for p in self.pipelines:
+                p.stop()
+
+    def start(self, p: Pipeline) -> bool:
+        try:
+            p.start(lambda: self.on_exit(p))
+        except (
+            click.ClickException,
+            click.Abort,
+            RuntimeError,
+            ValueError,
+            GLib.Error,
+        ) as e:
+            reason = f": {e}" if str(e) else ""
+            click.echo(f"{p.name}: failed to start{reason}")
+            self.restart(p)
+        else:
+            self._running.add(p.name)
+
+        return False
+
+    def on_exit(self, p: Pipeline) -> None:
+        # Elements may post several errors before the pipeline is stopped, and
+        # it can't be stopped from within its own bus handler.
+        if p.name not in self._running:
+            return
+
+        self._running.discard(p.name)
+        GLib.idle_add(self.restart, p)
+
+    def restart(self, p: Pipeline) -> bool:
+        """
+        Stop p, and start it again after restart_delay. Without a delay it
+        stays stopped, and the daemon exits once every pipeline is.
+        """
+        p.stop()
+
+        if self.restart_delay:
+            click.echo(f"{p.name}: restarting in {self.restart_delay}s")
+            GLib.timeout_add(int(self.restart_delay * 1000), self.start, p)
+        else:
+            # Checked once the loop runs, as the others may still be starting.
+            GLib.idle_add(self.quit_if_stopped)
+
+        return False
+
+    def quit_if_stopped(self) -> bool:
+        if not self._running:
+            click.echo("All cameras stopped")
+            self.loop.quit()
+
+        return False
+
+    def on_sigterm(self) -> bool:
+        self.loop.quit()
+
+        return False
+
+
+@click.command()
+@click.argument(
+    "config",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--restart-delay",
+    help="""
+    Seconds to wait before starting a failed camera again.
+    0 leaves it stopped.
+    """,
+    type=click.FloatRange(min=0),
+    default=DEFAULT_RESTART_DELAY,
+)
+@click.option(
+    "--batch-window-ms",
+    help="""
+    Milliseconds a camera's frame waits for frames of other cameras to be
+    segmented in the same batch. 0 only batches frames that are waiting
+    already.
+    """,
+    type=click.IntRange(0, 1000),
+    default=DEFAULT_BATCH_WINDOW,
+)
+@click.option(
+    "--max-batch",
+    help="Most frames segmented in one batch.",
+    type=click.IntRange(1, 64),
+    default=DEFAULT_MAX_BATCH,
+)
+def daemon(
+    config: Path,
+    restart_delay: float,
+    batch_window_ms: int,
+    max_batch: int,
+) -> None:
+    """
+    Serve the cameras in the CONFIG file (JSON, or INI if it ends in .ini)
+    from one process.
+    """
+    pipelines = load_pipelines(config, batch_window_ms, max_batch)
+
+    Daemon(pipelines, restart_delay).run()
@@ -0,0 +1,259 @@
+"""
+Input and output backends selected by URI.
+
+  v4l2:///dev/video0      v4l2src / v4l2sink (a bare path means the same)
+  file:///path/video.mkv  decoded from / muxed to a file
+  shm:///tmp/socket       shmsrc / shmsink, raw frames over shared memory
+  fd://3                  decoded from / muxed to a file descriptor
+  appsink://name          appsink for consumers in the same process (output),
+                          keeping only the latest frame unless max-buffers
+                          and drop are given
+
+Query parameters are set as properties on the source or sink element
+(e.g. ``v4l2:///dev/video3?throttle-time=20``), except for shm inputs where
+format, width, height and framerate describe the raw frames being read.
+"""
+import typing as t
+import dataclasses
+
+from urllib.parse import urlsplit, parse_qsl
+
+import gi
+
+gi.require_version("Gst", "1.0")
+
+from gi.repository import Gst
+
+from .click import click
+
+
+SOURCE_SCHEMES = {"v4l2", "file", "shm", "fd"}
+SINK_SCHEMES = {"v4l2", "file", "shm", "fd", "appsink"}
+
+# Elements the query parameters of each scheme are set on.
+SOURCE_ELEMENTS = {
+    "v4l2": "v4l2src",
+    "file": "filesrc",
+    "shm": "shmsrc",
+    "fd": "fdsrc",
+}
+SINK_ELEMENTS = {
+    "v4l2": "v4l2sink",
+    "file": "filesink",
+    "shm": "shmsink",
+    "fd": "fdsink",
+    "appsink": "appsink",
+}
+
+# shm inputs carry no caps, so the frames are described with query
+# parameters. The default format matches what shm outputs write.
+DEFAULT_SHM_FORMAT = "YUY2"
+SHM_SOURCE_CAPS = ("format", "width", "height", "framerate")
+
+DEFAULT_APPSINK_NAME = "appsink"
+
+# Frames an appsink keeps for its consumer, dropping the oldest beyond that,
+# so they don't pile up when nothing pulls them.
+DEFAULT_APPSINK_MAX_BUFFERS = 1
+
+
+@dataclasses.dataclass()
+class Endpoint:
+    scheme: str
+    location: str
+    params: t.Dict[str, str]
+
+
+def parse_endpoint(value: str, schemes: t.Collection[str]) -> Endpoint:
+    """
+    Parse an input or output URI. A value without a scheme is a v4l2 device,
+    optionally followed by query parameters.
+    """
+    if "://" not in value:
+        location, _, query = value.partition("?")
+        return Endpoint("v4l2", location, dict(parse_qsl(query)))
+
+    url = urlsplit(value)
+
+    if url.scheme not in schemes:
+        allowed = ", ".join(f"{x}://" for x in sorted(schemes))
+        raise ValueError(f"unsupported scheme {url.scheme!r} (use {allowed})")
+
+    location = url.netloc + url.path
+
+    if not location and url.scheme != "appsink":
+        raise ValueError(f"missing location in {value!r}")
+
+    if url.scheme == "fd" and not location.isdigit():
+        raise ValueError(f"invalid file descriptor {location!r}")
+
+    return Endpoint(url.scheme, location, dict(parse_qsl(url.query)))
+
+
+def validate_endpoint(
+    schemes: t.Collection[str],
+) -> t.Callable[[click.Context, click.Parameter, str], str]:
+    """
+    Return a click callback checking an option is a valid endpoint.
+    """
+    def callback(ctx, param, value):
+        if value is None:
+            return value
+
+        try:
+            parse_endpoint(value, schemes)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+        return value
+
+    return callback
+
+
+def check_params(endpoint: Endpoint, output: bool) -> None:
+    """
+    Raise ValueError if a query parameter isn't a property of the element it
+    would be set on, so that fails before any of the pipeline is built.
+    GStreamer must be initialised already.
+    """
+    if output:
+        factoryname = SINK_ELEMENTS[endpoint.scheme]
+        params = endpoint.params
+    else:
+        factoryname = SOURCE_ELEMENTS[endpoint.scheme]
+        params = dict(endpoint.params)
+        if endpoint.scheme == "shm":
+            for name in SHM_SOURCE_CAPS:
+                params.pop(name, None)
+
+    element = make(factoryname)
+
+    for name in params:
+        if element.find_property(name) is None:
+            raise ValueError(f"{factoryname} has no property {name!r}")
+
+
+def make_source(
+    endpoint: Endpoint,
+    width: int,
+    height: int,
+    framerate: str,
+) -> Gst.Element:
+    """
+    Return an element producing the stream of a non v4l2 input, to be fed
+    into a decodebin. width, height and framerate describe the frames of
+    shm inputs unless given as query parameters.
+    """
+    params = dict(endpoint.params)
+
+    if endpoint.scheme == "file":
+        src = make("filesrc")
+        src.set_property("location", endpoint.location)
+
+    elif endpoint.scheme == "fd":
+        src = make("fdsrc")
+        src.set_property("fd", int(endpoint.location))
+
+    elif endpoint.scheme == "shm":
+        src = make("shmsrc")
+        src.set_property("socket-path", endpoint.location)
+        src.set_property("is-live", True)
+
+        caps = Gst.Caps.from_string(
+            "video/x-raw, "
+            f"format={params.pop('format', DEFAULT_SHM_FORMAT)}, "
+            f"width={params.pop('width', width)}, "
+            f"height={params.pop('height', height)}, "
+            f"framerate={params.pop('framerate', framerate)}"
+        )
+
+        set_properties(src, params)
+
+        capsfilter = make("capsfilter")
+        capsfilter.set_property("caps", caps)
+
+        return chain_bin([src, capsfilter], capsfilter.get_static_pad("src"))
+
+    else:
+        raise ValueError(f"{endpoint.scheme}:// can't be used as an input")
+
+    set_properties(src, params)
+
+    return src
+
+
+def make_sink(endpoint: Endpoint) -> Gst.Element:
+    """
+    Return an element consuming raw frames for a non v4l2 output.
+    """
+    if endpoint.scheme in {"file", "fd"}:
+        if endpoint.scheme == "file":
+            sink = make("filesink")
+            sink.set_property("location", endpoint.location)
+        else:
+            sink = make("fdsink")
+            sink.set_property("fd", int(endpoint.location))
+
+        set_properties(sink, endpoint.params)
+
+        mux = make("matroskamux")
+        mux.set_property("streamable", endpoint.scheme == "fd")
+
+        return chain_bin([mux, sink], mux.get_request_pad("video_%u"))
+
+    elif endpoint.scheme == "shm":
+        sink = make("shmsink")
+        sink.set_property("socket-path", endpoint.location)
+        sink.set_property("wait-for-connection", False)
+
+    elif endpoint.scheme == "appsink":
+        sink = make("appsink", endpoint.location or DEFAULT_APPSINK_NAME)
+        sink.set_property("emit-signals", True)
+        sink.set_property("max-buffers", DEFAULT_APPSINK_MAX_BUFFERS)
+        sink.set_property("drop", True)
+
+    else:
+        raise ValueError(f"{endpoint.scheme}:// can't be used as an output")
+
+    set_properties(sink, endpoint.params)
+
+    return sink
+
+
+def set_properties(element: Gst.Element, params: t.Mapping[str, str]) -> None:
+    for name, value in params.items():
+        if element.find_property(name) is None:
+            factory = element.get_factory().get_name()
+            raise ValueError(f"{factory} has no property {name!r}")
+
+        Gst.util_set_object_arg(element, name, value)
+
+
+def chain_bin(elements: t.Sequence[Gst.Element], pad: Gst.Pad) -> Gst.Bin:
+    """
+    Link elements into a bin, exposing pad (of one of them) as its "src" or
+    "sink" pad.
+    """
+    b = Gst.Bin.new()
+
+    for e in elements:
+        b.add(e)
+
+    for a, z in zip(elements, elements[1:]):
+        a.link(z)
+
+    if pad.get_direction() == Gst.PadDirection.SRC:
+        b.add_pad(Gst.GhostPad.new("src", pad))
+    else:
+        b.add_pad(Gst.GhostPad.new("sink", pad))
+
+    return b
+
+
+def make(factoryname: str, name: t.Optional[str] = None) -> Gst.Element:
+    elm = Gst.ElementFactory.make(factoryname, name)
+
+    if elm is None:
+        raise RuntimeError(f"failed to create element '{factoryname}'")
+
+    return elm
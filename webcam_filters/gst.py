@@ -2,6 +2,8 @@ import typing as t
 import os
 import sys
 import enum
+import platform
+import threading
 import dataclasses
 
 import gi
@@ -12,18 +14,34 @@ gi.require_version("GstBase", "1.0")
 from fractions import Fraction
 from pathlib import Path
 
-from gi.repository import Gst, GObject, GstBase
-from rich.console import Console
-from rich.table import Table
+from gi.repository import Gst, GObject, GstBase, GLib
 
 from .mediapipe import (
     SelfieSegmentationModel,
+    MaskInterpolation,
+    DropPolicy,
+)
+from .backends import (
+    GraphSpec,
+    OnnxOptimization,
+    SegmentationBackend,
+    onnx_model_path,
 )
 from .click import (
     click,
 )
+from . import caps_cache
+from . import endpoints
+from . import v4l2
+from .endpoints import (
+    SOURCE_SCHEMES,
+    SINK_SCHEMES,
+    Endpoint,
+    parse_endpoint,
+    set_properties,
+)
 
-from . import GST_PLUGIN_PATH
+from . import GST_PLUGIN_PATH, CACHE_DIR
 
 
 RGB_FORMATS = [
@@ -44,6 +62,35 @@ RGB_FORMATS = [
     "ABGR",
 ]
 
+# Settings the control socket can change while playing, by option name, as
+# (element property, conversion from JSON). They are set on whichever of the
+# FILTER_ELEMENTS have the property.
+CONTROLS = {
+    "background-blur": ("ksize", int),
+    "background-blur-downscale": ("downscale", int),
+    "selfie-segmentation-model": (
+        "model",
+        lambda x: SelfieSegmentationModel[x],
+    ),
+    "selfie-segmentation-threshold": ("threshold", float),
+    "segmentation-backend": ("backend", lambda x: SegmentationBackend[x]),
+    "selfie-segmentation-feather": ("feather", float),
+    "selfie-segmentation-smoothing": ("smoothing", float),
+    "selfie-segmentation-hysteresis": ("hysteresis", float),
+    "selfie-segmentation-interval": ("interval", int),
+    "selfie-segmentation-motion-threshold": ("motion-threshold", float),
+}
+
+FILTER_ELEMENTS = ("selfie", "blur")
+
+# Blur intensity of filters enabled over the control socket when the
+# pipeline was started without --background-blur.
+DEFAULT_BACKGROUND_BLUR = 50
+
+# Format frames are filtered in with --native-yuv. Decoded MJPEG is usually
+# I420 already, and webcams' YUY2 only needs repacking.
+NATIVE_YUV_FORMAT = "I420"
+
 
 class HardwareAccelAPI(enum.Enum):
     off = enum.auto()
@@ -53,6 +100,16 @@ class HardwareAccelAPI(enum.Enum):
       return self.name
 
 
+class IOMode(enum.Enum):
+    auto = enum.auto()
+    mmap = enum.auto()
+    userptr = enum.auto()
+    dmabuf = enum.auto()
+
+    def __str__(self):
+      return self.name
+
+
 class VaapiFeature(enum.Flag):
     jpegdec = enum.auto()
     mpeg2dec = enum.auto()
@@ -70,11 +127,25 @@ class VaapiFeature(enum.Flag):
     all = decode | rgbconvert | sinkconvert
 
 
-def init():
-    # hack to let Gst.ElementFactory.make("...") to find custom plugins
-    os.environ["GST_PLUGIN_PATH"] = ":".join(
-        [GST_PLUGIN_PATH] + os.environ.get("GST_PLUGIN_PATH", "").split(":")
-    )
+def init(load_plugins: bool = True):
+    """
+    Initialize GStreamer. The Python plugins are only made available with
+    load_plugins, since loading any of them imports all of them (and numpy,
+    cv2, etc). Pipelines that don't use them (e.g. passthrough) skip that.
+    """
+    if load_plugins:
+        # hack to let Gst.ElementFactory.make("...") to find custom plugins
+        os.environ["GST_PLUGIN_PATH"] = ":".join(
+            [GST_PLUGIN_PATH] + os.environ.get("GST_PLUGIN_PATH", "").split(":")
+        )
+
+        # Use a registry of our own, so runs with and without the plugins
+        # (or other GStreamer applications) don't keep invalidating each
+        # other's registry and forcing a rescan of every plugin.
+        os.environ.setdefault(
+            "GST_REGISTRY",
+            str(CACHE_DIR / f"registry.{platform.machine()}.bin")
+        )
 
     # hack to ensure interperter path is on PATH so that custom plugins will use the correct interpeter
     os.environ["PATH"] = ":".join(
@@ -99,48 +170,291 @@ class Pipeline:
     input_height: int
     input_framerate: Fraction
     input_media_type: t.Optional[str]
+    outputs: t.Sequence[str]
     background_blur: t.Optional[int]
+    background_blur_downscale: int
+    background_blur_threads: int
     selfie_segmentation_model: SelfieSegmentationModel
     selfie_segmentation_threshold: int
+    selfie_segmentation_feather: float
+    selfie_segmentation_smoothing: float
+    selfie_segmentation_hysteresis: float
+    selfie_segmentation_interval: int
+    selfie_segmentation_motion_threshold: float
+    selfie_segmentation_async: bool
+    selfie_segmentation_queue_depth: int
+    selfie_segmentation_drop_policy: DropPolicy
+    selfie_segmentation_width: int
+    selfie_segmentation_height: int
+    selfie_segmentation_interpolation: MaskInterpolation
+    selfie_segmentation_preload: t.Sequence[SelfieSegmentationModel]
+    segmentation_backend: SegmentationBackend
+    segmentation_onnx_model_dir: Path
+    segmentation_onnx_threads: int
+    segmentation_onnx_optimization: OnnxOptimization
+    fused_pipeline: bool
+    native_yuv: bool
+    max_latency_ms: int
+    io_mode: IOMode
     hw_accel_api: HardwareAccelAPI
     verbose: bool
+    stats: bool
+    stats_file: t.Optional[Path]
+    stats_interval: float
+    control_socket: t.Optional[Path]
     vaapi_features: VaapiFeature
 
+    # Name of the Gst.Pipeline, which prefixes element paths in messages
+    # (e.g. a camera's name in daemon mode).
+    name: t.Optional[str] = dataclasses.field(default=None, init=False)
+
+    # Load one graph per segmentation model for all pipelines in the process
+    # instead of one per pipeline.
+    shared_segmentation: bool = dataclasses.field(default=False, init=False)
+
+    # How shared segmentation batches frames of different pipelines (see the
+    # batch-window and max-batch properties of selfie_seg).
+    selfie_segmentation_batch_window_ms: int = dataclasses.field(
+        default=0,
+        init=False,
+    )
+    selfie_segmentation_max_batch: int = dataclasses.field(
+        default=8,
+        init=False,
+    )
+
+    # Frames each queue dropped to stay within max_latency_ms, by queue name.
+    queue_drops: t.Dict[str, int] = dataclasses.field(
+        default_factory=dict,
+        init=False,
+    )
+
+    # Set up by start() and released by stop().
+    _pipeline: t.Optional[Gst.Pipeline] = dataclasses.field(
+        default=None,
+        init=False,
+        repr=False,
+    )
+    _reporter: t.Any = dataclasses.field(default=None, init=False, repr=False)
+    _server: t.Any = dataclasses.field(default=None, init=False, repr=False)
+    _drops_timeout: t.Optional[int] = dataclasses.field(
+        default=None,
+        init=False,
+        repr=False,
+    )
+
+    @property
+    def uses_filters(self) -> bool:
+        """
+        Whether the filters are built, either enabled from the start or to
+        be toggled over the control socket.
+        """
+        return (
+            any(blur for _, blur in self.output_specs()) or
+            self.control_socket is not None
+        )
+
+    def output_specs(self) -> t.List[t.Tuple[Endpoint, t.Optional[int]]]:
+        """
+        Return the endpoint and background blur of every output, starting
+        with output_dev.
+        """
+        return [
+            (parse_endpoint(self.output_dev, SINK_SCHEMES), self.background_blur),
+            *(parse_output(x) for x in self.outputs),
+        ]
+
     def run(self):
-        init()
+        init(load_plugins=self.uses_filters)
 
         self.enable_hwdec_elements()
 
-        pipeline = self.build_pipeline()
-
         loop = GObject.MainLoop()
 
+        self.start(loop.quit)
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            loop.quit()
+        finally:
+            self.stop()
+
+    def start(self, on_exit: t.Callable[[], None]) -> None:
+        """
+        Build the pipeline and start playing it on the default main context.
+        on_exit is called once it ends (EOS) or fails (error).
+
+        GStreamer must be initialised already. stop() cleans up after a
+        start() that raised part way too.
+        """
+        self.check_endpoints()
+
+        if self.uses_filters:
+            self.check_segmentation_backend()
+
+        pipeline = self.build_pipeline()
+        self._pipeline = pipeline
+
         if self.verbose:
             pipeline.add_property_deep_notify_watch(None, True)
 
         bus = pipeline.get_bus()
         bus.add_signal_watch()
-        bus.connect("message", self.on_bus_message, loop, pipeline)
+        bus.connect("message", self.on_bus_message, on_exit, pipeline)
+
+        if self.stats or self.stats_file is not None:
+            from .stats import StatsReporter
+
+            self._reporter = StatsReporter(
+                pipeline,
+                self.stats_interval,
+                self.stats,
+                self.stats_file,
+            )
+            self._reporter.start()
+
+        if self.max_latency_ms:
+            self._drops_timeout = GLib.timeout_add_seconds(
+                1,
+                self.report_queue_drops,
+                {},
+            )
+
+        preload = self.selfie_segmentation_preload
+        if not preload and self.control_socket is not None:
+            # So switching models over the socket never stalls the video.
+            preload = list(SelfieSegmentationModel)
+
+        # Models the backend can't run would only fail in the background.
+        preload = [
+            x for x in preload
+            if self.segmentation_backend_error(x) is None
+        ]
+
+        if self.uses_filters and preload:
+            from .segmentation import GRAPH_POOL
+
+            threading.Thread(
+                target=GRAPH_POOL.warm_up,
+                args=([self.graph_spec(x) for x in preload],),
+                daemon=True,
+            ).start()
+
+        if self.control_socket is not None:
+            from .control import ControlServer
+
+            self._server = ControlServer(
+                self.control_socket,
+                lambda request: self.handle_control(pipeline, request),
+            )
+            try:
+                self._server.start()
+            except OSError as e:
+                self._server = None
+                click.echo(f"unable to listen on {self.control_socket}: {e}")
+                raise click.Abort()
 
         pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self) -> None:
+        """
+        Stop the pipeline and release everything start() set up.
+        """
+        if self._reporter is not None:
+            self._reporter.stop()
+            self._reporter = None
+
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+        if self._drops_timeout is not None:
+            GLib.source_remove(self._drops_timeout)
+            self._drops_timeout = None
+
+        if self._pipeline is not None:
+            self._pipeline.set_state(Gst.State.NULL)
+            self._pipeline.get_bus().remove_signal_watch()
+            self._pipeline = None
+
+    def check_endpoints(self) -> None:
+        """
+        Fail on query parameters the input and output elements don't have,
+        rather than part way through building the pipeline.
+        """
         try:
-            loop.run()
-        except KeyboardInterrupt:
-            loop.quit()
+            endpoints.check_params(
+                parse_endpoint(self.input_dev, SOURCE_SCHEMES),
+                output=False,
+            )
+            for endpoint, _ in self.output_specs():
+                endpoints.check_params(endpoint, output=True)
+        except ValueError as e:
+            raise click.ClickException(str(e))
 
-        pipeline.set_state(Gst.State.NULL)
+    def check_segmentation_backend(self) -> None:
+        """
+        Abort if the segmentation backend can't run the selected model, rather
+        than failing once the pipeline starts.
+        """
+        error = self.segmentation_backend_error(self.selfie_segmentation_model)
+
+        if error is not None:
+            click.echo(error)
+            raise click.Abort()
+
+    def segmentation_backend_error(
+        self,
+        model: SelfieSegmentationModel,
+    ) -> t.Optional[str]:
+        """
+        Return why the segmentation backend can't run model, or None if it
+        can.
+        """
+        if self.segmentation_backend != SegmentationBackend.onnxruntime:
+            return None
+
+        import importlib.util
+
+        if importlib.util.find_spec("onnxruntime") is None:
+            return (
+                "the onnxruntime backend needs the onnxruntime package "
+                "(e.g. pip install webcam-filters[onnx])"
+            )
+
+        path = onnx_model_path(str(self.segmentation_onnx_model_dir), model)
+
+        if not path.is_file():
+            return f"ONNX model {str(path)!r} not found"
+
+        return None
+
+    def graph_spec(self, model: SelfieSegmentationModel):
+        """
+        Return the segmentation GraphSpec of model with the backend settings.
+        """
+        if self.segmentation_backend == SegmentationBackend.mediapipe:
+            return GraphSpec(int(self.segmentation_backend), int(model))
+
+        return GraphSpec(
+            int(self.segmentation_backend),
+            int(model),
+            str(self.segmentation_onnx_model_dir),
+            self.segmentation_onnx_threads,
+            int(self.segmentation_onnx_optimization),
+        )
 
     def select_input(self) -> Gst.Caps:
         """
         Return Caps for input device that's closest to the desired values.
         """
-        dev = self.input_dev
+        dev = parse_endpoint(self.input_dev, SOURCE_SCHEMES).location
         media_type = self.input_media_type
         width = self.input_width
         height = self.input_height
         framerate = self.input_framerate
 
-        caps = query_device_caps(dev)
+        caps = device_caps(dev, refresh=True)
 
         if caps is None:
             click.echo(f"unable to determine capabilities for device {dev!r}")
@@ -183,16 +497,132 @@ class Pipeline:
         return new_caps
 
     def build_pipeline(self) -> Gst.Pipeline:
-        input_caps = self.select_input()
-        click.echo(f"Selected input: {input_caps}")
+        pipeline = Gst.Pipeline.new(self.name)
+
+        src = self.build_source(pipeline)
+        outputs = self.output_specs()
+
+        if len(outputs) > 1:
+            self.build_fanout(pipeline, src, outputs)
+            return pipeline
 
-        pipeline = Gst.Pipeline.new()
+        if self.control_socket is not None:
+            out = self.build_switchable_filters(pipeline, src)
+        else:
+            out = self.build_filters(pipeline, src, self.background_blur)
+        self.build_sink(pipeline, out, outputs[0][0])
+
+        return pipeline
+
+    def build_fanout(
+        self,
+        pipeline: Gst.Pipeline,
+        src: Gst.Element,
+        outputs: t.Sequence[t.Tuple[Endpoint, t.Optional[int]]],
+    ) -> None:
+        """
+        Feed every output from src through its own filters.
+
+        Decoding, conversion and segmentation happen once, and are shared
+        through tees however many outputs use them. Each output gets a queue
+        of its own, so a slow sink doesn't hold up the others.
+        """
+        frames = make_element("tee", "frames_tee")
+        pipeline.add(frames)
+        src.link(frames)
+
+        masks = None
+        if self.uses_filters:
+            masks = self.build_segmentation(pipeline, request_tee_pad(frames))
+
+        for i, (endpoint, background_blur) in enumerate(outputs):
+            queue = make_element("queue", f"output_queue_{i}")
+            self.configure_queue(queue)
+            pipeline.add(queue)
+            request_tee_pad(frames).link(queue.get_static_pad("sink"))
+
+            if i == 0 and self.control_socket is not None:
+                out = self.build_switchable_filters(pipeline, queue, masks)
+            elif background_blur:
+                out = self.build_blur(
+                    pipeline,
+                    queue.get_static_pad("src"),
+                    masks,
+                    background_blur,
+                    "blur" if i == 0 else f"blur_{i}",
+                )
+            else:
+                out = queue
+
+            self.build_sink(pipeline, out, endpoint)
+
+    def build_source(self, pipeline: Gst.Pipeline) -> Gst.Element:
+        """
+        Add the input and its conversion to RGB to the pipeline and return the
+        element producing RGB frames.
+        """
+        endpoint = parse_endpoint(self.input_dev, SOURCE_SCHEMES)
+
+        if endpoint.scheme == "v4l2":
+            input_caps = self.select_input()
+            click.echo(f"Selected input: {input_caps}")
+
+            src = make_element("v4l2src")
+            inputfilter = make_element("capsfilter")
+
+            src.set_property("device", endpoint.location)
+            self.set_io_mode(src, endpoint.location, output=False)
+            set_properties(src, endpoint.params)
+            inputfilter.set_property("caps", input_caps)
+
+            pipeline.add(src, inputfilter)
+            src.link(inputfilter)
+
+            source = inputfilter
+        else:
+            framerate = self.input_framerate
+            source = endpoints.make_source(
+                endpoint,
+                self.input_width,
+                self.input_height,
+                f"{framerate.numerator}/{framerate.denominator}",
+            )
+            pipeline.add(source)
 
-        src = make_element("v4l2src")
-        inputfilter = make_element("capsfilter")
         decodebin = make_element("decodebin3")
+        rgbconvert = self.make_rgbconvert()
+        rgbfilter = make_element("capsfilter")
 
+        rgbfilter.set_property(
+            "caps",
+            Gst.Caps.from_string(f"video/x-raw, format={self.frame_format}")
+        )
+
+        pipeline.add(
+            decodebin,
+            rgbconvert,
+            rgbfilter,
+        )
+
+        source.link(decodebin)
+        decodebin.connect(
+            "pad-added",
+            lambda dbin, pad: pad.link(rgbconvert.get_static_pad("sink"))
+        )
+        rgbconvert.link(rgbfilter)
+
+        return rgbfilter
+
+    @property
+    def frame_format(self) -> str:
+        """
+        Format of the frames fed to the filters.
+        """
+        return NATIVE_YUV_FORMAT if self.native_yuv else "RGB"
+
+    def make_rgbconvert(self) -> Gst.Element:
         if (
+            not self.native_yuv and
             self.hw_accel_api == HardwareAccelAPI.vaapi and
             VaapiFeature.rgbconvert in self.vaapi_features
         ):
@@ -201,16 +631,268 @@ class Pipeline:
             # fallback to some variant of RGBA and then use videoconvert to
             # to get to RGB.
             c= ";".join(f"video/x-raw, format={f}" for f in reversed(RGB_FORMATS))
-            rgbconvert = Gst.parse_bin_from_description(
+            return Gst.parse_bin_from_description(
                 f"vaapipostproc ! {c} ! videoconvert",
                 True
             )
+
+        return make_element("videoconvert")
+
+    def build_switchable_filters(
+        self,
+        pipeline: Gst.Pipeline,
+        rgbfilter: Gst.Element,
+        masks: t.Optional[Gst.Element] = None,
+    ) -> Gst.Element:
+        """
+        Add the filters to the pipeline along with a bypass around them, so
+        they can be turned on and off over the control socket without
+        renegotiating, and return the element producing the output frames.
+
+        The valve stops frames going into the filters while they're off and
+        the selector picks either their output or the bypass.
+        """
+        tee = make_element("tee", "bypass_tee")
+        valve = make_element("valve", "filters_valve")
+        selector = make_element("input-selector", "filters_selector")
+
+        # Frames on the inactive pad are dropped instead of waiting for the
+        # active one.
+        selector.set_property("sync-streams", False)
+
+        pipeline.add(tee, valve, selector)
+        rgbfilter.link(tee)
+        request_tee_pad(tee).link(valve.get_static_pad("sink"))
+
+        out = self.build_filters(
+            pipeline,
+            valve,
+            self.background_blur or DEFAULT_BACKGROUND_BLUR,
+            masks,
+        )
+
+        sink_template = selector.get_pad_template("sink_%u")
+        filtered = selector.request_pad(sink_template, "sink_0", None)
+        bypass = selector.request_pad(sink_template, "sink_1", None)
+
+        out.get_static_pad("src").link(filtered)
+        request_tee_pad(tee).link(bypass)
+
+        self.set_filters_enabled(pipeline, bool(self.background_blur))
+
+        return selector
+
+    def set_filters_enabled(self, pipeline: Gst.Pipeline, enabled: bool) -> None:
+        valve = pipeline.get_by_name("filters_valve")
+        selector = pipeline.get_by_name("filters_selector")
+
+        if enabled:
+            valve.set_property("drop", False)
+            selector.set_property(
+                "active-pad",
+                selector.get_static_pad("sink_0")
+            )
         else:
-            rgbconvert = make_element("videoconvert")
+            selector.set_property(
+                "active-pad",
+                selector.get_static_pad("sink_1")
+            )
+            valve.set_property("drop", True)
 
-        rgbfilter = make_element("capsfilter")
-        tee = make_element("tee")
+    def handle_control(
+        self,
+        pipeline: Gst.Pipeline,
+        request: t.Dict[str, t.Any],
+    ) -> t.Dict[str, t.Any]:
+        """
+        Apply the "set" settings of a control socket request and return the
+        current values of all of them.
+        """
+        elements = [
+            e for e in map(pipeline.get_by_name, FILTER_ELEMENTS)
+            if e is not None
+        ]
+        settings = request.get("set", {})
+
+        if not isinstance(settings, dict):
+            raise ValueError("set must be a JSON object")
+
+        # Every setting is checked before any is applied, so a request with
+        # a bad one leaves the pipeline as it was.
+        filters = None
+        changes = []
+
+        for name, value in settings.items():
+            if name == "filters":
+                if not isinstance(value, bool):
+                    raise ValueError("filters must be true or false")
+                filters = value
+                continue
+
+            if name not in CONTROLS:
+                raise ValueError(f"unknown setting {name!r}")
+
+            prop, convert = CONTROLS[name]
+            value = convert(value)
+
+            for e in elements:
+                pspec = e.find_property(prop)
+                if pspec is None:
+                    continue
+
+                if not pspec.minimum <= value <= pspec.maximum:
+                    raise ValueError(
+                        f"{name} must be between {pspec.minimum} and "
+                        f"{pspec.maximum}"
+                    )
+
+                changes.append((e, prop, value))
+
+        for e, prop, value in changes:
+            e.set_property(prop, value)
+
+        if filters is not None:
+            self.set_filters_enabled(pipeline, filters)
+
+        values = {
+            "filters": not pipeline.get_by_name("filters_valve").get_property(
+                "drop"
+            ),
+        }
+        for name, (prop, _) in CONTROLS.items():
+            for e in elements:
+                if e.find_property(prop) is not None:
+                    values[name] = e.get_property(prop)
+                    break
+
+        if "selfie-segmentation-model" in values:
+            values["selfie-segmentation-model"] = str(
+                SelfieSegmentationModel(values["selfie-segmentation-model"])
+            )
+
+        if "segmentation-backend" in values:
+            values["segmentation-backend"] = str(
+                SegmentationBackend(values["segmentation-backend"])
+            )
+
+        return {"values": values}
+
+    def build_filters(
+        self,
+        pipeline: Gst.Pipeline,
+        rgbfilter: Gst.Element,
+        background_blur: t.Optional[int],
+        masks: t.Optional[Gst.Element] = None,
+    ) -> Gst.Element:
+        """
+        Add the filters to the pipeline, fed by the frames (in frame_format)
+        from rgbfilter, and return the element producing the filtered frames.
+
+        masks is a tee of masks (see build_segmentation) to use instead of
+        segmenting the frames here.
+        """
+        out = rgbfilter
+
+        if background_blur and self.fused_pipeline and masks is None:
+            # Segmentation, blur and compositing in a single element
+            blured = make_element("selfie_blur", "blur")
+            self.set_selfie_properties(blured)
+            blured.set_property("ksize", background_blur)
+            blured.set_property("downscale", self.background_blur_downscale)
+            pipeline.add(blured)
+            rgbfilter.link(blured)
+
+            out = blured
+
+        elif background_blur:
+            frames = rgbfilter.get_static_pad("src")
+
+            if masks is None:
+                tee = make_element("tee")
+                pipeline.add(tee)
+                rgbfilter.link(tee)
+
+                masks = self.build_segmentation(pipeline, request_tee_pad(tee))
+                frames = request_tee_pad(tee)
+
+            out = self.build_blur(
+                pipeline,
+                frames,
+                masks,
+                background_blur,
+                "blur",
+            )
+
+        return out
+
+    def build_segmentation(
+        self,
+        pipeline: Gst.Pipeline,
+        frames: Gst.Pad,
+    ) -> Gst.Element:
+        """
+        Add segmentation of the frames from the frames pad to the pipeline and
+        return a tee of the resulting GRAY8 masks, which any number of blur
+        elements can share.
+        """
+        selfie_queue = make_element("queue", "selfie_queue")
+        self.configure_queue(selfie_queue)
+        selfie = make_element("selfie_seg", "selfie")
+        self.set_selfie_properties(selfie)
+        masks = make_element("tee", "mask_tee")
+
+        pipeline.add(selfie_queue, selfie, masks)
+        frames.link(selfie_queue.get_static_pad("sink"))
+        selfie_queue.link(selfie)
+        selfie.link_filtered(
+            masks,
+            Gst.Caps.from_string("video/x-raw, format=GRAY8")
+        )
+
+        return masks
+
+    def build_blur(
+        self,
+        pipeline: Gst.Pipeline,
+        frames: Gst.Pad,
+        masks: Gst.Element,
+        background_blur: int,
+        name: str,
+    ) -> Gst.Element:
+        """
+        Add a blur of the background of the frames from the frames pad, using
+        masks from the masks tee, and return it.
+        """
+        # Blurs only the background regions of the frame and composites in
+        # the same pass.
+        blured = make_element("background_blur", name)
+        blured.set_property("ksize", background_blur)
+        blured.set_property("downscale", self.background_blur_downscale)
+        blured.set_property("n-threads", self.background_blur_threads)
+        if self.max_latency_ms:
+            # Wait at most this long for a mask before compositing with the
+            # previous one.
+            blured.set_property(
+                "latency",
+                self.max_latency_ms * Gst.MSECOND
+            )
+        pipeline.add(blured)
+
+        request_tee_pad(masks).link(blured.get_static_pad("mask"))
+        frames.link(blured.get_static_pad("frame"))
+
+        return blured
 
+    def build_sink(
+        self,
+        pipeline: Gst.Pipeline,
+        out: Gst.Element,
+        endpoint: Endpoint,
+    ) -> None:
+        """
+        Add the conversion to the output format and the output endpoint to the
+        pipeline, fed by out.
+        """
         if (
             self.hw_accel_api == HardwareAccelAPI.vaapi and
             VaapiFeature.sinkconvert in self.vaapi_features
@@ -224,80 +906,163 @@ class Pipeline:
             sinkconvert = make_element("videoconvert")
 
         sinkfilter = make_element("capsfilter")
-        sink = make_element("v4l2sink")
+        sink = self.make_sink(endpoint)
 
-        src.set_property("device", self.input_dev)
-        inputfilter.set_property("caps", input_caps)
-        rgbfilter.set_property(
-            "caps",
-            Gst.Caps.from_string("video/x-raw, format=RGB")
-        )
         sinkfilter.set_property(
             "caps",
             Gst.Caps.from_string(f"video/x-raw, format=YUY2")
         )
-        sink.set_property("device", self.output_dev)
+
+        pipeline.add(sinkconvert, sinkfilter, sink)
+
+        out.link(sinkconvert)
+        sinkconvert.link(sinkfilter)
+        sinkfilter.link(sink)
+
+    def make_sink(self, endpoint: Endpoint) -> Gst.Element:
+        if endpoint.scheme != "v4l2":
+            return endpoints.make_sink(endpoint)
+
+        sink = make_element("v4l2sink")
+        sink.set_property("device", endpoint.location)
         sink.set_property("throttle-time", 10)
         sink.set_property("qos", True)
+        self.set_io_mode(sink, endpoint.location, output=True)
+        set_properties(sink, endpoint.params)
 
-        pipeline.add(
-            src,
-            inputfilter,
-            decodebin,
-            rgbconvert,
-            rgbfilter,
-            tee,
-            sinkconvert,
-            sinkfilter,
-            sink,
-        )
+        return sink
 
-        src.link(inputfilter)
-        inputfilter.link(decodebin)
-        decodebin.connect(
-            "pad-added",
-            lambda dbin, pad: pad.link(rgbconvert.get_static_pad("sink"))
-        )
-        rgbconvert.link(rgbfilter)
-        rgbfilter.link(tee)
+    def set_io_mode(self, element: Gst.Element, dev: str, output: bool) -> None:
+        """
+        Set the io-mode of a v4l2src or v4l2sink to io_mode, if the device
+        supports it. Otherwise leave it on auto.
 
-        out = tee
-
-        need_selfie = self.background_blur or False
-
-        if need_selfie:
-            selfie_queue = make_element("queue", "selfie_queue")
-            selfie = make_element("selfie_seg")
-            selfie.set_property("model", self.selfie_segmentation_model)
-            selfie.set_property("threshold", self.selfie_segmentation_threshold)
-            pipeline.add(selfie_queue, selfie)
-            tee.link(selfie_queue)
-            selfie_queue.link(selfie)
-
-        if self.background_blur:
-            blured_queue = make_element("queue", "blured_queue")
-            blured = make_element("cv2_boxfilter")
-            blured.set_property("ksize", self.background_blur)
-            pipeline.add(blured_queue, blured)
-            tee.link(blured_queue)
-            blured_queue.link(blured)
-
-            where = make_element("numpy_where")
-            pipeline.add(where)
-            selfie.get_static_pad("src").link(where.get_static_pad("condition"))
-            tee.request_pad(tee.get_pad_template("src_%u"), None, None).link(
-                where.get_static_pad("x")
+        With dmabuf, v4l2src exports its mmap buffers as DMABufs and v4l2sink
+        imports the DMABufs it's given.
+        """
+        if self.io_mode == IOMode.auto:
+            return
+
+        if self.io_mode == IOMode.userptr:
+            memory = v4l2.V4L2_MEMORY_USERPTR
+            mode = "userptr"
+        elif self.io_mode == IOMode.dmabuf and output:
+            memory = v4l2.V4L2_MEMORY_DMABUF
+            mode = "dmabuf-import"
+        elif self.io_mode == IOMode.dmabuf:
+            memory = v4l2.V4L2_MEMORY_MMAP
+            mode = "dmabuf"
+        else:
+            memory = v4l2.V4L2_MEMORY_MMAP
+            mode = "mmap"
+
+        try:
+            supported = v4l2.supports_memory(dev, output, memory)
+        except OSError as e:
+            click.secho(f"failed to query io modes of {dev!r}: {e}", fg="red")
+            supported = False
+
+        if not supported:
+            click.secho(
+                f"{dev!r} doesn't support io-mode {mode}, using auto",
+                fg="red"
             )
-            blured.get_static_pad("src").link(where.get_static_pad("y"))
+            return
 
-            out = where
+        Gst.util_set_object_arg(element, "io-mode", mode)
 
-        out.link(sinkconvert)
-        sinkconvert.link(sinkfilter)
-        sinkfilter.link(sink)
+    def configure_queue(self, queue: Gst.Element) -> None:
+        """
+        Bound queue to max_latency_ms worth of frames, dropping the oldest
+        frame when it's full rather than letting latency grow.
+        """
+        if not self.max_latency_ms:
+            return
 
-        return pipeline
+        framerate = self.input_framerate
+        max_buffers = max(1, int(self.max_latency_ms * framerate / 1000))
+
+        queue.set_property("max-size-buffers", max_buffers)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", self.max_latency_ms * Gst.MSECOND)
+        Gst.util_set_object_arg(queue, "leaky", "downstream")
 
+        name = queue.get_name()
+        self.queue_drops[name] = 0
+
+        def on_overrun(queue):
+            self.queue_drops[name] += 1
+
+        queue.connect("overrun", on_overrun)
+
+    def report_queue_drops(self, reported: t.Dict[str, int]) -> bool:
+        """
+        Print how many frames each queue dropped since the last report.
+        """
+        for name, dropped in self.queue_drops.items():
+            new = dropped - reported.get(name, 0)
+            reported[name] = dropped
+
+            if new:
+                click.echo(
+                    f"Dropped {new} frame(s) in {name} to stay within "
+                    f"{self.max_latency_ms}ms latency"
+                )
+
+        return True
+
+    def set_selfie_properties(self, selfie: Gst.Element) -> None:
+        """
+        Configure the selfie segmentation properties of selfie_seg or
+        selfie_blur.
+        """
+        selfie.set_property("model", self.selfie_segmentation_model)
+        selfie.set_property("threshold", self.selfie_segmentation_threshold)
+        selfie.set_property("feather", self.selfie_segmentation_feather)
+        selfie.set_property("smoothing", self.selfie_segmentation_smoothing)
+        selfie.set_property("hysteresis", self.selfie_segmentation_hysteresis)
+        selfie.set_property("interval", self.selfie_segmentation_interval)
+        selfie.set_property(
+            "motion-threshold",
+            self.selfie_segmentation_motion_threshold
+        )
+        selfie.set_property("async", self.selfie_segmentation_async)
+        selfie.set_property(
+            "queue-depth",
+            self.selfie_segmentation_queue_depth
+        )
+        selfie.set_property(
+            "drop-policy",
+            self.selfie_segmentation_drop_policy
+        )
+        selfie.set_property(
+            "inference-width",
+            self.selfie_segmentation_width
+        )
+        selfie.set_property(
+            "inference-height",
+            self.selfie_segmentation_height
+        )
+        selfie.set_property(
+            "interpolation",
+            self.selfie_segmentation_interpolation
+        )
+        selfie.set_property("backend", self.segmentation_backend)
+        selfie.set_property(
+            "onnx-model-dir",
+            str(self.segmentation_onnx_model_dir)
+        )
+        selfie.set_property("onnx-threads", self.segmentation_onnx_threads)
+        selfie.set_property(
+            "onnx-optimization",
+            self.segmentation_onnx_optimization
+        )
+        selfie.set_property("shared-graph", self.shared_segmentation)
+        selfie.set_property(
+            "batch-window",
+            self.selfie_segmentation_batch_window_ms
+        )
+        selfie.set_property("max-batch", self.selfie_segmentation_max_batch)
 
     def enable_hwdec_elements(self) -> None:
         if self.hw_accel_api == HardwareAccelAPI.off:
@@ -333,7 +1098,7 @@ class Pipeline:
         self,
         bus: Gst.Bus,
         message: Gst.Message,
-        loop: GObject.MainLoop,
+        on_exit: t.Callable[[], None],
         pipeline: Gst.Pipeline,
     ) -> bool:
         mtype = message.type
@@ -345,7 +1110,7 @@ class Pipeline:
             click.echo(f"type: {mtype}")
 
         if mtype == Gst.MessageType.EOS:
-            loop.quit()
+            on_exit()
 
         elif mtype == Gst.MessageType.ERROR:
             gerror, debug = message.parse_error()
@@ -353,7 +1118,7 @@ class Pipeline:
             if self.verbose:
                 click.echo(f"Debug: {debug}")
 
-            loop.quit()
+            on_exit()
 
         elif mtype == Gst.MessageType.WARNING:
             gerror, debug = message.parse_warning()
@@ -372,10 +1137,32 @@ class Pipeline:
 
             click.echo(f"{name}: {value}")
 
+        elif mtype == Gst.MessageType.ELEMENT and self.verbose:
+            s = message.get_structure()
+
+            if s.get_name() == "selfie-seg-stats":
+                click.echo(
+                    f"Selfie segmentation: {s.get_value('hits')} cached, "
+                    f"{s.get_value('misses')} inferred "
+                    f"({s.get_value('hit-ratio'):.0%} cached)"
+                )
+
+                if s.has_field("dropped"):
+                    click.echo(
+                        f"Selfie segmentation: {s.get_value('dropped')} "
+                        "frames dropped from the inference queue"
+                    )
+
+                if s.has_field("mean-batch"):
+                    click.echo(
+                        f"Selfie segmentation: {s.get_value('mean-batch'):.1f} "
+                        "frames per batch on average"
+                    )
+
         elif mtype == Gst.MessageType.STATE_CHANGED and src == pipeline:
             old, new, pending = message.parse_state_changed()
 
-            click.echo("Pipeline: ", nl=False)
+            click.echo(f"{self.name or 'Pipeline'}: ", nl=False)
             if new == Gst.State.PAUSED:
                 click.echo("PAUSED")
             elif new == Gst.State.READY:
@@ -388,6 +1175,42 @@ class Pipeline:
         return True
 
 
+def parse_output(value: str) -> t.Tuple[Endpoint, t.Optional[int]]:
+    """
+    Parse an --output URI into its endpoint and background blur, given by
+    the background-blur query parameter.
+    """
+    endpoint = parse_endpoint(value, SINK_SCHEMES)
+    background_blur = endpoint.params.pop("background-blur", None)
+
+    if background_blur is not None:
+        if not background_blur.isdigit() or not 1 <= int(background_blur) <= 200:
+            raise ValueError(
+                f"background-blur must be between 1 and 200 in {value!r}"
+            )
+        background_blur = int(background_blur)
+
+    return endpoint, background_blur
+
+
+def validate_outputs(
+    ctx: click.Context,
+    param: click.Parameter,
+    values: t.Sequence[str],
+) -> t.Sequence[str]:
+    for value in values:
+        try:
+            parse_output(value)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+    return values
+
+
+def request_tee_pad(tee: Gst.Element) -> Gst.Pad:
+    return tee.request_pad(tee.get_pad_template("src_%u"), None, None)
+
+
 def make_element(factoryname: str, name: t.Optional[str] = None) -> Gst.Element:
     elm = Gst.ElementFactory.make(factoryname, name)
 
@@ -417,6 +1240,49 @@ def query_device_caps(dev: str) -> t.Optional[Gst.Caps]:
     return caps
 
 
+def device_caps(dev: str, refresh: bool = False) -> t.Optional[Gst.Caps]:
+    """
+    Return the capabilities of dev, from the on-disk cache when they are
+    current, and cache them otherwise.
+
+    With refresh, cached caps are still returned straight away, but the
+    device is probed again in the background so that changes the
+    fingerprint doesn't catch are picked up on the next start.
+    """
+    caps = caps_cache.load(dev)
+
+    if caps is None:
+        caps = query_device_caps(dev)
+
+        if caps is not None:
+            caps_cache.store(dev, caps)
+
+    elif refresh:
+        threading.Thread(
+            target=refresh_device_caps,
+            args=(dev, caps.copy()),
+            daemon=True,
+        ).start()
+
+    return caps
+
+
+def refresh_device_caps(dev: str, cached: Gst.Caps) -> None:
+    caps = query_device_caps(dev)
+
+    if caps is None:
+        # e.g. the device is busy streaming already
+        return
+
+    if not caps.is_equal(cached):
+        click.echo(
+            f"capabilities of {dev!r} changed, they'll be used from the "
+            "next start"
+        )
+
+    caps_cache.store(dev, caps)
+
+
 def print_device_caps(
     ctx: click.Context,
     param: click.Parameter,
@@ -425,17 +1291,23 @@ def print_device_caps(
     """
     Print device capabilities and exit.
     """
-    init()
-
+    # click calls eager callbacks even when the option isn't given, and
+    # GStreamer can only be initialised once, so only initialise it (without
+    # the plugins) when the caps are listed.
     if not value or ctx.resilient_parsing:
         return
 
-    caps = query_device_caps(value)
+    init(load_plugins=False)
+
+    caps = device_caps(value)
 
     if caps is None:
         click.echo(f"unable to determine capabilities for device {value!r}")
         ctx.exit(1)
 
+    from rich.console import Console
+    from rich.table import Table
+
     table = Table(title=f"{value!r} Capabilites")
 
     table.add_column("Media Type")
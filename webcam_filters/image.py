@@ -0,0 +1,213 @@
+"""
+Image operations shared by the filter elements.
+
+Frames are HxWx3 uint8 RGB numpy arrays or YUVFrames of planar YUV 4:2:0, and
+masks are HxW (or HxWx1) uint8 arrays where 255 is foreground and 0 is
+background.
+"""
+import typing as t
+
+import cv2
+import numpy
+
+
+# With automatic downscaling the frame is shrunk so the kernel is roughly this
+# many pixels wide, but never by more than MAX_AUTO_DOWNSCALE.
+AUTO_DOWNSCALE_KSIZE = 16
+MAX_AUTO_DOWNSCALE = 8
+
+
+class YUVFrame(t.NamedTuple):
+    """
+    Planes of a YUV 4:2:0 frame. For I420 u and v are separate ceil(H/2) x
+    ceil(W/2) planes, for NV12 u is the interleaved ceil(H/2) x ceil(W/2) x 2
+    chroma plane and v is None.
+    """
+    y: numpy.ndarray
+    u: numpy.ndarray
+    v: t.Optional[numpy.ndarray]
+
+
+Frame = t.Union[numpy.ndarray, YUVFrame]
+
+
+def frame_planes(frame: Frame) -> t.List[t.Tuple[numpy.ndarray, int]]:
+    """
+    Return (plane, subsampling) for every plane of the frame, where
+    subsampling is 1 for full resolution planes and 2 for chroma planes.
+
+    Single channel planes are HxW, the others HxWxC.
+    """
+    if not isinstance(frame, YUVFrame):
+        return [(frame, 1)]
+
+    if frame.v is None:
+        return [(frame.y, 1), (frame.u, 2)]
+
+    return [(frame.y, 1), (frame.u, 2), (frame.v, 2)]
+
+
+def channels(plane: numpy.ndarray) -> numpy.ndarray:
+    """
+    Return plane as HxWxC, adding a channel axis to single channel planes.
+    """
+    if plane.ndim == 2:
+        return plane[..., None]
+
+    return plane
+
+
+def yuv_to_rgb(
+    frame: YUVFrame,
+    dst: numpy.ndarray,
+    scratch: numpy.ndarray,
+) -> None:
+    """
+    Scale frame to the (even) size of the HxWx3 dst and convert it to RGB.
+
+    scratch is a (H * 3 / 2)xW uint8 array the scaled planes are assembled
+    in, so only a frame of dst's size is ever converted.
+    """
+    height, width = dst.shape[:2]
+    csize = (width // 2, height // 2)
+    chroma = scratch[height:].reshape(-1)
+
+    cv2.resize(
+        frame.y,
+        (width, height),
+        dst=scratch[:height],
+        interpolation=cv2.INTER_AREA
+    )
+
+    if frame.v is None:
+        cv2.resize(
+            frame.u,
+            csize,
+            dst=chroma.reshape(csize[1], csize[0], 2),
+            interpolation=cv2.INTER_AREA
+        )
+        code = cv2.COLOR_YUV2RGB_NV12
+    else:
+        n = csize[0] * csize[1]
+        for plane, out in ((frame.u, chroma[:n]), (frame.v, chroma[n:])):
+            cv2.resize(
+                plane,
+                csize,
+                dst=out.reshape(csize[1], csize[0]),
+                interpolation=cv2.INTER_AREA
+            )
+        code = cv2.COLOR_YUV2RGB_I420
+
+    cv2.cvtColor(scratch, code, dst=dst)
+
+
+def auto_downscale(ksize: int) -> int:
+    """
+    Return the factor to shrink a frame by before blurring it with ksize.
+    """
+    return max(1, min(ksize // AUTO_DOWNSCALE_KSIZE, MAX_AUTO_DOWNSCALE))
+
+
+def box_blur(
+    src: numpy.ndarray,
+    dst: numpy.ndarray,
+    ksize: int,
+    factor: int = 1,
+) -> None:
+    """
+    Box blur src into dst (which may be src) at 1/factor of the resolution.
+    """
+    if factor == 1:
+        cv2.boxFilter(src, -1, (ksize, ksize), dst=dst)
+        return
+
+    height, width = src.shape[:2]
+    swidth = max(1, round(width / factor))
+    sheight = max(1, round(height / factor))
+    sksize = max(1, round(ksize / factor))
+
+    small = cv2.resize(src, (swidth, sheight), interpolation=cv2.INTER_AREA)
+    cv2.boxFilter(small, -1, (sksize, sksize), dst=small)
+    cv2.resize(small, (width, height), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+
+def blend(
+    alpha: numpy.ndarray,
+    x: numpy.ndarray,
+    y: numpy.ndarray,
+    res: numpy.ndarray,
+    a: numpy.ndarray,
+    d: numpy.ndarray,
+) -> None:
+    """
+    res = y + (x - y) * alpha / 255 in 7-bit fixed point.
+
+    alpha is HxWx1 uint8, x, y and res are HxWx3 uint8. a (HxWx1) and
+    d (HxWx3) are int16 scratch arrays, so nothing frame sized is allocated.
+
+    alpha is scaled from [0, 255] to [0, 128] so that (x - y) * alpha fits
+    in int16, and 0 and 255 reproduce y and x exactly.
+    """
+    numpy.right_shift(alpha, 7, out=a, dtype=numpy.int16)
+    numpy.add(a, alpha, out=a)
+    numpy.right_shift(a, 1, out=a)
+
+    numpy.subtract(x, y, out=d, dtype=numpy.int16)
+    numpy.multiply(d, a, out=d)
+    numpy.right_shift(d, 7, out=d)
+    numpy.add(d, y, out=res, dtype=numpy.int16, casting="unsafe")
+
+
+def background_regions(
+    mask: numpy.ndarray,
+    band: int,
+) -> t.List[t.Tuple[int, int, int, int]]:
+    """
+    Return (top, bottom, left, right) rectangles covering every pixel of the
+    HxW mask that isn't fully foreground.
+
+    The mask is split into horizontal bands of the given height. Runs of
+    adjacent bands with any background are merged, and each run is cropped
+    to the columns that contain background.
+    """
+    height = mask.shape[0]
+    regions = []
+    top = None
+
+    for r in range(0, height + band, band):
+        has_background = r < height and mask[r:r + band].min() < 255
+
+        if has_background and top is None:
+            top = r
+        elif not has_background and top is not None:
+            bottom = min(r, height)
+            cols = numpy.flatnonzero(mask[top:bottom].min(axis=0) < 255)
+            regions.append((top, bottom, int(cols[0]), int(cols[-1]) + 1))
+            top = None
+
+    return regions
+
+
+def merge_regions(
+    regions: t.List[t.Tuple[int, int, int, int]],
+    gap: int,
+) -> t.List[t.Tuple[int, int, int, int]]:
+    """
+    Merge (top, bottom, left, right) rectangles, sorted by top, that are
+    fewer than gap rows apart into their bounding rectangle.
+    """
+    merged = []
+
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < gap:
+            top, bottom, left, right = merged[-1]
+            merged[-1] = (
+                top,
+                max(bottom, region[1]),
+                min(left, region[2]),
+                max(right, region[3]),
+            )
+        else:
+            merged.append(region)
+
+    return merged
@@ -1,4 +1,5 @@
 from fractions import Fraction
+from pathlib import Path
 from .click import (
     click,
     print_version,
@@ -10,10 +11,25 @@ from .click import (
 )
 from .mediapipe import (
     SelfieSegmentationModel,
+    MaskInterpolation,
+    DropPolicy,
 )
+from .backends import (
+    SegmentationBackend,
+    OnnxOptimization,
+)
+from .endpoints import (
+    SOURCE_SCHEMES,
+    SINK_SCHEMES,
+    validate_endpoint,
+)
+from . import DATA_DIR
+from .tiling import DEFAULT_N_THREADS, MAX_N_THREADS
 from .gst import (
   print_device_caps,
+  validate_outputs,
   HardwareAccelAPI,
+  IOMode,
   Pipeline,
   VaapiFeature,
 )
@@ -22,9 +38,13 @@ from .gst import (
 @click.command()
 @click.option(
     "--input-dev",
-    help="Input device (e.g. real webcam at /dev/video0).",
+    help="""
+    Input device (e.g. real webcam at /dev/video0) or URI
+    (v4l2://, file://, shm:// or fd://).
+    """,
     type=str,
     required=True,
+    callback=validate_endpoint(SOURCE_SCHEMES),
 )
 @click.option(
     "--input-width",
@@ -56,9 +76,28 @@ from .gst import (
 )
 @click.option(
     "--output-dev",
-    help="Output device (e.g. virtual webcam at /dev/video3).",
+    help="""
+    Output device (e.g. virtual webcam at /dev/video3) or URI
+    (v4l2://, file://, shm://, fd:// or appsink://).
+    """,
     type=str,
     required=True,
+    callback=validate_endpoint(SINK_SCHEMES),
+)
+@click.option(
+    "--output",
+    "outputs",
+    help="""
+    Additional output device or URI, fed from the same input. May be given
+    multiple times. A background-blur query parameter
+    (e.g. /dev/video4?background-blur=150) blurs that output. Otherwise it
+    gets the unfiltered frames. Decoding and segmentation are shared by all
+    outputs, so --fused-pipeline doesn't apply.
+    """,
+    type=str,
+    multiple=True,
+    default=[],
+    callback=validate_outputs,
 )
 @click.option(
     "--background-blur",
@@ -66,6 +105,21 @@ from .gst import (
     type=click.IntRange(0, 200),
     default=None,
 )
+@click.option(
+    "--background-blur-downscale",
+    help="""
+    Blur the background at 1/N of the resolution and scale it back up.
+    0 picks N based on --background-blur, 1 blurs at full resolution.
+    """,
+    type=click.IntRange(0, 16),
+    default=0,
+)
+@click.option(
+    "--background-blur-threads",
+    help="Number of threads to blur bands of each frame on.",
+    type=click.IntRange(1, MAX_N_THREADS),
+    default=DEFAULT_N_THREADS,
+)
 @click.option(
     "--selfie-segmentation-model",
     help="Mediapipe model used for selfie segmentation",
@@ -78,6 +132,186 @@ from .gst import (
     type=click.FloatRange(min=0, max=1),
     default=0.5,
 )
+@click.option(
+    "--selfie-segmentation-feather",
+    help="""
+    Soften the mask edges by blending foreground and background across a
+    band of this width around the threshold (0 for a hard edge).
+    """,
+    type=click.FloatRange(min=0, max=1),
+    default=0.0,
+)
+@click.option(
+    "--selfie-segmentation-smoothing",
+    help="""
+    Steady flickering mask edges by averaging the model's output over time.
+    The weight of the previous masks in the average (0 disables it).
+    """,
+    type=click.FloatRange(min=0, max=0.99),
+    default=0.0,
+)
+@click.option(
+    "--selfie-segmentation-hysteresis",
+    help="""
+    Width of a band around the threshold within which pixels stay on the
+    side of the mask they were on, so they don't flip back and forth.
+    Ignored with --selfie-segmentation-feather.
+    """,
+    type=click.FloatRange(min=0, max=1),
+    default=0.0,
+)
+@click.option(
+    "--selfie-segmentation-interval",
+    help="""
+    Run selfie segmentation on every Nth frame and reuse the last mask for
+    the frames in between.
+    """,
+    type=click.IntRange(min=1),
+    default=1,
+)
+@click.option(
+    "--selfie-segmentation-motion-threshold",
+    help="""
+    Re-run selfie segmentation before the interval is up when the mean
+    absolute difference (0-1) from the last segmented frame reaches this.
+    0 disables motion detection.
+    """,
+    type=click.FloatRange(min=0, max=1),
+    default=0.0,
+)
+@click.option(
+    "--selfie-segmentation-async",
+    help="""
+    Run selfie segmentation on a background thread. Frames are passed
+    through with the most recent completed mask instead of waiting on the
+    model.
+    """,
+    is_flag=True,
+    default=False,
+    show_default=False,
+)
+@click.option(
+    "--selfie-segmentation-queue-depth",
+    help="Frames waiting for background selfie segmentation.",
+    type=click.IntRange(1, 64),
+    default=1,
+)
+@click.option(
+    "--selfie-segmentation-drop-policy",
+    help="Frame to drop when the background segmentation queue is full.",
+    type=EnumChoice(DropPolicy),
+    default=DropPolicy.drop_oldest,
+)
+@click.option(
+    "--selfie-segmentation-width",
+    help="""
+    Width frames are scaled down to before selfie segmentation (e.g. 256,
+    which is much cheaper and barely changes the mask).
+    0 derives it from the height (or uses the input width if both are 0).
+    """,
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--selfie-segmentation-height",
+    help="""
+    Height frames are scaled down to before selfie segmentation.
+    0 derives it from the width (or uses the input height if both are 0).
+    """,
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--selfie-segmentation-interpolation",
+    help="Interpolation used to scale the segmentation mask back up.",
+    type=EnumChoice(MaskInterpolation),
+    default=MaskInterpolation.bilinear,
+)
+@click.option(
+    "--selfie-segmentation-preload",
+    help="""
+    Segmentation model to load in the background at start up, so switching
+    to it later takes effect immediately instead of once it's loaded. May be
+    given multiple times.
+    """,
+    type=EnumChoice(SelfieSegmentationModel),
+    multiple=True,
+    default=[],
+)
+@click.option(
+    "--segmentation-backend",
+    help="""
+    Engine running the selfie segmentation model. onnxruntime needs the
+    onnxruntime package and the models in --segmentation-onnx-model-dir.
+    """,
+    type=EnumChoice(SegmentationBackend),
+    default=SegmentationBackend.mediapipe,
+)
+@click.option(
+    "--segmentation-onnx-model-dir",
+    help="""
+    Directory with the ONNX models of the onnxruntime backend, named after
+    the model (general.onnx, landscape.onnx). int8 quantised models work
+    too.
+    """,
+    type=click.Path(file_okay=False, path_type=Path),
+    default=str(DATA_DIR / "models"),
+)
+@click.option(
+    "--segmentation-onnx-threads",
+    help="""
+    Threads onnxruntime runs each operator on. 0 uses one per core.
+    """,
+    type=click.IntRange(0, 1024),
+    default=0,
+)
+@click.option(
+    "--segmentation-onnx-optimization",
+    help="Graph optimizations onnxruntime applies to the model.",
+    type=EnumChoice(OnnxOptimization),
+    default=OnnxOptimization.all,
+)
+@click.option(
+    "--fused-pipeline",
+    help="""
+    Segment, blur and composite in a single element instead of separate
+    branches, avoiding the hand-offs between streaming threads.
+    """,
+    is_flag=True,
+    default=False,
+    show_default=False,
+)
+@click.option(
+    "--native-yuv",
+    help="""
+    Filter frames as planar YUV (I420) instead of RGB, skipping the
+    conversion to RGB and back. Only segmentation converts frames to RGB,
+    at its inference size.
+    """,
+    is_flag=True,
+    default=False,
+    show_default=False,
+)
+@click.option(
+    "--max-latency-ms",
+    help="""
+    Latency budget in milliseconds. Queues hold at most this much and drop
+    the oldest frame when full, and compositing waits at most this long for
+    a mask before reusing the previous one. 0 uses the GStreamer defaults.
+    """,
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--io-mode",
+    help="""
+    How frames are exchanged with v4l2 devices. dmabuf and userptr avoid
+    copying frames in and out of the driver, and fall back to auto when the
+    device doesn't support them.
+    """,
+    type=EnumChoice(IOMode),
+    default=IOMode.auto,
+)
 @click.option(
     "--hw-accel-api",
     help="Hardware acceleration API to use.",
@@ -102,9 +336,46 @@ from .gst import (
     default=False,
     show_default=False,
 )
+@click.option(
+    "--stats",
+    help="""
+    Show a live table of per element processing times, queue levels,
+    late and dropped frames and the frame rate of each output.
+    """,
+    is_flag=True,
+    default=False,
+    show_default=False,
+)
+@click.option(
+    "--stats-file",
+    help="Write the --stats statistics to this file as JSON lines.",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+)
+@click.option(
+    "--stats-interval",
+    help="Seconds between statistics updates.",
+    type=click.FloatRange(min=0.1),
+    default=1.0,
+)
+@click.option(
+    "--control-socket",
+    help="""
+    Listen on this Unix socket for JSON requests that change settings
+    (e.g. {"set": {"background-blur": 80, "filters": true}}) while running.
+    The filters are built even without --background-blur, so they can be
+    turned on later.
+    """,
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+)
 @click.option(
     "--list-dev-caps",
-    help="List device capabilities (width, height, framerate, etc) and exit.",
+    help="""
+    List device capabilities (width, height, framerate, etc) and exit.
+    Capabilities are cached in ~/.cache/webcam-filters until the device
+    changes.
+    """,
     type=str,
     is_eager=True,
     callback=print_device_caps,
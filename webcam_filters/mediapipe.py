@@ -8,3 +8,23 @@ class SelfieSegmentationModel(int, Enum):
 
     def __str__(self):
         return self.name
+
+
+@unique
+class MaskInterpolation(int, Enum):
+    nearest = 0
+    bilinear = 1
+    edge_aware = 2
+
+    def __str__(self):
+        return self.name
+
+
+@unique
+class DropPolicy(int, Enum):
+    drop_oldest = 0
+    drop_newest = 1
+
+    def __str__(self):
+        return self.name
+
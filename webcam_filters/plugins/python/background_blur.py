@@ -0,0 +1,440 @@
+import gi
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstBase", "1.0")
+
+import numpy
+
+from gi.repository import Gst, GstBase, GLib, GObject
+
+from webcam_filters.aggregation import pop_matching, still_coming
+from webcam_filters.allocation import (
+    COPIED_BYTES_PROPERTY,
+    CopyCounter,
+    acquire_buffer,
+    decide_allocation,
+)
+from webcam_filters.image import (
+    auto_downscale,
+    background_regions,
+    blend,
+    box_blur,
+    channels,
+    frame_planes,
+)
+from webcam_filters.video import (
+    RGB_FORMAT,
+    MASK_FORMAT,
+    FRAME_FORMATS,
+    caps_list,
+    caps_layout,
+    frame_view,
+    mask_view,
+)
+from webcam_filters.tiling import DEFAULT_N_THREADS, MAX_N_THREADS, Tiler
+
+
+SRC_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list(FRAME_FORMATS)}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
+
+FRAME_CAPS = SRC_CAPS
+
+MASK_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list((MASK_FORMAT, RGB_FORMAT))}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
+
+SRC_PAD_TEMPLATE = Gst.PadTemplate.new_with_gtype(
+    "src",
+    Gst.PadDirection.SRC,
+    Gst.PadPresence.ALWAYS,
+    SRC_CAPS,
+    GstBase.AggregatorPad.__gtype__
+)
+
+FRAME_PAD_TEMPLATE = Gst.PadTemplate.new_with_gtype(
+    "frame",
+    Gst.PadDirection.SINK,
+    Gst.PadPresence.ALWAYS,
+    FRAME_CAPS,
+    GstBase.AggregatorPad.__gtype__
+)
+
+MASK_PAD_TEMPLATE = Gst.PadTemplate.new_with_gtype(
+    "mask",
+    Gst.PadDirection.SINK,
+    Gst.PadPresence.ALWAYS,
+    MASK_CAPS,
+    GstBase.AggregatorPad.__gtype__
+)
+
+DEFAULT_KSIZE = 10
+DEFAULT_DOWNSCALE = 0
+
+# Height of the horizontal bands the mask is scanned in for background.
+BAND_ROWS = 16
+
+
+class BackgroundBlur(GstBase.Aggregator):
+
+    __gstmetadata__ = (
+        "Background Blur",
+        "Filter",
+        "Blur the parts of a frame the mask marks as background",
+        "Jashandeep Sohi <jashandeep.s.sohi@gmail.com>"
+    )
+
+    __gsttemplates__ = (
+        SRC_PAD_TEMPLATE,
+        FRAME_PAD_TEMPLATE,
+        MASK_PAD_TEMPLATE,
+    )
+
+    __gproperties__ = {
+        "ksize": (
+            int,
+            "ksize",
+            "ksize",
+            0,
+            200,
+            DEFAULT_KSIZE,
+            GObject.ParamFlags.READWRITE
+        ),
+        "downscale": (
+            int,
+            "downscale",
+            "Blur at 1/N of the resolution and scale back up "
+            "(0=pick N from ksize, 1=full resolution)",
+            0,
+            16,
+            DEFAULT_DOWNSCALE,
+            GObject.ParamFlags.READWRITE
+        ),
+        "n-threads": (
+            int,
+            "n-threads",
+            "Number of threads to blur horizontal bands of the frame on",
+            1,
+            MAX_N_THREADS,
+            DEFAULT_N_THREADS,
+            GObject.ParamFlags.READWRITE
+        ),
+        "copied-bytes": COPIED_BYTES_PROPERTY,
+    }
+
+    def __init__(self):
+        super().__init__()
+
+        self.ksize = DEFAULT_KSIZE
+        self.downscale = DEFAULT_DOWNSCALE
+        self.tiler = Tiler()
+        self._band_scratch = {}
+        self.copies = CopyCounter()
+
+        self._frame = Gst.Pad.new_from_template(FRAME_PAD_TEMPLATE, "frame")
+        self._mask = Gst.Pad.new_from_template(MASK_PAD_TEMPLATE, "mask")
+
+        self.add_pad(self._frame)
+        self.add_pad(self._mask)
+
+        # Used when the mask for a frame doesn't arrive within the latency, or
+        # was dropped.
+        self._last_mask = None
+
+    def do_get_property(self, prop: GObject.GParamSpec):
+        if prop.name == "copied-bytes":
+            return self.copies.bytes
+        elif prop.name == "ksize":
+            return self.ksize
+        elif prop.name == "downscale":
+            return self.downscale
+        elif prop.name == "n-threads":
+            return self.tiler.n_threads
+        else:
+            raise AttributeError(f"unkown property {prop.name}")
+
+    def do_set_property(self, prop: GObject.GParamSpec, value):
+        if prop.name == "ksize":
+            self.ksize = value
+        elif prop.name == "downscale":
+            self.downscale = value
+        elif prop.name == "n-threads":
+            self.tiler.n_threads = value
+        else:
+            raise AttributeError(f"unkown property {prop.name}")
+
+    def do_stop(self):
+        self.tiler.stop()
+
+        return True
+
+    def do_fixate_src_caps(self, caps):
+        caps = caps.intersect(self._frame.get_current_caps())
+        return caps.fixate()
+
+    def do_negotiated_src_caps(self, caps):
+        Gst.info(f"src caps: '{caps}'")
+
+        frame_caps = self._frame.get_current_caps()
+        Gst.info(f"frame caps: '{frame_caps}'")
+        if not frame_caps.is_equal_fixed(caps):
+            Gst.error(f"frame caps != src caps")
+            return False
+
+        self._layout = caps_layout(caps)
+
+        mask_caps = self._mask.get_current_caps()
+        Gst.info(f"mask caps: '{mask_caps}'")
+        self._mask_layout = caps_layout(mask_caps)
+        if (
+            self._mask_layout.width != self._layout.width or
+            self._mask_layout.height != self._layout.height
+        ):
+            Gst.error(f"mask size != src size")
+            return False
+
+        self._last_mask = None
+
+        # Scratch space for each plane, so nothing frame sized is allocated
+        # per frame. The planes of an uninitialised frame give their shapes.
+        self._scratch = []
+        self._band_scratch = {}
+        frame = frame_view(
+            numpy.empty(self._layout.size, numpy.uint8),
+            self._layout
+        )
+        for plane, _ in frame_planes(frame):
+            shape = channels(plane).shape
+            self._scratch.append((
+                numpy.empty(shape, numpy.uint8),
+                numpy.empty(shape[:2] + (1,), numpy.int16),
+                numpy.empty(shape, numpy.int16),
+            ))
+
+        return True
+
+    def get_downscale(self):
+        if self.downscale:
+            return self.downscale
+
+        return auto_downscale(self.ksize)
+
+    def do_decide_allocation(self, query):
+        return decide_allocation(query, self._layout.size)
+
+    def do_aggregate(self, timeout):
+        try:
+            framebuf = self._frame.peek_buffer()
+            if framebuf is None:
+                if self._frame.is_eos():
+                    return Gst.FlowReturn.EOS
+                # Timed out with no frame, so there is nothing to output.
+                return Gst.FlowReturn.OK
+
+            maskbuf, stale = pop_matching(self._mask, framebuf.pts)
+            if stale is not None:
+                self._last_mask = stale
+
+            if maskbuf is None and still_coming(self._mask, timeout):
+                # Called again once the mask arrives or the latency runs out.
+                return Gst.FlowReturn.OK
+
+            self._frame.drop_buffer()
+
+            if maskbuf is None:
+                maskbuf = self._last_mask
+            else:
+                self._last_mask = maskbuf
+
+            if maskbuf is None:
+                # No mask yet, so pass the frame through untouched.
+                self.selected_samples(
+                    framebuf.pts,
+                    framebuf.dts,
+                    framebuf.duration,
+                    None
+                )
+                self.finish_buffer(framebuf)
+                return Gst.FlowReturn.OK
+
+            if framebuf.mini_object.is_writable():
+                return self.blur_in_place(framebuf, maskbuf)
+
+            # Something else still holds the frame (e.g. the other outputs
+            # of a tee), so the result goes into a buffer of our own.
+            ret, resbuf = acquire_buffer(self)
+            if ret != Gst.FlowReturn.OK:
+                return ret
+
+            resbuf.pts = framebuf.pts
+            resbuf.dts = framebuf.dts
+            resbuf.duration = framebuf.duration
+
+            self.selected_samples(
+                framebuf.pts,
+                framebuf.dts,
+                framebuf.duration,
+                None
+            )
+
+            framebuf_info = framebuf.map(Gst.MapFlags.READ)
+            maskbuf_info = maskbuf.map(Gst.MapFlags.READ)
+            resbuf_info = resbuf.map(Gst.MapFlags.WRITE)
+
+            with framebuf_info, maskbuf_info, resbuf_info:
+                frame = frame_view(framebuf_info.data, self._layout)
+                mask = mask_view(maskbuf_info.data, self._mask_layout)
+                res = frame_view(resbuf_info.data, self._layout)
+
+                for (src, _), (dst, _) in zip(
+                    frame_planes(frame),
+                    frame_planes(res)
+                ):
+                    numpy.copyto(dst, src)
+                    self.copies.add(dst.nbytes)
+
+                self.blur_background(frame, mask, res)
+
+            self.finish_buffer(resbuf)
+
+            return Gst.FlowReturn.OK
+
+        except Gst.MapError as e:
+            Gst.error("mapping error %s" % e)
+            return Gst.FlowReturn.ERROR
+        except Exception as e:
+            Gst.error("%s" % e)
+            return Gst.FlowReturn.ERROR
+
+    def blur_in_place(self, framebuf, maskbuf):
+        """
+        Blur the background of a frame nothing else holds within it, and
+        push it.
+        """
+        self.selected_samples(
+            framebuf.pts,
+            framebuf.dts,
+            framebuf.duration,
+            None
+        )
+
+        self.copies.before(framebuf)
+        framebuf_info = framebuf.map(Gst.MapFlags.READ | Gst.MapFlags.WRITE)
+        maskbuf_info = maskbuf.map(Gst.MapFlags.READ)
+
+        with framebuf_info, maskbuf_info:
+            self.copies.after(framebuf_info)
+
+            frame = frame_view(framebuf_info.data, self._layout)
+            mask = mask_view(maskbuf_info.data, self._mask_layout)
+
+            self.blur_background(frame, mask, frame)
+
+        self.finish_buffer(framebuf)
+
+        return Gst.FlowReturn.OK
+
+    def blur_background(self, frame, mask, res):
+        """
+        Blur only the regions of the frame with background and blend them
+        into res, which may be the frame itself.
+
+        Regions are found on the full resolution mask and scaled down to the
+        chroma planes of YUV frames, which are blurred with a kernel matching
+        their resolution. Each plane is split into horizontal bands that are
+        processed on the tiler's threads.
+        """
+        factor = self.get_downscale()
+        regions = background_regions(mask[..., 0], BAND_ROWS)
+
+        planes = zip(frame_planes(frame), frame_planes(res), self._scratch)
+
+        for (src, s), (dst, _), (blurred, alpha, diff) in planes:
+            src = channels(src)
+            dst = channels(dst)
+            pmask = mask[::s, ::s]
+            ksize = max(1, self.ksize // s)
+            pfactor = max(1, factor // s)
+            height, width = src.shape[:2]
+
+            # Pixels outside a region that the blur inside it depends on.
+            halo = ksize // 2 + 2 * pfactor
+
+            def band_rects(btop, bbottom):
+                """
+                The parts of the regions, scaled to the plane, that fall
+                within the rows of a band.
+                """
+                for top, bottom, left, right in regions:
+                    top = max(btop, top // s)
+                    bottom = min(bbottom, -(-bottom // s))
+
+                    if top < bottom:
+                        yield top, bottom, left // s, -(-right // s)
+
+            def blur_band(i, btop, bbottom):
+                for top, bottom, left, right in band_rects(btop, bbottom):
+                    htop = max(0, top - halo)
+                    hbottom = min(height, bottom + halo)
+                    hleft = max(0, left - halo)
+                    hright = min(width, right + halo)
+
+                    # The halo may overlap other regions, so only the region
+                    # itself is kept from the window it's blurred in.
+                    window = self.get_scratch(i, src, hbottom - htop)
+                    window = window[:, hleft:hright]
+                    box_blur(
+                        src[htop:hbottom, hleft:hright],
+                        window,
+                        ksize,
+                        pfactor,
+                    )
+                    numpy.copyto(
+                        blurred[top:bottom, left:right],
+                        window[top - htop:bottom - htop, left - hleft:right - hleft],
+                    )
+
+            def blend_band(i, btop, bbottom):
+                for top, bottom, left, right in band_rects(btop, bbottom):
+                    blend(
+                        pmask[top:bottom, left:right],
+                        src[top:bottom, left:right],
+                        blurred[top:bottom, left:right],
+                        dst[top:bottom, left:right],
+                        alpha[top:bottom, left:right],
+                        diff[top:bottom, left:right],
+                    )
+
+            # Blended once every band is blurred, since dst may be src and
+            # the blur of a band reads the rows around it.
+            self.tiler.map(blur_band, height)
+            self.tiler.map(blend_band, height)
+
+    def get_scratch(self, i, plane, rows):
+        """
+        Return a scratch array of rows of plane private to band i.
+        """
+        key = (i,) + plane.shape[1:]
+        scratch = self._band_scratch.get(key)
+
+        if scratch is None or scratch.shape[0] < rows:
+            scratch = numpy.empty((rows,) + plane.shape[1:], numpy.uint8)
+            self._band_scratch[key] = scratch
+
+        return scratch[:rows]
+
+GObject.type_register(BackgroundBlur)
+
+__gstelementfactory__ = (
+    "background_blur",
+    Gst.Rank.NONE,
+    BackgroundBlur
+)
@@ -3,33 +3,27 @@ import gi
 gi.require_version("Gst", "1.0")
 gi.require_version("GstBase", "1.0")
 
-import cv2
 import numpy
 
 from gi.repository import Gst, GstBase, GLib, GObject
 
+from webcam_filters.allocation import COPIED_BYTES_PROPERTY, CopyCounter
+from webcam_filters.image import auto_downscale, box_blur, frame_planes
+from webcam_filters.tiling import DEFAULT_N_THREADS, MAX_N_THREADS, Tiler
+from webcam_filters.video import FRAME_FORMATS, caps_list, caps_layout, frame_view
 
-SRC_CAPS = Gst.Caps(Gst.Structure(
-    "video/x-raw",
-    format="RGB",
-    width=Gst.IntRange(range(1, GLib.MAXINT)),
-    height=Gst.IntRange(range(1, GLib.MAXINT)),
-    framerate=Gst.FractionRange(
-        Gst.Fraction(1, 1),
-        Gst.Fraction(GLib.MAXINT, 1)
-    )
-))
-
-SINK_CAPS = Gst.Caps(Gst.Structure(
-    "video/x-raw",
-    format="RGB",
-    width=Gst.IntRange(range(1, GLib.MAXINT)),
-    height=Gst.IntRange(range(1, GLib.MAXINT)),
-    framerate=Gst.FractionRange(
-        Gst.Fraction(1, 1),
-        Gst.Fraction(GLib.MAXINT, 1)
-    )
-))
+
+CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list(FRAME_FORMATS)}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
+
+SRC_CAPS = CAPS
+
+SINK_CAPS = CAPS
 
 SRC_PAD_TEMPLATE = Gst.PadTemplate.new(
     "src",
@@ -46,6 +40,7 @@ SINK_PAD_TEMPLATE = Gst.PadTemplate.new(
 )
 
 DEFAULT_KSIZE = 10
+DEFAULT_DOWNSCALE = 0
 
 class BoxFilter(GstBase.BaseTransform):
 
@@ -68,44 +63,88 @@ class BoxFilter(GstBase.BaseTransform):
             DEFAULT_KSIZE,
             GObject.ParamFlags.READWRITE
         ),
+        "downscale": (
+            int,
+            "downscale",
+            "Blur at 1/N of the resolution and scale back up "
+            "(0=pick N from ksize, 1=full resolution)",
+            0,
+            16,
+            DEFAULT_DOWNSCALE,
+            GObject.ParamFlags.READWRITE
+        ),
+        "n-threads": (
+            int,
+            "n-threads",
+            "Number of threads to blur horizontal bands of the frame on",
+            1,
+            MAX_N_THREADS,
+            DEFAULT_N_THREADS,
+            GObject.ParamFlags.READWRITE
+        ),
+        "copied-bytes": COPIED_BYTES_PROPERTY,
     }
 
     def __init__(self):
         super().__init__()
         self.ksize = DEFAULT_KSIZE
+        self.downscale = DEFAULT_DOWNSCALE
+        self.tiler = Tiler()
+        self._scratch = {}
+        self.copies = CopyCounter()
         self.set_qos_enabled(True)
 
     def do_get_property(self, prop: GObject.GParamSpec):
-        if prop.name == "ksize":
+        if prop.name == "copied-bytes":
+            return self.copies.bytes
+        elif prop.name == "ksize":
             return self.ksize
+        elif prop.name == "downscale":
+            return self.downscale
+        elif prop.name == "n-threads":
+            return self.tiler.n_threads
         else:
             raise AttributeError(f"unkown property {prop.name}")
 
     def do_set_property(self, prop: GObject.GParamSpec, value):
         if prop.name == "ksize":
             self.ksize  = value
+        elif prop.name == "downscale":
+            self.downscale = value
+        elif prop.name == "n-threads":
+            self.tiler.n_threads = value
         else:
             raise AttributeError(f"unkown property {prop.name}")
 
 
+    def do_stop(self):
+        self.tiler.stop()
+
+        return True
+
     def do_set_caps(self, incaps, outcaps):
-        s = incaps.get_structure(0)
-        self.width = s.get_int("width").value
-        self.height = s.get_int("height").value
+        self.layout = caps_layout(incaps)
+        self.width = self.layout.width
+        self.height = self.layout.height
+        self._scratch = {}
 
         return True
 
+    def get_downscale(self):
+        if self.downscale:
+            return self.downscale
+
+        return auto_downscale(self.ksize)
+
+    def do_before_transform(self, buf):
+        self.copies.before(buf)
+
     def do_transform_ip(self, inbuf):
         try:
             inbuf_info = inbuf.map(Gst.MapFlags.READ | Gst.MapFlags.WRITE)
             with inbuf_info:
-                in_nd = numpy.ndarray(
-                    shape=(self.height, self.width, 3),
-                    dtype=numpy.uint8,
-                    buffer=inbuf_info.data
-                )
-
-                in_nd[:] = cv2.boxFilter(in_nd, -1, (self.ksize, self.ksize))
+                self.copies.after(inbuf_info)
+                self.blur(frame_view(inbuf_info.data, self.layout))
 
                 return Gst.FlowReturn.OK
 
@@ -116,6 +155,60 @@ class BoxFilter(GstBase.BaseTransform):
             Gst.error("%s" % e)
             return Gst.FlowReturn.ERROR
 
+    def blur(self, frame):
+        """
+        Blur every plane of the frame in place. Chroma planes of YUV frames
+        are blurred with a kernel (and downscale) matching their resolution.
+        """
+        factor = self.get_downscale()
+
+        for plane, subsampling in frame_planes(frame):
+            self.blur_plane(
+                plane,
+                max(1, self.ksize // subsampling),
+                max(1, factor // subsampling),
+            )
+
+    def blur_plane(self, plane, ksize, factor):
+        if self.tiler.n_threads == 1:
+            box_blur(plane, plane, ksize, factor)
+            return
+
+        height = plane.shape[0]
+
+        # Rows above and below a band that the blur inside it depends on.
+        halo = ksize // 2 + 2 * factor
+
+        def blur_band(i, top, bottom):
+            htop = max(0, top - halo)
+            hbottom = min(height, bottom + halo)
+            scratch = self.get_scratch(i, plane, hbottom - htop)
+            box_blur(plane[htop:hbottom], scratch, ksize, factor)
+
+            return scratch[top - htop:bottom - htop]
+
+        # Bands read their neighbours' rows, so every band is blurred before
+        # any of them is written back.
+        blurred = self.tiler.map(blur_band, height)
+
+        def copy_band(i, top, bottom):
+            numpy.copyto(plane[top:bottom], blurred[i])
+
+        self.tiler.map(copy_band, height)
+
+    def get_scratch(self, i, plane, rows):
+        """
+        Return a scratch array of rows of plane private to band i.
+        """
+        key = (i,) + plane.shape[1:]
+        scratch = self._scratch.get(key)
+
+        if scratch is None or scratch.shape[0] < rows:
+            scratch = numpy.empty((rows,) + plane.shape[1:], numpy.uint8)
+            self._scratch[key] = scratch
+
+        return scratch[:rows]
+
 GObject.type_register(BoxFilter)
 
 __gstelementfactory__ = (
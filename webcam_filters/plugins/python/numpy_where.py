@@ -8,28 +8,41 @@ import numpy
 
 from gi.repository import Gst, GstBase, GLib, GObject
 
+from webcam_filters.aggregation import pop_matching, still_coming
+from webcam_filters.allocation import acquire_buffer, decide_allocation
+from webcam_filters.image import blend, channels, frame_planes
+from webcam_filters.tiling import DEFAULT_N_THREADS, MAX_N_THREADS, Tiler
+from webcam_filters.video import (
+    RGB_FORMAT,
+    MASK_FORMAT,
+    FRAME_FORMATS,
+    caps_list,
+    caps_layout,
+    frame_view,
+)
 
-SRC_CAPS = Gst.Caps(Gst.Structure(
-    "video/x-raw",
-    format="RGB",
-    width=Gst.IntRange(range(1, GLib.MAXINT)),
-    height=Gst.IntRange(range(1, GLib.MAXINT)),
-    framerate=Gst.FractionRange(
-        Gst.Fraction(1, 1),
-        Gst.Fraction(GLib.MAXINT, 1)
-    )
-))
-
-SINK_CAPS = Gst.Caps(Gst.Structure(
-    "video/x-raw",
-    format="RGB",
-    width=Gst.IntRange(range(1, GLib.MAXINT)),
-    height=Gst.IntRange(range(1, GLib.MAXINT)),
-    framerate=Gst.FractionRange(
-        Gst.Fraction(1, 1),
-        Gst.Fraction(GLib.MAXINT, 1)
-    )
-))
+
+SRC_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list(FRAME_FORMATS)}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
+
+SINK_CAPS = SRC_CAPS
+
+# The condition may be a full RGB frame or a single channel mask that is
+# broadcast over all three channels. It is always at full resolution; the
+# chroma planes of YUV frames use every other row and column of its first
+# channel.
+CONDITION_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list((RGB_FORMAT, MASK_FORMAT))}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
 
 SRC_PAD_TEMPLATE = Gst.PadTemplate.new_with_gtype(
     "src",
@@ -48,6 +61,19 @@ SINK_PAD_TEMPLATE = Gst.PadTemplate.new_with_gtype(
     GstBase.AggregatorPad.__gtype__
 )
 
+CONDITION_PAD_TEMPLATE = Gst.PadTemplate.new_with_gtype(
+    "condition",
+    Gst.PadDirection.SINK,
+    Gst.PadPresence.ALWAYS,
+    CONDITION_CAPS,
+    GstBase.AggregatorPad.__gtype__
+)
+
+MODE_SELECT = 0
+MODE_BLEND = 1
+
+DEFAULT_MODE = MODE_SELECT
+
 
 class Where(GstBase.Aggregator):
 
@@ -61,12 +87,42 @@ class Where(GstBase.Aggregator):
     __gsttemplates__ = (
         SRC_PAD_TEMPLATE,
         SINK_PAD_TEMPLATE,
+        CONDITION_PAD_TEMPLATE,
     )
 
+    __gproperties__ = {
+        "mode": (
+            int,
+            "Mode",
+            "How the condition combines x and y (0=select, where any "
+            "non-zero condition picks x, 1=blend, where the condition is an "
+            "alpha value weighting x over y)",
+            0,
+            1,
+            DEFAULT_MODE,
+            GObject.ParamFlags.READWRITE
+        ),
+        "n-threads": (
+            int,
+            "n-threads",
+            "Number of threads to combine horizontal bands of the frame on",
+            1,
+            MAX_N_THREADS,
+            DEFAULT_N_THREADS,
+            GObject.ParamFlags.READWRITE
+        ),
+    }
+
     def __init__(self):
         super().__init__()
 
-        self._condition =Gst.Pad.new_from_template(SINK_PAD_TEMPLATE, "condition")
+        self.mode = DEFAULT_MODE
+        self.tiler = Tiler()
+
+        self._condition = Gst.Pad.new_from_template(
+            CONDITION_PAD_TEMPLATE,
+            "condition"
+        )
         self._x = Gst.Pad.new_from_template(SINK_PAD_TEMPLATE, "x")
         self._y = Gst.Pad.new_from_template(SINK_PAD_TEMPLATE, "y")
 
@@ -74,10 +130,27 @@ class Where(GstBase.Aggregator):
         self.add_pad(self._x)
         self.add_pad(self._y)
 
-        self._allocator, self._allocator_params = self.get_allocator()
+        # Used in place of the buffer of a pad that doesn't arrive within the
+        # latency or was dropped, by pad name.
+        self._last = {}
+
+    def do_get_property(self, prop: GObject.GParamSpec):
+        if prop.name == "mode":
+            return self.mode
+        elif prop.name == "n-threads":
+            return self.tiler.n_threads
+        else:
+            raise AttributeError(f"unkown property {prop.name}")
+
+    def do_set_property(self, prop: GObject.GParamSpec, value):
+        if prop.name == "mode":
+            self.mode = value
+        elif prop.name == "n-threads":
+            self.tiler.n_threads = value
+        else:
+            raise AttributeError(f"unkown property {prop.name}")
 
     def do_fixate_src_caps(self, caps):
-        caps = caps.intersect(self._condition.get_current_caps())
         caps = caps.intersect(self._x.get_current_caps())
         caps = caps.intersect(self._y.get_current_caps())
         return caps.fixate()
@@ -85,12 +158,6 @@ class Where(GstBase.Aggregator):
     def do_negotiated_src_caps(self, caps):
         Gst.info(f"src caps: '{caps}'")
 
-        cond_caps = self._condition.get_current_caps()
-        Gst.info(f"condition caps: '{cond_caps}'")
-        if not cond_caps.is_equal_fixed(caps):
-            Gst.error(f"condition caps != src caps")
-            return False
-
         x_caps = self._x.get_current_caps()
         Gst.info(f"x caps: '{x_caps}'")
         if not x_caps.is_equal_fixed(caps):
@@ -103,29 +170,84 @@ class Where(GstBase.Aggregator):
             Gst.error(f"y caps != src caps")
             return False
 
-        s = caps.get_structure(0)
-        self._width = s.get_int("width").value
-        self._height = s.get_int("height").value
+        self._layout = caps_layout(caps)
 
-        self._resbuf = Gst.Buffer.new_allocate(
-            self._allocator,
-            self._width * self._height * 3,
-            self._allocator_params,
+        cond_caps = self._condition.get_current_caps()
+        Gst.info(f"condition caps: '{cond_caps}'")
+        self._cond_layout = caps_layout(cond_caps)
+        if (
+            self._cond_layout.width != self._layout.width or
+            self._cond_layout.height != self._layout.height
+        ):
+            Gst.error(f"condition size != src size")
+            return False
+
+        self._last = {}
+
+        # Scratch space for blending each plane, so no frame sized
+        # temporaries are allocated per frame. The planes of an uninitialised
+        # frame give their shapes.
+        self._scratch = []
+        frame = frame_view(
+            numpy.empty(self._layout.size, numpy.uint8),
+            self._layout
         )
+        for plane, _ in frame_planes(frame):
+            shape = channels(plane).shape
+            self._scratch.append((
+                numpy.empty(shape[:2] + (1,), numpy.int16),
+                numpy.empty(shape, numpy.int16),
+            ))
 
         return True
 
+    def do_stop(self):
+        self.tiler.stop()
+
+        return True
+
+    def do_decide_allocation(self, query):
+        return decide_allocation(query, self._layout.size)
+
     def do_aggregate(self, timeout):
         try:
-            cbuf = self._condition.pop_buffer()
-            xbuf = self._x.pop_buffer()
-            ybuf = self._y.pop_buffer()
-            resbuf = self._resbuf
+            xbuf = self._x.peek_buffer()
+            if xbuf is None:
+                if self._x.is_eos():
+                    return Gst.FlowReturn.EOS
+                # Timed out with no frame, so there is nothing to output.
+                return Gst.FlowReturn.OK
+
+            others = (self._y, self._condition)
+            matched = [self.match(pad, xbuf.pts) for pad in others]
 
-            resbuf.pts = cbuf.pts
-            resbuf.dts = cbuf.dts
+            if any(
+                buf is None and still_coming(pad, timeout)
+                for pad, buf in zip(others, matched)
+            ):
+                # Called again once they arrive or the latency runs out.
+                return Gst.FlowReturn.OK
 
-            self.selected_samples(cbuf.pts, cbuf.dts, cbuf.duration, None)
+            self._x.drop_buffer()
+
+            ybuf, cbuf = (
+                self._last.get(pad.get_name()) if buf is None else buf
+                for pad, buf in zip(others, matched)
+            )
+
+            if cbuf is None or ybuf is None:
+                # An input hasn't produced anything yet.
+                return Gst.FlowReturn.OK
+
+            ret, resbuf = acquire_buffer(self)
+            if ret != Gst.FlowReturn.OK:
+                return ret
+
+            resbuf.pts = xbuf.pts
+            resbuf.dts = xbuf.dts
+            resbuf.duration = xbuf.duration
+
+            self.selected_samples(xbuf.pts, xbuf.dts, xbuf.duration, None)
 
             cbuf_info = cbuf.map(Gst.MapFlags.READ)
             xbuf_info = xbuf.map(Gst.MapFlags.READ)
@@ -133,28 +255,30 @@ class Where(GstBase.Aggregator):
             resbuf_info = resbuf.map(Gst.MapFlags.WRITE)
 
             with cbuf_info, xbuf_info, ybuf_info, resbuf_info:
-                condition = numpy.ndarray(
-                    shape=(self._height, self._width, 3),
-                    dtype=numpy.dtype("bool"),
-                    buffer=cbuf_info.data
+                condition = channels(
+                    frame_view(cbuf_info.data, self._cond_layout)
                 )
-                x = numpy.ndarray(
-                    shape=(self._height, self._width, 3),
-                    dtype=numpy.uint8,
-                    buffer=xbuf_info.data
-                )
-                y = numpy.ndarray(
-                    shape=(self._height, self._width, 3),
-                    dtype=numpy.uint8,
-                    buffer=ybuf_info.data
-                )
-                res = numpy.ndarray(
-                    shape=(self._height, self._width, 3),
-                    dtype=numpy.uint8,
-                    buffer=resbuf_info.data
+                planes = zip(
+                    frame_planes(frame_view(xbuf_info.data, self._layout)),
+                    frame_planes(frame_view(ybuf_info.data, self._layout)),
+                    frame_planes(frame_view(resbuf_info.data, self._layout)),
+                    self._scratch,
                 )
 
-                res[:] = numpy.where(condition, x, y)
+                for (x, s), (y, _), (res, _), (alpha, diff) in planes:
+                    if self._layout.format != RGB_FORMAT:
+                        cond = condition[::s, ::s, :1]
+                    else:
+                        cond = condition
+
+                    self.combine_plane(
+                        cond,
+                        channels(x),
+                        channels(y),
+                        channels(res),
+                        alpha,
+                        diff,
+                    )
 
             self.finish_buffer(resbuf)
 
@@ -167,6 +291,51 @@ class Where(GstBase.Aggregator):
             Gst.error("%s" % e)
             return Gst.FlowReturn.ERROR
 
+    def match(self, pad, pts):
+        """
+        Return the buffer of pad with the given pts, or None if it hasn't
+        arrived or was dropped. The newest buffer pad had is kept to fall
+        back on.
+        """
+        last = self._last.get(pad.get_name())
+        if last is not None and pts != Gst.CLOCK_TIME_NONE and last.pts == pts:
+            # Matched already, by a call that then waited on another input.
+            return last
+
+        buf, stale = pop_matching(pad, pts)
+
+        if buf is not None:
+            self._last[pad.get_name()] = buf
+        elif stale is not None:
+            self._last[pad.get_name()] = stale
+
+        return buf
+
+    def combine_plane(self, condition, x, y, res, alpha, diff):
+        """
+        Combine a plane of x and y into res, in bands on the tiler.
+        """
+        self.tiler.map(
+            lambda i, top, bottom: self.combine(
+                condition[top:bottom],
+                x[top:bottom],
+                y[top:bottom],
+                res[top:bottom],
+                alpha[top:bottom],
+                diff[top:bottom],
+            ),
+            x.shape[0]
+        )
+
+    def combine(self, condition, x, y, res, alpha, diff):
+        """
+        Combine a band of x and y into res according to the mode.
+        """
+        if self.mode == MODE_BLEND:
+            blend(condition[..., :1], x, y, res, alpha, diff)
+        else:
+            res[:] = numpy.where(condition.view(numpy.bool_), x, y)
+
 GObject.type_register(Where)
 
 __gstelementfactory__ = (
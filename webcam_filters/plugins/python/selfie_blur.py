@@ -0,0 +1,266 @@
+import gi
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstBase", "1.0")
+
+import numpy
+
+from gi.repository import Gst, GstBase, GLib, GObject
+
+from webcam_filters.allocation import COPIED_BYTES_PROPERTY, CopyCounter
+from webcam_filters.image import (
+    auto_downscale,
+    background_regions,
+    blend,
+    box_blur,
+    channels,
+    frame_planes,
+    merge_regions,
+)
+from webcam_filters.segmentation import Segmenter, GPROPERTIES
+from webcam_filters.video import (
+    FRAME_FORMATS,
+    YUV_FORMATS,
+    caps_list,
+    caps_layout,
+    frame_view,
+)
+
+
+SRC_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list(FRAME_FORMATS)}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
+
+SINK_CAPS = SRC_CAPS
+
+SRC_PAD_TEMPLATE = Gst.PadTemplate.new(
+    "src",
+    Gst.PadDirection.SRC,
+    Gst.PadPresence.ALWAYS,
+    SRC_CAPS
+)
+
+SINK_PAD_TEMPLATE = Gst.PadTemplate.new(
+    "sink",
+    Gst.PadDirection.SINK,
+    Gst.PadPresence.ALWAYS,
+    SINK_CAPS
+)
+
+DEFAULT_KSIZE = 10
+DEFAULT_DOWNSCALE = 0
+
+# Height of the horizontal bands the mask is scanned in for background.
+BAND_ROWS = 16
+
+
+class SelfieBlur(GstBase.BaseTransform):
+
+    __gstmetadata__ = (
+        "Selfie Blur",
+        "Filter",
+        "Segment the person in a frame and blur the background in one pass",
+        "Jashandeep Sohi <jashandeep.s.sohi@gmail.com>"
+    )
+
+    __gsttemplates__ = (SRC_PAD_TEMPLATE, SINK_PAD_TEMPLATE)
+
+    __gproperties__ = {
+        **GPROPERTIES,
+        "ksize": (
+            int,
+            "ksize",
+            "ksize",
+            0,
+            200,
+            DEFAULT_KSIZE,
+            GObject.ParamFlags.READWRITE
+        ),
+        "downscale": (
+            int,
+            "downscale",
+            "Blur at 1/N of the resolution and scale back up "
+            "(0=pick N from ksize, 1=full resolution)",
+            0,
+            16,
+            DEFAULT_DOWNSCALE,
+            GObject.ParamFlags.READWRITE
+        ),
+        "copied-bytes": COPIED_BYTES_PROPERTY,
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.segmenter = Segmenter()
+        self.ksize = DEFAULT_KSIZE
+        self.downscale = DEFAULT_DOWNSCALE
+        self.copies = CopyCounter()
+        self.set_qos_enabled(True)
+
+    def do_get_property(self, prop: GObject.GParamSpec):
+        if prop.name == "copied-bytes":
+            return self.copies.bytes
+        elif prop.name == "ksize":
+            return self.ksize
+        elif prop.name == "downscale":
+            return self.downscale
+        elif prop.name in GPROPERTIES:
+            return self.segmenter.get(prop.name)
+        else:
+            raise AttributeError(f"unkown property {prop.name}")
+
+    def do_set_property(self, prop: GObject.GParamSpec, value):
+        if prop.name == "ksize":
+            self.ksize = value
+        elif prop.name == "downscale":
+            self.downscale = value
+        elif prop.name in GPROPERTIES:
+            self.segmenter.set(prop.name, value)
+        else:
+            raise AttributeError(f"unkown property {prop.name}")
+
+    def do_start(self):
+        try:
+            self.segmenter.start()
+        except Exception as e:
+            Gst.error("failed to start segmentation: %s" % e)
+            return False
+
+        return True
+
+    def do_stop(self):
+        self.segmenter.stop()
+
+        return True
+
+    def do_set_caps(self, incaps, outcaps):
+        self.layout = caps_layout(incaps)
+        self.width = self.layout.width
+        self.height = self.layout.height
+
+        self.segmenter.configure(
+            self.width,
+            self.height,
+            yuv=self.layout.format in YUV_FORMATS
+        )
+
+        # Scratch space for each plane, so nothing frame sized is allocated
+        # per frame. The planes of an uninitialised frame give their shapes.
+        self._scratch = []
+        frame = frame_view(
+            numpy.empty(self.layout.size, numpy.uint8),
+            self.layout
+        )
+        for plane, _ in frame_planes(frame):
+            shape = channels(plane).shape
+            self._scratch.append((
+                numpy.empty(shape, numpy.uint8),
+                numpy.empty(shape[:2] + (1,), numpy.int16),
+                numpy.empty(shape, numpy.int16),
+            ))
+
+        return True
+
+    def get_downscale(self):
+        if self.downscale:
+            return self.downscale
+
+        return auto_downscale(self.ksize)
+
+    def do_before_transform(self, buf):
+        self.copies.before(buf)
+
+    def do_transform_ip(self, inbuf):
+        try:
+            inbuf_info = inbuf.map(Gst.MapFlags.READ | Gst.MapFlags.WRITE)
+            with inbuf_info:
+                self.copies.after(inbuf_info)
+                in_nd = frame_view(inbuf_info.data, self.layout)
+
+                mask = self.segmenter.update_mask(in_nd)
+                self.segmenter.post_stats(self)
+
+                self.blur_background(in_nd, mask[..., None])
+
+                return Gst.FlowReturn.OK
+
+        except Gst.MapError as e:
+            Gst.error("mapping error %s" % e)
+            return Gst.FlowReturn.ERROR
+        except Exception as e:
+            Gst.error("%s" % e)
+            return Gst.FlowReturn.ERROR
+
+    def blur_background(self, frame, mask):
+        """
+        Blur the regions of the frame with background and blend them back
+        into the frame.
+
+        Regions are found on the full resolution mask and scaled down to the
+        chroma planes of YUV frames, which are blurred with a kernel matching
+        their resolution.
+        """
+        factor = self.get_downscale()
+
+        planes = []
+        for plane, s in frame_planes(frame):
+            ksize = max(1, self.ksize // s)
+            pfactor = max(1, factor // s)
+            # Pixels outside a region that the blur inside it depends on.
+            halo = ksize // 2 + 2 * pfactor
+            planes.append((channels(plane), s, ksize, pfactor, halo))
+
+        # Blending writes into the frame, so regions whose halos overlap are
+        # merged to keep one region from blurring another's blended pixels.
+        # Halos are compared in full resolution pixels, plus one for rounding
+        # regions to chroma planes.
+        gap = max(2 * s * (halo + 1) for _, s, _, _, halo in planes)
+        regions = merge_regions(
+            background_regions(mask[..., 0], BAND_ROWS),
+            gap
+        )
+
+        for (plane, s, ksize, pfactor, halo), scratch in zip(
+            planes,
+            self._scratch
+        ):
+            blurred, alpha, diff = scratch
+            pmask = mask[::s, ::s]
+            height, width = plane.shape[:2]
+
+            for top, bottom, left, right in regions:
+                top, left = top // s, left // s
+                bottom, right = -(-bottom // s), -(-right // s)
+
+                htop = max(0, top - halo)
+                hbottom = min(height, bottom + halo)
+                hleft = max(0, left - halo)
+                hright = min(width, right + halo)
+
+                box_blur(
+                    plane[htop:hbottom, hleft:hright],
+                    blurred[htop:hbottom, hleft:hright],
+                    ksize,
+                    pfactor,
+                )
+
+                blend(
+                    pmask[top:bottom, left:right],
+                    plane[top:bottom, left:right],
+                    blurred[top:bottom, left:right],
+                    plane[top:bottom, left:right],
+                    alpha[top:bottom, left:right],
+                    diff[top:bottom, left:right],
+                )
+
+GObject.type_register(SelfieBlur)
+
+__gstelementfactory__ = (
+    "selfie_blur",
+    Gst.Rank.NONE,
+    SelfieBlur
+)
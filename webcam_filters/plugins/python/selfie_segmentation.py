@@ -7,30 +7,36 @@ import numpy
 
 from gi.repository import Gst, GstBase, GLib, GObject
 
-from mediapipe.python.solutions.selfie_segmentation import SelfieSegmentation
+from webcam_filters.allocation import COPIED_BYTES_PROPERTY, CopyCounter
+from webcam_filters.segmentation import Segmenter, GPROPERTIES
+from webcam_filters.video import (
+    RGB_FORMAT,
+    MASK_FORMAT,
+    YUV_FORMATS,
+    FRAME_FORMATS,
+    caps_list,
+    caps_layout,
+    frame_view,
+)
 
 
-SRC_CAPS = Gst.Caps(Gst.Structure(
-    "video/x-raw",
-    format="RGB",
-    width=Gst.IntRange(range(1, GLib.MAXINT)),
-    height=Gst.IntRange(range(1, GLib.MAXINT)),
-    framerate=Gst.FractionRange(
-        Gst.Fraction(1, 1),
-        Gst.Fraction(GLib.MAXINT, 1)
-    )
-))
-
-SINK_CAPS = Gst.Caps(Gst.Structure(
-    "video/x-raw",
-    format="RGB",
-    width=Gst.IntRange(range(1, GLib.MAXINT)),
-    height=Gst.IntRange(range(1, GLib.MAXINT)),
-    framerate=Gst.FractionRange(
-        Gst.Fraction(1, 1),
-        Gst.Fraction(GLib.MAXINT, 1)
-    )
-))
+# The mask is either written back into an RGB frame (in place) or into a
+# separate single channel GRAY8 frame. YUV frames only produce GRAY8 masks.
+SRC_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list((RGB_FORMAT, MASK_FORMAT))}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
+
+SINK_CAPS = Gst.Caps.from_string(
+    "video/x-raw, "
+    f"format=(string){caps_list(FRAME_FORMATS)}, "
+    f"width=(int)[ 1, {GLib.MAXINT} ], "
+    f"height=(int)[ 1, {GLib.MAXINT} ], "
+    f"framerate=(fraction)[ 1/1, {GLib.MAXINT}/1 ]"
+)
 
 SRC_PAD_TEMPLATE = Gst.PadTemplate.new(
     "src",
@@ -46,9 +52,6 @@ SINK_PAD_TEMPLATE = Gst.PadTemplate.new(
     SINK_CAPS
 )
 
-DEFAULT_MODEL = 0
-DEFAULT_THRESHOLD = 0.5
-
 
 class SelfieSegmenter(GstBase.BaseTransform):
 
@@ -62,50 +65,41 @@ class SelfieSegmenter(GstBase.BaseTransform):
     __gsttemplates__ = (SRC_PAD_TEMPLATE, SINK_PAD_TEMPLATE)
 
     __gproperties__ = {
-        "model": (
-            int,
-            "Segmentation model",
-            "Segmentation model (0=general, 1=landscape)",
-            0,
-            1,
-            DEFAULT_MODEL,
-            GObject.ParamFlags.READWRITE
-        ),
-        "threshold": (
-            float,
-            "Segmentation threshold",
-            "Segmentation  threshold",
-            0.0,
-            1.0,
-            DEFAULT_THRESHOLD,
-            GObject.ParamFlags.READWRITE
-        )
+        **GPROPERTIES,
+        "copied-bytes": COPIED_BYTES_PROPERTY,
     }
 
     def __init__(self):
         super().__init__()
-        self.model = DEFAULT_MODEL
-        self.threshold = DEFAULT_THRESHOLD
+        self.segmenter = Segmenter()
+        self.copies = CopyCounter()
         self.set_qos_enabled(True)
 
     def do_get_property(self, prop: GObject.GParamSpec):
-        if prop.name == "model":
-            return self.model
-        elif prop.name == "threshold":
-            return self.threshold
+        if prop.name == "copied-bytes":
+            return self.copies.bytes
+        elif prop.name in GPROPERTIES:
+            return self.segmenter.get(prop.name)
         else:
             raise AttributeError(f"unkown property {prop.name}")
 
     def do_set_property(self, prop: GObject.GParamSpec, value):
-        if prop.name == "model":
-            self.model  = value
-        elif prop.name == "threshold":
-            self.threshold  = value
+        if prop.name in GPROPERTIES:
+            self.segmenter.set(prop.name, value)
         else:
             raise AttributeError(f"unkown property {prop.name}")
 
     def do_start(self):
-        self.mp_seg = SelfieSegmentation(model_selection=self.model)
+        try:
+            self.segmenter.start()
+        except Exception as e:
+            Gst.error("failed to start segmentation: %s" % e)
+            return False
+
+        return True
+
+    def do_stop(self):
+        self.segmenter.stop()
 
         return True
 
@@ -118,48 +112,106 @@ class SelfieSegmenter(GstBase.BaseTransform):
         """
          Given a pad in this direction and the given caps, what caps are
          allowed on the other pad in this element.
+
+         Only the format differs between the two pads, so everything else is
+         carried over. A YUV frame can only become a GRAY8 mask and an RGB
+         mask can only come from an RGB frame.
         """
         if direction == Gst.PadDirection.SRC:
-            outcaps = SRC_CAPS
+            template = SINK_CAPS
+        else:
+            template = SRC_CAPS
+
+        if caps.is_any():
+            outcaps = template
         else:
-            outcaps = SINK_CAPS
+            outcaps = Gst.Caps.new_empty()
+            for i in range(caps.get_size()):
+                s = caps.get_structure(i).copy()
+                format_ = s.get_string("format")
+                s.remove_field("format")
+
+                if direction == Gst.PadDirection.SINK:
+                    if format_ in YUV_FORMATS:
+                        s.set_value("format", MASK_FORMAT)
+                elif format_ == RGB_FORMAT:
+                    s.set_value("format", RGB_FORMAT)
+
+                outcaps.append_structure(s)
+
+            outcaps = outcaps.intersect_full(
+                template,
+                Gst.CapsIntersectMode.FIRST
+            )
 
         if filter_:
-            outcaps = outcaps.intersect(filter_)
+            outcaps = filter_.intersect_full(
+                outcaps,
+                Gst.CapsIntersectMode.FIRST
+            )
 
         return outcaps
 
     def do_fixate_caps(self, direction, caps, othercaps):
-        if direction == Gst.PadDirection.SRC:
-            return othercaps.fixate()
-        else:
-            return caps.fixate()
+        return othercaps.fixate()
+
+    def do_transform_size(self, direction, caps, size, othercaps):
+        return True, caps_layout(othercaps).size
 
     def do_set_caps(self, incaps, outcaps):
-        s = incaps.get_structure(0)
-        self.width = s.get_int("width").value
-        self.height = s.get_int("height").value
+        self.layout = caps_layout(incaps)
+        self.mask_layout = caps_layout(outcaps)
+        self.width = self.layout.width
+        self.height = self.layout.height
+
+        # RGB masks are written over the input frame, GRAY8 masks need an
+        # output buffer of their own.
+        self.mask_format = self.mask_layout.format
+        self.set_in_place(self.mask_format == RGB_FORMAT)
+
+        self.segmenter.configure(
+            self.width,
+            self.height,
+            yuv=self.layout.format in YUV_FORMATS
+        )
 
         return True
 
+    def do_before_transform(self, buf):
+        if self.mask_format == RGB_FORMAT:
+            self.copies.before(buf)
+
     def do_transform_ip(self, inbuf):
         try:
             inbuf_info = inbuf.map(Gst.MapFlags.READ | Gst.MapFlags.WRITE)
             with inbuf_info:
-                in_nd = numpy.ndarray(
-                    shape=(self.height, self.width, 3),
-                    dtype=numpy.uint8,
-                    buffer=inbuf_info.data
-                )
+                self.copies.after(inbuf_info)
+                in_nd = frame_view(inbuf_info.data, self.layout)
 
-                in_nd.flags.writeable = False
-                result = self.mp_seg.process(in_nd)
-                in_nd.flags.writeable = True
-                self.mp_seg.reset()
+                mask = self.segmenter.update_mask(in_nd)
+                self.segmenter.post_stats(self)
 
-                mask = -(result.segmentation_mask >= self.threshold).view("uint8")
+                in_nd[:] = mask[..., None]
+
+                return Gst.FlowReturn.OK
 
-                numpy.stack((mask, mask, mask), -1, in_nd)
+        except Gst.MapError as e:
+            Gst.error("mapping error %s" % e)
+            return Gst.FlowReturn.ERROR
+        except Exception as e:
+            Gst.error("%s" % e)
+            return Gst.FlowReturn.ERROR
+
+    def do_transform(self, inbuf, outbuf):
+        try:
+            inbuf_info = inbuf.map(Gst.MapFlags.READ)
+            outbuf_info = outbuf.map(Gst.MapFlags.WRITE)
+            with inbuf_info, outbuf_info:
+                in_nd = frame_view(inbuf_info.data, self.layout)
+                out_nd = frame_view(outbuf_info.data, self.mask_layout)
+
+                numpy.copyto(out_nd, self.segmenter.update_mask(in_nd))
+                self.segmenter.post_stats(self)
 
                 return Gst.FlowReturn.OK
 
@@ -0,0 +1,1151 @@
+"""
+Selfie segmentation shared by the elements that need a person mask.
+
+Segmenter runs a selfie segmentation model (see backends) on (downscaled)
+frames and turns its float output into a uint8 mask at frame size, where 255 is foreground and 0 is
+background. Frames are RGB arrays or YUVFrames; YUV frames are only
+converted to RGB at the inference size. The element owning it maps its
+GObject properties onto Segmenter attributes with get() and set().
+"""
+import time
+import threading
+import collections
+
+import gi
+
+gi.require_version("Gst", "1.0")
+
+import cv2
+import numpy
+
+from gi.repository import Gst, GLib, GObject
+
+from . import DATA_DIR
+from .image import yuv_to_rgb
+from .backends import (
+    ONNX_OPTIMIZATION_LEVELS,
+    GraphSpec,
+    SegmentationBackend,
+    build_graph,
+)
+
+
+DEFAULT_MODEL = 0
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_INFERENCE_WIDTH = 0
+DEFAULT_INFERENCE_HEIGHT = 0
+DEFAULT_INTERPOLATION = 1
+DEFAULT_FEATHER = 0.0
+DEFAULT_SMOOTHING = 0.0
+DEFAULT_HYSTERESIS = 0.0
+DEFAULT_INTERVAL = 1
+DEFAULT_MOTION_THRESHOLD = 0.0
+DEFAULT_ASYNC = False
+DEFAULT_QUEUE_DEPTH = 1
+DEFAULT_DROP_POLICY = 0
+DEFAULT_SHARED_GRAPH = False
+DEFAULT_BATCH_WINDOW = 0
+DEFAULT_MAX_BATCH = 8
+DEFAULT_BACKEND = int(SegmentationBackend.mediapipe)
+DEFAULT_ONNX_MODEL_DIR = str(DATA_DIR / "models")
+DEFAULT_ONNX_THREADS = 0
+DEFAULT_ONNX_OPTIMIZATION = len(ONNX_OPTIMIZATION_LEVELS) - 1
+
+DROP_OLDEST = 0
+DROP_NEWEST = 1
+
+INTERPOLATION_NEAREST = 0
+INTERPOLATION_BILINEAR = 1
+INTERPOLATION_EDGE_AWARE = 2
+
+# Guided filter parameters used for edge-aware mask upsampling. The radius is
+# in pixels of the inference frame.
+GUIDED_FILTER_RADIUS = 4
+GUIDED_FILTER_EPS = 1e-3
+
+# Frames are reduced to this (width, height) to score motion between frames.
+MOTION_SIZE = (64, 36)
+
+# Post a "selfie-seg-stats" element message every this many frames.
+STATS_PERIOD = 300
+
+# Idle graphs GRAPH_POOL keeps for reuse, enough for one of each model.
+DEFAULT_POOL_SIZE = 2
+
+
+class GraphPool:
+    """
+    Process-wide pool of initialised graphs, by GraphSpec.
+
+    Building a graph loads the model and sets up the backend (e.g. mediapipe's
+    calculator graph), which takes long enough to freeze the video. Segmenters
+    acquire() a graph when they start and release() it when they stop (or
+    switch models or backends), so restarts and switching back to a recently
+    used model get a ready one.
+
+    A graph is only used by one Segmenter at a time, unless it's acquired
+    with acquire_shared(). At most size idle graphs are kept, closing the
+    least recently used ones.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+
+        # (spec, graph), least recently used first
+        self._idle = []
+        self._lock = threading.Lock()
+
+        # spec -> SharedGraph in use. The lock is held while building one,
+        # so Segmenters starting together don't each build the same graph.
+        self._shared = {}
+        self._shared_lock = threading.Lock()
+
+    def acquire(self, spec):
+        with self._lock:
+            for i in reversed(range(len(self._idle))):
+                if self._idle[i][0] == spec:
+                    return self._idle.pop(i)[1]
+
+        Gst.info(f"building segmentation graph {spec}")
+
+        return build_graph(spec)
+
+    def release(self, spec, graph):
+        with self._lock:
+            self._idle.append((spec, graph))
+            evicted = self._idle[:max(0, len(self._idle) - self.size)]
+            del self._idle[:len(evicted)]
+
+        for _, g in evicted:
+            g.close()
+
+    def acquire_shared(self, spec):
+        """
+        Return the SharedGraph of spec, which all Segmenters that acquire
+        it use in turn.
+        """
+        with self._shared_lock:
+            shared = self._shared.get(spec)
+
+            if shared is None:
+                shared = SharedGraph(self.acquire(spec))
+                self._shared[spec] = shared
+
+            shared.users += 1
+
+        return shared
+
+    def release_shared(self, spec, shared):
+        """
+        Release a SharedGraph. Once its last user releases it, the graph is
+        kept idle like any other.
+        """
+        with self._shared_lock:
+            shared.users -= 1
+
+            if shared.users:
+                return
+
+            del self._shared[spec]
+
+        shared.close()
+        self.release(spec, shared.graph)
+
+    def warm_up(self, specs):
+        """
+        Build idle graphs for specs ahead of time (e.g. at start up). A spec
+        that fails to build (e.g. a bad model file) is skipped with a
+        warning.
+        """
+        for spec in specs:
+            try:
+                graph = self.acquire(spec)
+            except Exception as e:
+                Gst.warning(f"failed to preload {spec}: {e}")
+                continue
+
+            self.release(spec, graph)
+
+
+def process_batch(graph, frames):
+    """
+    Return the results of running graph on each of frames.
+
+    A graph with a process_batch() method of its own runs them in one call.
+    mediapipe graphs take one frame per call, so they're run back to back
+    and reset in between, so that no state carries over between streams.
+    """
+    batch = getattr(graph, "process_batch", None)
+
+    if batch is not None:
+        return batch(frames)
+
+    results = []
+    for frame in frames:
+        results.append(graph.process(frame))
+        graph.reset()
+
+    return results
+
+
+class InferenceRequest:
+
+    def __init__(self, frame, window, max_batch):
+        self.frame = frame
+        self.deadline = time.monotonic() + window
+        self.max_batch = max_batch
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SharedGraph:
+    """
+    A graph used by several Segmenters (e.g. of different cameras) at once.
+
+    Frames are run in batches on a thread of its own. A batch is closed once
+    the batch window of any of its frames is up or max_batch frames are
+    waiting (the smallest max_batch of the waiting frames). process() blocks
+    until its frame's result is ready, so a frame waits at most its window
+    on top of the inference itself.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.users = 0
+
+        # Batches run and the frames in them, for stats.
+        self.batches = 0
+        self.frames = 0
+
+        self._pending = []
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self.run,
+            name="selfie-seg-batch",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def process(self, frame, window=0.0, max_batch=1):
+        """
+        Return the result of running the graph on frame, batched with the
+        frames of other Segmenters that arrive within window seconds.
+        """
+        request = InferenceRequest(frame, window, max_batch)
+
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("shared graph is closed")
+
+            self._pending.append(request)
+            self._cond.notify()
+
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def close(self):
+        """
+        Stop the batch thread. Only called once there are no users left, so
+        no frames are waiting.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+        self._thread.join()
+
+    def next_batch(self):
+        """
+        Wait for the next batch to close and return its requests, or None
+        once closed.
+        """
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+
+            while not self._stopped:
+                max_batch = min(r.max_batch for r in self._pending)
+                deadline = min(r.deadline for r in self._pending)
+                remaining = deadline - time.monotonic()
+
+                if len(self._pending) >= max_batch or remaining <= 0:
+                    break
+
+                self._cond.wait(remaining)
+
+            if self._stopped:
+                return None
+
+            batch = self._pending[:max_batch]
+            del self._pending[:max_batch]
+
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+
+            if batch is None:
+                return
+
+            try:
+                results = process_batch(self.graph, [r.frame for r in batch])
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            else:
+                for r, result in zip(batch, results):
+                    r.result = result
+
+            self.batches += 1
+            self.frames += len(batch)
+
+            for r in batch:
+                r.done.set()
+
+
+GRAPH_POOL = GraphPool()
+
+
+class InferenceWorker:
+    """
+    Run inference on a background thread.
+
+    Frames are queued with submit() and the most recent result is picked up
+    with take_result(), so the caller never waits on the model.
+    """
+
+    def __init__(self, infer, depth, drop_policy):
+        self.infer = infer
+        self.depth = depth
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+        self._pending = collections.deque()
+        self._result = None
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self.run,
+            name="selfie-seg-inference",
+            daemon=True,
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+        self._thread.join()
+
+    def submit(self, frame):
+        with self._cond:
+            if len(self._pending) >= self.depth:
+                self.dropped += 1
+
+                if self.drop_policy == DROP_NEWEST:
+                    return
+
+                self._pending.popleft()
+
+            self._pending.append(frame)
+            self._cond.notify()
+
+    def take_result(self):
+        """
+        Return (mask, frame) for the latest completed inference, or None if
+        nothing completed since the last call.
+        """
+        with self._cond:
+            result = self._result
+            self._result = None
+
+        return result
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+
+                if self._stopped:
+                    return
+
+                frame = self._pending.popleft()
+
+            try:
+                mask = self.infer(frame)
+            except Exception as e:
+                Gst.error("inference failed: %s" % e)
+                continue
+
+            with self._cond:
+                self._result = (mask, frame)
+
+
+def release_graph(spec, graph):
+    """
+    Return a graph from GraphPool.acquire() or acquire_shared() to the pool.
+    """
+    if isinstance(graph, SharedGraph):
+        GRAPH_POOL.release_shared(spec, graph)
+    else:
+        GRAPH_POOL.release(spec, graph)
+
+
+GPROPERTIES = {
+    "model": (
+        int,
+        "Segmentation model",
+        "Segmentation model (0=general, 1=landscape), switchable while "
+        "playing",
+        0,
+        1,
+        DEFAULT_MODEL,
+        GObject.ParamFlags.READWRITE
+    ),
+    "threshold": (
+        float,
+        "Segmentation threshold",
+        "Segmentation  threshold",
+        0.0,
+        1.0,
+        DEFAULT_THRESHOLD,
+        GObject.ParamFlags.READWRITE
+    ),
+    "inference-width": (
+        int,
+        "Inference width",
+        "Width of the frame fed to the model (0=derive from "
+        "inference-height, or use the input width if both are 0)",
+        0,
+        GLib.MAXINT,
+        DEFAULT_INFERENCE_WIDTH,
+        GObject.ParamFlags.READWRITE
+    ),
+    "inference-height": (
+        int,
+        "Inference height",
+        "Height of the frame fed to the model (0=derive from "
+        "inference-width, or use the input height if both are 0)",
+        0,
+        GLib.MAXINT,
+        DEFAULT_INFERENCE_HEIGHT,
+        GObject.ParamFlags.READWRITE
+    ),
+    "interpolation": (
+        int,
+        "Mask interpolation",
+        "Mask upsampling interpolation "
+        "(0=nearest, 1=bilinear, 2=edge-aware)",
+        0,
+        2,
+        DEFAULT_INTERPOLATION,
+        GObject.ParamFlags.READWRITE
+    ),
+    "feather": (
+        float,
+        "Mask feather",
+        "Width of the band around the threshold over which the mask "
+        "ramps from 0 to 255 (0=hard mask)",
+        0.0,
+        1.0,
+        DEFAULT_FEATHER,
+        GObject.ParamFlags.READWRITE
+    ),
+    "smoothing": (
+        float,
+        "Temporal smoothing",
+        "Weight of the previous masks in a running average the model's "
+        "output is folded into, to steady flickering edges (0=off)",
+        0.0,
+        0.99,
+        DEFAULT_SMOOTHING,
+        GObject.ParamFlags.READWRITE
+    ),
+    "hysteresis": (
+        float,
+        "Threshold hysteresis",
+        "Width of the band around the threshold within which pixels keep "
+        "their previous side of it, for hard masks (0=off)",
+        0.0,
+        1.0,
+        DEFAULT_HYSTERESIS,
+        GObject.ParamFlags.READWRITE
+    ),
+    "interval": (
+        int,
+        "Inference interval",
+        "Run the model on every Nth frame and reuse the last mask in "
+        "between",
+        1,
+        GLib.MAXINT,
+        DEFAULT_INTERVAL,
+        GObject.ParamFlags.READWRITE
+    ),
+    "motion-threshold": (
+        float,
+        "Motion threshold",
+        "Run the model before the interval is up when the mean absolute "
+        "difference (0-1) from the last segmented frame reaches this "
+        "(0=disabled)",
+        0.0,
+        1.0,
+        DEFAULT_MOTION_THRESHOLD,
+        GObject.ParamFlags.READWRITE
+    ),
+    "async": (
+        bool,
+        "Asynchronous inference",
+        "Run the model on a background thread and pass frames through "
+        "with the most recent completed mask (takes effect on start)",
+        DEFAULT_ASYNC,
+        GObject.ParamFlags.READWRITE
+    ),
+    "queue-depth": (
+        int,
+        "Queue depth",
+        "Frames waiting for the background inference thread before "
+        "the drop policy applies",
+        1,
+        64,
+        DEFAULT_QUEUE_DEPTH,
+        GObject.ParamFlags.READWRITE
+    ),
+    "drop-policy": (
+        int,
+        "Drop policy",
+        "Frame dropped when the inference queue is full "
+        "(0=oldest, 1=newest)",
+        0,
+        1,
+        DEFAULT_DROP_POLICY,
+        GObject.ParamFlags.READWRITE
+    ),
+    "shared-graph": (
+        bool,
+        "Shared graph",
+        "Share the model's graph with the other elements in the process "
+        "that set this, instead of loading one of their own (takes effect "
+        "on start)",
+        DEFAULT_SHARED_GRAPH,
+        GObject.ParamFlags.READWRITE
+    ),
+    "batch-window": (
+        int,
+        "Batch window",
+        "Milliseconds a frame waits for frames of other elements to be "
+        "run in the same batch with a shared graph (0=only batch frames "
+        "that are waiting already)",
+        0,
+        1000,
+        DEFAULT_BATCH_WINDOW,
+        GObject.ParamFlags.READWRITE
+    ),
+    "max-batch": (
+        int,
+        "Maximum batch size",
+        "Most frames run in one batch with a shared graph",
+        1,
+        64,
+        DEFAULT_MAX_BATCH,
+        GObject.ParamFlags.READWRITE
+    ),
+    "backend": (
+        int,
+        "Segmentation backend",
+        "Engine running the model (0=mediapipe, 1=onnxruntime), "
+        "switchable while playing",
+        0,
+        1,
+        DEFAULT_BACKEND,
+        GObject.ParamFlags.READWRITE
+    ),
+    "onnx-model-dir": (
+        str,
+        "ONNX model directory",
+        "Directory with the onnxruntime backend's models, named after the "
+        "model (general.onnx, landscape.onnx)",
+        DEFAULT_ONNX_MODEL_DIR,
+        GObject.ParamFlags.READWRITE
+    ),
+    "onnx-threads": (
+        int,
+        "ONNX intra-op threads",
+        "Threads onnxruntime runs an operator on (0=one per core)",
+        0,
+        1024,
+        DEFAULT_ONNX_THREADS,
+        GObject.ParamFlags.READWRITE
+    ),
+    "onnx-optimization": (
+        int,
+        "ONNX graph optimization",
+        "onnxruntime graph optimization level "
+        "(0=disabled, 1=basic, 2=extended, 3=all)",
+        0,
+        len(ONNX_OPTIMIZATION_LEVELS) - 1,
+        DEFAULT_ONNX_OPTIMIZATION,
+        GObject.ParamFlags.READWRITE
+    ),
+}
+
+# Properties that change the graph a Segmenter uses.
+GRAPH_PROPERTIES = (
+    "model",
+    "backend",
+    "onnx-model-dir",
+    "onnx-threads",
+    "onnx-optimization",
+)
+
+# GObject property name -> Segmenter attribute
+PROPERTY_ATTRS = {
+    name: "run_async" if name == "async" else name.replace("-", "_")
+    for name in GPROPERTIES
+}
+
+
+class Segmenter:
+
+    def __init__(self):
+        self.model = DEFAULT_MODEL
+        self.threshold = DEFAULT_THRESHOLD
+        self.inference_width = DEFAULT_INFERENCE_WIDTH
+        self.inference_height = DEFAULT_INFERENCE_HEIGHT
+        self.interpolation = DEFAULT_INTERPOLATION
+        self.feather = DEFAULT_FEATHER
+        self.smoothing = DEFAULT_SMOOTHING
+        self.hysteresis = DEFAULT_HYSTERESIS
+        self.interval = DEFAULT_INTERVAL
+        self.motion_threshold = DEFAULT_MOTION_THRESHOLD
+        self.run_async = DEFAULT_ASYNC
+        self.queue_depth = DEFAULT_QUEUE_DEPTH
+        self.drop_policy = DEFAULT_DROP_POLICY
+        self.shared_graph = DEFAULT_SHARED_GRAPH
+        self.batch_window = DEFAULT_BATCH_WINDOW
+        self.max_batch = DEFAULT_MAX_BATCH
+        self.backend = DEFAULT_BACKEND
+        self.onnx_model_dir = DEFAULT_ONNX_MODEL_DIR
+        self.onnx_threads = DEFAULT_ONNX_THREADS
+        self.onnx_optimization = DEFAULT_ONNX_OPTIMIZATION
+
+        # The graph in use (from GRAPH_POOL) and its spec, while started.
+        # The lock keeps a switch from releasing a graph mid inference.
+        self.graph = None
+        self._graph_spec = None
+        self._graph_lock = threading.Lock()
+        self._worker = None
+
+    def get(self, name):
+        return getattr(self, PROPERTY_ATTRS[name])
+
+    def set(self, name, value):
+        attr = PROPERTY_ATTRS[name]
+        old = getattr(self, attr)
+        setattr(self, attr, value)
+
+        if name in GRAPH_PROPERTIES:
+            self.switch_graph(attr, old)
+
+    def graph_spec(self):
+        """
+        Return the GraphSpec of the current model and backend settings.
+        """
+        if self.backend == SegmentationBackend.mediapipe:
+            return GraphSpec(self.backend, self.model)
+
+        return GraphSpec(
+            self.backend,
+            self.model,
+            self.onnx_model_dir,
+            self.onnx_threads,
+            self.onnx_optimization,
+        )
+
+    def switch_graph(self, attr, old):
+        """
+        Switch a started Segmenter to the graph of the current model and
+        backend settings, after attr changed from old.
+
+        Building a graph that isn't preloaded stalls whatever thread builds
+        it, so it's built on a thread of its own and the graph in use keeps
+        segmenting frames until it's ready.
+        """
+        spec = self.graph_spec()
+
+        if self.graph is None or spec == self._graph_spec:
+            return
+
+        threading.Thread(
+            target=self.load_graph,
+            args=(spec, attr, old),
+            daemon=True,
+        ).start()
+
+    def load_graph(self, spec, attr, old):
+        """
+        Acquire the graph of spec and switch to it, unless the settings
+        changed again or the Segmenter stopped meanwhile. If the graph can't
+        be built (e.g. a model file is missing) attr goes back to old and the
+        graph in use is kept.
+        """
+        try:
+            graph = self.acquire_graph(spec)
+        except Exception as e:
+            Gst.error(f"failed to switch to {spec}: {e}")
+            if self.graph_spec() == spec:
+                setattr(self, attr, old)
+            return
+
+        with self._graph_lock:
+            if self.graph is not None and self.graph_spec() == spec:
+                old_graph, old_spec = self.graph, self._graph_spec
+                self.graph, self._graph_spec = graph, spec
+            else:
+                old_graph, old_spec = graph, spec
+
+        release_graph(old_spec, old_graph)
+
+    def acquire_graph(self, spec):
+        if self.shared_graph:
+            return GRAPH_POOL.acquire_shared(spec)
+
+        return GRAPH_POOL.acquire(spec)
+
+    def start(self):
+        self._graph_spec = self.graph_spec()
+        self.graph = self.acquire_graph(self._graph_spec)
+
+        self._hits = 0
+        self._misses = 0
+
+        if self.run_async:
+            self._worker = InferenceWorker(
+                self.infer,
+                self.queue_depth,
+                self.drop_policy,
+            )
+            self._worker.start()
+        else:
+            self._worker = None
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+
+        with self._graph_lock:
+            graph, self.graph = self.graph, None
+
+        if graph is not None:
+            release_graph(self._graph_spec, graph)
+
+    def configure(self, width, height, yuv=False):
+        """
+        Allocate the per-frame buffers for (YUV) frames of the given size.
+        """
+        self.width = width
+        self.height = height
+        self.yuv = yuv
+
+        self._maskbuf = numpy.empty((self.height, self.width), numpy.uint8)
+        self._soft = numpy.empty((self.height, self.width), numpy.float32)
+
+        # Motion is scored on luma alone for YUV frames.
+        mwidth, mheight = MOTION_SIZE
+        tshape = (mheight, mwidth) if yuv else (mheight, mwidth, 3)
+        self._thumb = numpy.empty(tshape, numpy.uint8)
+        self._last_thumb = numpy.empty(tshape, numpy.uint8)
+
+        # _maskbuf holds no valid mask until the next inference
+        self._since_inference = None
+        self._have_mask = False
+
+        self.inference_size = self.get_inference_size()
+        iwidth, iheight = self.inference_size
+
+        # Temporal filter state, updated in place: the running average of the
+        # model's output and which side of the threshold each pixel was on.
+        self._average = numpy.empty((iheight, iwidth), numpy.float32)
+        self._foreground = numpy.empty((self.height, self.width), numpy.bool_)
+        self._above = numpy.empty((self.height, self.width), numpy.bool_)
+        self._have_average = False
+        self._have_foreground = False
+
+        if yuv:
+            self._small = numpy.empty((iheight, iwidth, 3), numpy.uint8)
+            self._small_yuv = numpy.empty(
+                (iheight * 3 // 2, iwidth),
+                numpy.uint8
+            )
+        elif self.inference_size == (self.width, self.height):
+            self._small = None
+        else:
+            self._small = numpy.empty((iheight, iwidth, 3), numpy.uint8)
+
+        if self.inference_size != (self.width, self.height):
+            self._mask = numpy.empty((self.height, self.width), numpy.float32)
+            self._gray = numpy.empty((self.height, self.width), numpy.uint8)
+            self._grayf = numpy.empty((self.height, self.width), numpy.float32)
+            self._a = numpy.empty((self.height, self.width), numpy.float32)
+            self._b = numpy.empty((self.height, self.width), numpy.float32)
+
+            # The guided filter's terms at the inference size, and the luma
+            # of the small frame.
+            self._guided = numpy.empty((8, iheight, iwidth), numpy.float32)
+            self._small_gray = numpy.empty((iheight, iwidth), numpy.uint8)
+
+        Gst.info(
+            f"inference size: {self.inference_size}, "
+            f"frame size: {(self.width, self.height)}"
+        )
+
+    def get_inference_size(self):
+        """
+        Return the (width, height) frames are scaled to before inference.
+
+        A missing dimension is derived from the other one so that the aspect
+        ratio is preserved. Frames are never scaled up. YUV frames are
+        converted at an even size, as 4:2:0 chroma needs.
+        """
+        iwidth = self.inference_width or 0
+        iheight = self.inference_height or 0
+
+        if not iwidth and not iheight:
+            iwidth, iheight = self.width, self.height
+        elif not iwidth:
+            iwidth = round(iheight * self.width / self.height)
+        elif not iheight:
+            iheight = round(iwidth * self.height / self.width)
+
+        iwidth = max(1, min(iwidth, self.width))
+        iheight = max(1, min(iheight, self.height))
+
+        if self.yuv:
+            iwidth = max(2, iwidth - iwidth % 2)
+            iheight = max(2, iheight - iheight % 2)
+
+        return iwidth, iheight
+
+    def segment(self, in_nd):
+        """
+        Run the model on the frame and return a float mask at frame size.
+        """
+        frame = self.inference_frame(in_nd)
+
+        return self.full_size(self.smooth(self.infer(frame)), frame, in_nd)
+
+    def inference_frame(self, in_nd):
+        """
+        Return the frame scaled down to the inference size, in RGB.
+        """
+        if self.yuv:
+            yuv_to_rgb(in_nd, self._small, self._small_yuv)
+            return self._small
+
+        if self._small is None:
+            return in_nd
+
+        cv2.resize(
+            in_nd,
+            self.inference_size,
+            dst=self._small,
+            interpolation=cv2.INTER_AREA
+        )
+
+        return self._small
+
+    def infer(self, frame):
+        """
+        Run the model and return its float mask at the size of frame.
+        """
+        writeable = frame.flags.writeable
+        frame.flags.writeable = False
+        with self._graph_lock:
+            if isinstance(self.graph, SharedGraph):
+                mask = self.graph.process(
+                    frame,
+                    self.batch_window / 1000,
+                    self.max_batch,
+                )
+            else:
+                mask = self.graph.process(frame)
+                self.graph.reset()
+        frame.flags.writeable = writeable
+
+        return mask
+
+    def smooth(self, mask):
+        """
+        Fold the model's float mask into the running average and return the
+        average, or return mask as is without smoothing.
+        """
+        if self.smoothing <= 0:
+            self._have_average = False
+            return mask
+
+        if not self._have_average:
+            numpy.copyto(self._average, mask)
+            self._have_average = True
+        else:
+            cv2.accumulateWeighted(mask, self._average, 1 - self.smoothing)
+
+        return self._average
+
+    def full_size(self, mask, frame, in_nd):
+        """
+        Return the inference mask of frame scaled to the size of in_nd.
+        """
+        if self.inference_size == (self.width, self.height):
+            return mask
+
+        return self.upsample(mask, frame, in_nd)
+
+    def upsample(self, mask, small, in_nd):
+        """
+        Scale the inference mask back up to the frame size.
+        """
+        size = (self.width, self.height)
+
+        if self.interpolation == INTERPOLATION_NEAREST:
+            return cv2.resize(
+                mask,
+                size,
+                dst=self._mask,
+                interpolation=cv2.INTER_NEAREST
+            )
+
+        if self.interpolation == INTERPOLATION_BILINEAR:
+            return cv2.resize(
+                mask,
+                size,
+                dst=self._mask,
+                interpolation=cv2.INTER_LINEAR
+            )
+
+        # Edge-aware: fast guided filter. The linear coefficients are solved
+        # on the small frame and only the final q = a * I + b is evaluated at
+        # full resolution, guided by the luma of the full frame.
+        ksize = (2 * GUIDED_FILTER_RADIUS + 1,) * 2
+
+        guide, mean_i, mean_p, corr_ip, corr_ii, a, b, tmp = self._guided
+
+        cv2.cvtColor(small, cv2.COLOR_RGB2GRAY, dst=self._small_gray)
+        numpy.multiply(self._small_gray, numpy.float32(1 / 255), out=guide)
+
+        cv2.boxFilter(guide, -1, ksize, dst=mean_i)
+        cv2.boxFilter(mask, -1, ksize, dst=mean_p)
+        numpy.multiply(guide, mask, out=tmp)
+        cv2.boxFilter(tmp, -1, ksize, dst=corr_ip)
+        numpy.multiply(guide, guide, out=tmp)
+        cv2.boxFilter(tmp, -1, ksize, dst=corr_ii)
+
+        # var_i = corr_ii - mean_i * mean_i, in corr_ii
+        numpy.multiply(mean_i, mean_i, out=tmp)
+        numpy.subtract(corr_ii, tmp, out=corr_ii)
+        # cov_ip = corr_ip - mean_i * mean_p, in corr_ip
+        numpy.multiply(mean_i, mean_p, out=tmp)
+        numpy.subtract(corr_ip, tmp, out=corr_ip)
+
+        # a = cov_ip / (var_i + eps), b = mean_p - a * mean_i
+        numpy.add(corr_ii, GUIDED_FILTER_EPS, out=corr_ii)
+        numpy.divide(corr_ip, corr_ii, out=a)
+        numpy.multiply(a, mean_i, out=tmp)
+        numpy.subtract(mean_p, tmp, out=b)
+
+        # Fold the uint8 -> [0, 1] scaling of the full resolution guide into a.
+        cv2.boxFilter(a, -1, ksize, dst=tmp)
+        numpy.multiply(tmp, numpy.float32(1 / 255), out=a)
+        cv2.resize(a, size, dst=self._a, interpolation=cv2.INTER_LINEAR)
+
+        cv2.boxFilter(b, -1, ksize, dst=tmp)
+        cv2.resize(tmp, size, dst=self._b, interpolation=cv2.INTER_LINEAR)
+
+        if self.yuv:
+            numpy.copyto(self._grayf, in_nd.y)
+        else:
+            cv2.cvtColor(in_nd, cv2.COLOR_RGB2GRAY, dst=self._gray)
+            numpy.copyto(self._grayf, self._gray)
+
+        cv2.multiply(self._a, self._grayf, dst=self._mask)
+        cv2.add(self._mask, self._b, dst=self._mask)
+
+        return self._mask
+
+    def update_mask(self, in_nd):
+        """
+        Return the uint8 mask for the frame, running the model only when the
+        cached mask is stale.
+        """
+        if self._worker is not None:
+            self.update_mask_async(in_nd)
+        elif self.needs_inference(in_nd):
+            self._misses += 1
+            self._since_inference = 0
+            self.write_mask(self.segment(in_nd), self._maskbuf)
+        else:
+            self._hits += 1
+            self._since_inference += 1
+
+        return self._maskbuf
+
+    def update_mask_async(self, in_nd):
+        if self.needs_inference(in_nd):
+            self._misses += 1
+            self._since_inference = 0
+            # The buffer is unmapped once we return, so the worker gets a copy
+            self._worker.submit(self.inference_frame(in_nd).copy())
+        else:
+            self._hits += 1
+            self._since_inference += 1
+
+        result = self._worker.take_result()
+
+        if result is not None:
+            mask, frame = result
+            self.write_mask(
+                self.full_size(self.smooth(mask), frame, in_nd),
+                self._maskbuf
+            )
+            self._have_mask = True
+        elif not self._have_mask:
+            # Nothing to go on yet, treat everything as foreground
+            self._maskbuf.fill(255)
+            self._have_mask = True
+
+    def needs_inference(self, in_nd):
+        if self._since_inference is None:
+            needed = True
+        elif self._since_inference + 1 >= self.interval:
+            needed = True
+        else:
+            needed = False
+
+        if self.motion_threshold <= 0:
+            return needed
+
+        cv2.resize(
+            in_nd.y if self.yuv else in_nd,
+            MOTION_SIZE,
+            dst=self._thumb,
+            interpolation=cv2.INTER_AREA
+        )
+
+        if not needed:
+            score = cv2.norm(self._thumb, self._last_thumb, cv2.NORM_L1)
+            score /= self._thumb.size * 255
+            needed = score >= self.motion_threshold
+
+        if needed:
+            self._thumb, self._last_thumb = self._last_thumb, self._thumb
+
+        return needed
+
+    @property
+    def frames(self):
+        """
+        Frames seen since start.
+        """
+        return self._hits + self._misses
+
+    def post_stats(self, element):
+        """
+        Post a "selfie-seg-stats" element message every STATS_PERIOD frames.
+        """
+        total = self.frames
+
+        if total % STATS_PERIOD:
+            return
+
+        s = Gst.Structure.new_empty("selfie-seg-stats")
+        s.set_value("hits", self._hits)
+        s.set_value("misses", self._misses)
+        s.set_value("hit-ratio", self._hits / total)
+        if self._worker is not None:
+            s.set_value("dropped", self._worker.dropped)
+
+        shared = self.graph
+        if isinstance(shared, SharedGraph) and shared.batches:
+            s.set_value("mean-batch", shared.frames / shared.batches)
+
+        element.post_message(Gst.Message.new_element(element, s))
+
+    def write_mask(self, segmentation_mask, out_nd):
+        """
+        Write the uint8 mask for the float segmentation mask into out_nd.
+
+        Without feathering this is 255 where the mask is at or above the
+        threshold and 0 elsewhere, or see write_mask_hysteresis() with
+        hysteresis. With feathering it ramps linearly across
+        [threshold - feather / 2, threshold + feather / 2].
+        """
+        if self.feather <= 0 and self.hysteresis > 0:
+            self.write_mask_hysteresis(segmentation_mask, out_nd)
+            return
+
+        # Thresholded without hysteresis, so there's no previous side
+        self._have_foreground = False
+
+        if self.feather <= 0:
+            # 0 or 1 as bool, then 1 -> 255 without any temporaries
+            numpy.greater_equal(
+                segmentation_mask,
+                self.threshold,
+                out=out_nd.view(numpy.bool_)
+            )
+            numpy.negative(out_nd, out=out_nd)
+            return
+
+        scale = 255 / self.feather
+        offset = (self.feather / 2 - self.threshold) * scale
+
+        soft = self._soft
+        numpy.multiply(segmentation_mask, scale, out=soft)
+        numpy.add(soft, offset, out=soft)
+        numpy.clip(soft, 0, 255, out=soft)
+        numpy.copyto(out_nd, soft, casting="unsafe")
+
+    def write_mask_hysteresis(self, segmentation_mask, out_nd):
+        """
+        Write the hard uint8 mask for the float segmentation mask into out_nd,
+        keeping pixels in the foreground until they drop below
+        threshold - hysteresis / 2 and in the background until they reach
+        threshold + hysteresis / 2.
+        """
+        foreground = self._foreground
+        above = self._above
+        half = self.hysteresis / 2
+
+        if not self._have_foreground:
+            numpy.greater_equal(
+                segmentation_mask,
+                self.threshold,
+                out=foreground
+            )
+            self._have_foreground = True
+        else:
+            numpy.greater_equal(
+                segmentation_mask,
+                self.threshold - half,
+                out=above
+            )
+            numpy.logical_and(foreground, above, out=foreground)
+            numpy.greater_equal(
+                segmentation_mask,
+                self.threshold + half,
+                out=above
+            )
+            numpy.logical_or(foreground, above, out=foreground)
+
+        numpy.copyto(out_nd.view(numpy.bool_), foreground)
+        numpy.negative(out_nd, out=out_nd)
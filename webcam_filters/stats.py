@@ -0,0 +1,328 @@
+"""
+Live statistics for a running pipeline.
+
+PipelineStats instruments a pipeline with pad probes to measure how long each
+element spends on a frame, how full each queue is, how many frames are
+dropped or late (from QoS messages), how many bytes of frame data elements
+copy (for elements with a "copied-bytes" property) and the frame rate
+reaching each sink.
+StatsReporter periodically shows them as a table and/or writes them to a
+JSON-lines file.
+"""
+import collections
+import json
+import time
+import typing as t
+import threading
+
+import gi
+
+gi.require_version("Gst", "1.0")
+
+from pathlib import Path
+
+from gi.repository import Gst, GLib
+from rich.live import Live
+from rich.table import Table
+
+
+# Processing times kept per element to compute percentiles over.
+SAMPLES = 300
+
+# Elements that only route buffers, so timing them says nothing useful.
+ROUTING_FACTORIES = {"capsfilter", "queue", "tee"}
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: t.Sequence[float], p: float) -> float:
+    """
+    Return the p-th percentile (0-100) of values.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ElementTimer:
+    """
+    Time buffers from arriving on any sink pad of an element to leaving its
+    src pads, matching them up by pts.
+
+    For aggregators this is the time from the last input of a frame arriving
+    to the output being pushed, i.e. excluding the time spent waiting on the
+    other inputs.
+    """
+
+    def __init__(self, element: Gst.Element):
+        self.element = element
+        self.name = element.get_name()
+        self.frames = 0
+        self.counts_copies = element.find_property("copied-bytes") is not None
+        self._last_frames = 0
+        self._last_copied = 0
+        self.samples: t.Deque[float] = collections.deque(maxlen=SAMPLES)
+        self._arrivals: t.Dict[int, float] = {}
+
+        # Probes of different pads run on different streaming threads, and
+        # snapshot() on the main thread.
+        self._lock = threading.Lock()
+
+        for pad in element.sinkpads:
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.on_sink_buffer)
+
+        for pad in element.srcpads:
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.on_src_buffer)
+
+    def on_sink_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo):
+        pts = info.get_buffer().pts
+
+        if pts != Gst.CLOCK_TIME_NONE:
+            with self._lock:
+                self._arrivals[pts] = time.perf_counter()
+
+                # Frames the element drops never show up on the src pad.
+                if len(self._arrivals) > SAMPLES:
+                    self._arrivals.pop(next(iter(self._arrivals)), None)
+
+        return Gst.PadProbeReturn.OK
+
+    def on_src_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo):
+        with self._lock:
+            start = self._arrivals.pop(info.get_buffer().pts, None)
+
+            if start is not None:
+                self.samples.append((time.perf_counter() - start) * 1000)
+
+            self.frames += 1
+
+        return Gst.PadProbeReturn.OK
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            samples = list(self.samples)
+            frames = self.frames
+
+        result = {"frames": frames}
+        for p in PERCENTILES:
+            result[f"p{p}_ms"] = percentile(samples, p) if samples else None
+
+        # Averaged since the previous snapshot.
+        result["copied_bytes_per_frame"] = None
+        if self.counts_copies:
+            copied = self.element.get_property("copied-bytes")
+            result["copied_bytes_per_frame"] = (
+                (copied - self._last_copied) / max(frames - self._last_frames, 1)
+            )
+            self._last_frames = frames
+            self._last_copied = copied
+
+        return result
+
+
+class PipelineStats:
+    """
+    Collect statistics for every element in a pipeline.
+    """
+
+    def __init__(self, pipeline: Gst.Pipeline):
+        self.timers: t.List[ElementTimer] = []
+        self.queues: t.List[Gst.Element] = []
+        self.qos: t.Dict[str, t.Dict[str, int]] = {}
+        # Frames reaching each sink, by name. Every output of a fan-out gets
+        # the same frames, so they're counted separately rather than summed.
+        self.output_frames: t.Dict[str, int] = {}
+
+        self._last_frames: t.Dict[str, int] = {}
+        self._last_time = time.perf_counter()
+
+        for element in pipeline.iterate_recurse():
+            if isinstance(element, Gst.Bin):
+                continue
+
+            factory = element.get_factory()
+            factory_name = factory.get_name() if factory else ""
+
+            if factory_name == "queue":
+                self.queues.append(element)
+
+            if element.has_flag(Gst.ElementFlags.SINK):
+                self.output_frames[element.get_name()] = 0
+                for pad in element.sinkpads:
+                    pad.add_probe(Gst.PadProbeType.BUFFER, self.on_output)
+
+            elif (
+                factory_name not in ROUTING_FACTORIES and
+                element.sinkpads and
+                element.srcpads
+            ):
+                self.timers.append(ElementTimer(element))
+
+    def on_output(self, pad: Gst.Pad, info: Gst.PadProbeInfo):
+        self.output_frames[pad.get_parent_element().get_name()] += 1
+
+        return Gst.PadProbeReturn.OK
+
+    def on_qos(self, message: Gst.Message) -> None:
+        """
+        Count a QoS message, which an element posts when it drops or renders
+        a late frame.
+        """
+        counts = self.qos.setdefault(
+            message.src.get_name(),
+            {"late": 0, "dropped": 0}
+        )
+
+        jitter, _, _ = message.parse_qos_values()
+        if jitter > 0:
+            counts["late"] += 1
+
+        _, _, dropped = message.parse_qos_stats()
+        if dropped != GLib.MAXUINT64:
+            counts["dropped"] = dropped
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        """
+        Return the current statistics as a JSON serializable dict. The frame
+        rate of each sink is averaged since the previous snapshot.
+        """
+        now = time.perf_counter()
+        elapsed = max(now - self._last_time, 1e-9)
+        frames = dict(self.output_frames)
+        fps = {
+            name: (n - self._last_frames.get(name, 0)) / elapsed
+            for name, n in frames.items()
+        }
+        self._last_frames = frames
+        self._last_time = now
+
+        return {
+            "time": time.time(),
+            "fps": fps,
+            "elements": {x.name: x.snapshot() for x in self.timers},
+            "queues": {
+                q.get_name(): {
+                    "buffers": q.get_property("current-level-buffers"),
+                    "max_buffers": q.get_property("max-size-buffers"),
+                }
+                for q in self.queues
+            },
+            "qos": {name: dict(counts) for name, counts in self.qos.items()},
+        }
+
+
+def stats_table(snapshot: t.Dict[str, t.Any]) -> Table:
+    """
+    Render a snapshot from PipelineStats as a rich Table.
+    """
+    def ms(x):
+        return "-" if x is None else f"{x:.2f}"
+
+    fps = ", ".join(
+        f"{name} {x:.1f} fps" for name, x in snapshot["fps"].items()
+    )
+    table = Table(title=f"Pipeline ({fps})")
+
+    table.add_column("Element")
+    table.add_column("Frames")
+    for p in PERCENTILES:
+        table.add_column(f"p{p} ms")
+    table.add_column("Copied B/frame")
+    table.add_column("Queued")
+    table.add_column("Late")
+    table.add_column("Dropped")
+
+    names = list(snapshot["elements"])
+    names += [x for x in snapshot["queues"] if x not in names]
+    names += [x for x in snapshot["qos"] if x not in names]
+
+    for name in names:
+        element = snapshot["elements"].get(name)
+        queue = snapshot["queues"].get(name)
+        qos = snapshot["qos"].get(name, {})
+
+        table.add_row(
+            name,
+            str(element["frames"]) if element else "-",
+            *(
+                ms(element[f"p{p}_ms"]) if element else "-"
+                for p in PERCENTILES
+            ),
+            (
+                f"{element['copied_bytes_per_frame']:.0f}"
+                if element and element["copied_bytes_per_frame"] is not None
+                else "-"
+            ),
+            f"{queue['buffers']}/{queue['max_buffers']}" if queue else "-",
+            str(qos.get("late", "-")),
+            str(qos.get("dropped", "-")),
+        )
+
+    return table
+
+
+class StatsReporter:
+    """
+    Report PipelineStats every interval seconds while the main loop runs,
+    as a live table when show is set and as JSON lines when path is set.
+    """
+
+    def __init__(
+        self,
+        pipeline: Gst.Pipeline,
+        interval: float,
+        show: bool,
+        path: t.Optional[Path],
+    ):
+        self.stats = PipelineStats(pipeline)
+        self.interval = interval
+        self.bus = pipeline.get_bus()
+
+        self._live = Live(auto_refresh=False) if show else None
+        self._file = open(path, "w") if path is not None else None
+        self._handlers: t.List[int] = []
+        self._timeout: t.Optional[int] = None
+
+    def start(self) -> None:
+        """
+        Start reporting. The bus must already have a signal watch.
+        """
+        self._handlers.append(
+            self.bus.connect("message::qos", self.on_qos_message)
+        )
+        self._timeout = GLib.timeout_add(
+            int(self.interval * 1000),
+            self.report
+        )
+
+        if self._live is not None:
+            self._live.start()
+
+    def stop(self) -> None:
+        if self._timeout is not None:
+            GLib.source_remove(self._timeout)
+            self._timeout = None
+
+        for handler in self._handlers:
+            self.bus.disconnect(handler)
+        self._handlers = []
+
+        if self._live is not None:
+            self._live.stop()
+
+        if self._file is not None:
+            self._file.close()
+
+    def on_qos_message(self, bus: Gst.Bus, message: Gst.Message) -> None:
+        self.stats.on_qos(message)
+
+    def report(self) -> bool:
+        snapshot = self.stats.snapshot()
+
+        if self._live is not None:
+            self._live.update(stats_table(snapshot), refresh=True)
+
+        if self._file is not None:
+            self._file.write(json.dumps(snapshot) + "\n")
+            self._file.flush()
+
+        return True
@@ -0,0 +1,80 @@
+"""
+Tiled execution of frame operations on a thread pool.
+
+Frames are split into horizontal bands of whole rows which are processed
+concurrently. cv2 and numpy release the GIL in their inner loops, so bands
+really do run in parallel.
+"""
+import typing as t
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_N_THREADS = 1
+MAX_N_THREADS = 64
+
+# Bands shorter than this aren't worth handing to another thread.
+MIN_BAND_ROWS = 32
+
+
+def split_rows(height: int, n: int) -> t.List[t.Tuple[int, int]]:
+    """
+    Split height rows into at most n (top, bottom) bands of near equal size.
+    """
+    n = max(1, min(n, height // MIN_BAND_ROWS))
+    edges = [height * i // n for i in range(n + 1)]
+
+    return list(zip(edges[:-1], edges[1:]))
+
+
+class Tiler:
+    """
+    Run a function over the bands of a frame on a pool of n_threads threads.
+
+    With a single thread the function is called directly on the streaming
+    thread and no pool is created.
+    """
+
+    def __init__(self, n_threads: int = DEFAULT_N_THREADS):
+        self.n_threads = n_threads
+        self._pool = None
+        self._pool_size = 0
+
+    def map(
+        self,
+        fn: t.Callable[[int, int, int], t.Any],
+        height: int,
+    ) -> t.List[t.Any]:
+        """
+        Call fn(index, top, bottom) for every band of height rows and return
+        the results in band order once all of them are done.
+        """
+        bands = split_rows(height, self.n_threads)
+
+        if len(bands) == 1:
+            return [fn(0, *bands[0])]
+
+        pool = self.get_pool()
+        futures = [
+            pool.submit(fn, i, top, bottom)
+            for i, (top, bottom) in enumerate(bands)
+        ]
+
+        return [f.result() for f in futures]
+
+    def get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None or self._pool_size != self.n_threads:
+            self.stop()
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.n_threads,
+                thread_name_prefix="tile",
+            )
+            self._pool_size = self.n_threads
+
+        return self._pool
+
+    def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            self._pool_size = 0
@@ -0,0 +1,84 @@
+"""
+Direct queries of V4L2 devices via ioctl, for what GStreamer doesn't expose
+before a device is streaming.
+"""
+import os
+import errno
+import fcntl
+import struct
+
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_BUF_TYPE_VIDEO_OUTPUT = 2
+
+V4L2_MEMORY_MMAP = 1
+V4L2_MEMORY_USERPTR = 2
+V4L2_MEMORY_DMABUF = 4
+
+# struct v4l2_requestbuffers {
+#   __u32 count; __u32 type; __u32 memory; __u32 capabilities;
+#   __u8 flags; __u8 reserved[3];
+# }
+REQUESTBUFFERS = struct.Struct("IIII4x")
+
+# _IOWR('V', 8, struct v4l2_requestbuffers)
+VIDIOC_REQBUFS = 0xC0000000 | (REQUESTBUFFERS.size << 16) | (ord("V") << 8) | 8
+
+# struct v4l2_capability {
+#   __u8 driver[16]; __u8 card[32]; __u8 bus_info[32]; __u32 version;
+#   __u32 capabilities; __u32 device_caps; __u32 reserved[3];
+# }
+CAPABILITY = struct.Struct("16s32s32sIII12x")
+
+# _IOR('V', 0, struct v4l2_capability)
+VIDIOC_QUERYCAP = 0x80000000 | (CAPABILITY.size << 16) | (ord("V") << 8) | 0
+
+
+def supports_memory(device: str, output: bool, memory: int) -> bool:
+    """
+    Return whether the capture (or output) queue of device supports
+    buffers of the given V4L2_MEMORY_* type.
+
+    Requesting zero buffers allocates nothing, but fails with EINVAL if the
+    memory type is unsupported.
+    """
+    buf_type = V4L2_BUF_TYPE_VIDEO_OUTPUT if output else V4L2_BUF_TYPE_VIDEO_CAPTURE
+    req = bytearray(REQUESTBUFFERS.pack(0, buf_type, memory, 0))
+
+    fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        fcntl.ioctl(fd, VIDIOC_REQBUFS, req)
+    except OSError as e:
+        if e.errno in {errno.EINVAL, errno.ENOTTY}:
+            return False
+        raise
+    finally:
+        os.close(fd)
+
+    return True
+
+
+def device_fingerprint(device: str) -> str:
+    """
+    Return a string identifying the device currently behind a path: its
+    driver, card name, bus (e.g. the USB port) and driver version.
+
+    Raises OSError if device can't be opened or isn't a V4L2 device.
+    """
+    cap = bytearray(CAPABILITY.size)
+
+    fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, cap)
+    finally:
+        os.close(fd)
+
+    driver, card, bus_info, version, _, device_caps = CAPABILITY.unpack(cap)
+
+    return "/".join([
+        driver.rstrip(b"\0").decode(errors="replace"),
+        card.rstrip(b"\0").decode(errors="replace"),
+        bus_info.rstrip(b"\0").decode(errors="replace"),
+        f"{version:x}",
+        f"{device_caps:x}",
+    ])
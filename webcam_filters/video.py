@@ -0,0 +1,148 @@
+"""
+Numpy views of raw video frames.
+
+The Python elements handle packed RGB, GRAY8 masks and planar YUV 4:2:0
+(I420 and NV12). Planes are laid out the way GStreamer lays out buffers
+without a video meta: rows padded to 4 bytes and chroma planes of
+ceil(width / 2) x ceil(height / 2).
+"""
+import typing as t
+
+import numpy
+
+from .image import YUVFrame
+
+
+RGB_FORMAT = "RGB"
+MASK_FORMAT = "GRAY8"
+YUV_FORMATS = ("I420", "NV12")
+
+# Frame formats the filters work on natively.
+FRAME_FORMATS = (RGB_FORMAT,) + YUV_FORMATS
+
+
+class VideoLayout(t.NamedTuple):
+    format: str
+    width: int
+    height: int
+    offsets: t.Tuple[int, ...]
+    strides: t.Tuple[int, ...]
+    size: int
+
+
+def round_up(x: int, n: int) -> int:
+    return (x + n - 1) // n * n
+
+
+def caps_list(formats: t.Sequence[str]) -> str:
+    """
+    Return formats as a caps string list (e.g. "{ RGB, I420 }").
+    """
+    return "{ " + ", ".join(formats) + " }"
+
+
+def video_layout(format_: str, width: int, height: int) -> VideoLayout:
+    """
+    Return the plane offsets, strides and total size of a frame.
+    """
+    if format_ == RGB_FORMAT:
+        stride = round_up(width * 3, 4)
+        return VideoLayout(format_, width, height, (0,), (stride,), stride * height)
+
+    if format_ == MASK_FORMAT:
+        stride = round_up(width, 4)
+        return VideoLayout(format_, width, height, (0,), (stride,), stride * height)
+
+    luma_stride = round_up(width, 4)
+    luma_size = luma_stride * round_up(height, 2)
+    chroma_rows = round_up(height, 2) // 2
+
+    if format_ == "I420":
+        chroma_stride = round_up(round_up(width, 2) // 2, 4)
+        chroma_size = chroma_stride * chroma_rows
+        return VideoLayout(
+            format_,
+            width,
+            height,
+            (0, luma_size, luma_size + chroma_size),
+            (luma_stride, chroma_stride, chroma_stride),
+            luma_size + 2 * chroma_size,
+        )
+
+    if format_ == "NV12":
+        return VideoLayout(
+            format_,
+            width,
+            height,
+            (0, luma_size),
+            (luma_stride, luma_stride),
+            luma_size + luma_stride * chroma_rows,
+        )
+
+    raise ValueError(f"unsupported format {format_!r}")
+
+
+def caps_layout(caps) -> VideoLayout:
+    """
+    Return the layout of frames with the given fixed Gst.Caps.
+    """
+    s = caps.get_structure(0)
+
+    return video_layout(
+        s.get_string("format"),
+        s.get_int("width").value,
+        s.get_int("height").value,
+    )
+
+
+def frame_view(
+    data,
+    layout: VideoLayout,
+) -> t.Union[numpy.ndarray, YUVFrame]:
+    """
+    Return a view of the frame in data (e.g. a mapped buffer).
+
+    RGB frames are HxWx3 arrays, GRAY8 masks HxW arrays and YUV frames are
+    returned as a YUVFrame of their planes.
+    """
+    width = layout.width
+    height = layout.height
+
+    def plane(i, shape, pixel_strides=()):
+        return numpy.ndarray(
+            shape=shape,
+            dtype=numpy.uint8,
+            buffer=data,
+            offset=layout.offsets[i],
+            strides=(layout.strides[i],) + pixel_strides,
+        )
+
+    if layout.format == RGB_FORMAT:
+        return plane(0, (height, width, 3), (3, 1))
+
+    if layout.format == MASK_FORMAT:
+        return plane(0, (height, width), (1,))
+
+    y = plane(0, (height, width), (1,))
+    chroma = ((height + 1) // 2, (width + 1) // 2)
+
+    if layout.format == "I420":
+        return YUVFrame(
+            y,
+            plane(1, chroma, (1,)),
+            plane(2, chroma, (1,)),
+        )
+
+    return YUVFrame(y, plane(1, chroma + (2,), (2, 1)), None)
+
+
+def mask_view(data, layout: VideoLayout) -> numpy.ndarray:
+    """
+    Return an HxWx1 view of the first channel of a GRAY8 or RGB mask.
+    """
+    mask = frame_view(data, layout)
+
+    if mask.ndim == 2:
+        return mask[..., None]
+
+    return mask[..., :1]